@@ -0,0 +1,256 @@
+import collections as _collections
+import hashlib as _hashlib
+import math as _math
+import os as _os
+import threading as _threading
+import time as _time
+
+# به ترتیب اولویت؛ پلن‌های تجاری اول، بعد استارتر، بعد ترافیک بدون کلید (/prices)
+PRIORITY_CLASSES = ("business", "starter", "anonymous")
+
+
+def priority_for_plan(plan_slug: str | None) -> str:
+    return "business" if (plan_slug or "").endswith("-business") else "starter"
+
+
+class _Waiter:
+    __slots__ = ("event", "granted", "shed")
+
+    def __init__(self):
+        self.event = _threading.Event()
+        self.granted = False
+        self.shed = False
+
+
+class AdmissionController:
+    """Bounded in-flight request budget with priority queues and queue deadlines.
+
+    At most ``max_in_flight`` requests run at once. Others wait in one FIFO
+    queue per priority class for at most that class's ``queue_timeouts``
+    entry; a freed slot always goes to the oldest waiter of the highest
+    class. When ``max_queue`` requests are already waiting, a new request
+    displaces the newest waiter of a lower class, or is rejected outright
+    if there is none. Rejected requests should get ``503`` + ``Retry-After``.
+
+    The class of a request comes from its API key's plan, remembered from
+    earlier authenticated requests so admission itself never touches the
+    database; keys not seen yet count as ``starter``, and so do dashboard
+    requests that carry a Bearer token instead of a key.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_in_flight: int = 64,
+        max_queue: int = 256,
+        queue_timeouts: dict | None = None,
+        retry_after: int = 2,
+        known_keys: int = 10_000,
+    ):
+        self.max_in_flight = int(max_in_flight)
+        self.max_queue = int(max_queue)
+        self.queue_timeouts = {"business": 2.0, "starter": 1.0, "anonymous": 0.25, **(queue_timeouts or {})}
+        self.retry_after = int(retry_after)
+        self._known_keys = int(known_keys)
+        self._lock = _threading.Lock()
+        self._in_flight = 0
+        self._queues = {name: _collections.deque() for name in PRIORITY_CLASSES}
+        self._key_classes = _collections.OrderedDict()
+        self._stats = {name: _collections.Counter() for name in PRIORITY_CLASSES}
+
+    @classmethod
+    def from_env(cls) -> "AdmissionController | None":
+        max_in_flight = int(_os.environ.get("ADMISSION_MAX_IN_FLIGHT", "64"))
+        if max_in_flight <= 0:
+            return None
+        return cls(
+            max_in_flight=max_in_flight,
+            max_queue=int(_os.environ.get("ADMISSION_MAX_QUEUE", "256")),
+            queue_timeouts={
+                name: float(_os.environ[f"ADMISSION_QUEUE_TIMEOUT_{name.upper()}"])
+                for name in PRIORITY_CLASSES
+                if f"ADMISSION_QUEUE_TIMEOUT_{name.upper()}" in _os.environ
+            },
+            retry_after=int(_os.environ.get("ADMISSION_RETRY_AFTER", "2")),
+        )
+
+    @staticmethod
+    def _digest(api_key: str) -> bytes:
+        return _hashlib.blake2b(api_key.encode("utf-8"), digest_size=16).digest()
+
+    def classify(self, api_key: str | None, bearer: bool = False) -> str:
+        if not api_key:
+            # JWT داشبورد (/me/*) مال مشتری ثبت‌نام‌شده است و نباید هم‌ردیف /prices بدون کلید اول دور ریخته شود
+            return "starter" if bearer else "anonymous"
+        with self._lock:
+            return self._key_classes.get(self._digest(api_key), "starter")
+
+    def remember(self, api_key: str, plan_slug: str | None) -> None:
+        digest = self._digest(api_key)
+        with self._lock:
+            self._key_classes[digest] = priority_for_plan(plan_slug)
+            self._key_classes.move_to_end(digest)
+            while len(self._key_classes) > self._known_keys:
+                self._key_classes.popitem(last=False)
+
+    def _queued(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    def _shed_lower(self, priority: str) -> bool:
+        rank = PRIORITY_CLASSES.index(priority)
+        for name in reversed(PRIORITY_CLASSES[rank + 1:]):
+            if self._queues[name]:
+                waiter = self._queues[name].pop()
+                waiter.shed = True
+                waiter.event.set()
+                return True
+        return False
+
+    def acquire(self, priority: str) -> bool:
+        """Take an in-flight slot, waiting up to the class deadline; False means reject."""
+        stats = self._stats[priority]
+        with self._lock:
+            if self._in_flight < self.max_in_flight and not self._queued():
+                self._in_flight += 1
+                stats["admitted"] += 1
+                return True
+            if self._queued() >= self.max_queue and not self._shed_lower(priority):
+                stats["rejected"] += 1
+                return False
+            waiter = _Waiter()
+            self._queues[priority].append(waiter)
+
+        started = _time.monotonic()
+        waiter.event.wait(self.queue_timeouts[priority])
+        with self._lock:
+            stats["queue_ms"] += int((_time.monotonic() - started) * 1000)
+            if waiter.granted:
+                stats["admitted"] += 1
+                stats["queued"] += 1
+                return True
+            if not waiter.shed:
+                self._queues[priority].remove(waiter)
+            stats["shed" if waiter.shed else "timed_out"] += 1
+            return False
+
+    def release(self) -> None:
+        with self._lock:
+            for name in PRIORITY_CLASSES:
+                if self._queues[name]:
+                    # ظرفیت مستقیم به منتظر بعدی منتقل می‌شود
+                    waiter = self._queues[name].popleft()
+                    waiter.granted = True
+                    waiter.event.set()
+                    return
+            self._in_flight -= 1
+
+    def retry_after_seconds(self, priority: str) -> int:
+        return max(self.retry_after, _math.ceil(self.queue_timeouts[priority]))
+
+    def state(self) -> dict:
+        with self._lock:
+            return {
+                "in_flight": self._in_flight,
+                "max_in_flight": self.max_in_flight,
+                "queued": {name: len(q) for name, q in self._queues.items()},
+                "classes": {name: dict(counter) for name, counter in self._stats.items()},
+            }
+
+
+class MeteringGovernor:
+    """Detects a saturated usage database and switches metering to deferred counts.
+
+    Callers wrap each metering write in ``begin_write()`` / ``end_write()``.
+    If more than ``max_writers`` threads are already waiting on the SQLite
+    write lock, or a write took longer than ``slow_ms`` or failed with
+    "database is locked" after ``busy_timeout_ms``, the governor goes
+    degraded for ``hold`` seconds: ``begin_write()`` returns False and the
+    caller records the request with ``defer()`` instead of writing. Deferred counts are handed back by
+    ``drain()`` once the database is healthy again, to be added in one batch.
+    While degraded the caller checks quotas against the last known usage
+    plus deferred requests instead of the database.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_writers: int = 8,
+        slow_ms: float = 250.0,
+        hold: float = 5.0,
+        busy_timeout_ms: int = 1000,
+        clock=_time.monotonic,
+    ):
+        self.max_writers = int(max_writers)
+        self.busy_timeout_ms = int(busy_timeout_ms)
+        self.slow_ms = float(slow_ms)
+        self.hold = float(hold)
+        self._clock = clock
+        self._lock = _threading.Lock()
+        self._writers = 0
+        self._degraded_until = 0.0
+        self._deferred = _collections.Counter()
+        self._stats = _collections.Counter()
+
+    @classmethod
+    def from_env(cls) -> "MeteringGovernor":
+        return cls(
+            max_writers=int(_os.environ.get("METERING_MAX_WRITERS", "8")),
+            slow_ms=float(_os.environ.get("METERING_SLOW_MS", "250")),
+            hold=float(_os.environ.get("METERING_DEGRADED_HOLD", "5")),
+            busy_timeout_ms=int(_os.environ.get("METERING_BUSY_TIMEOUT_MS", "1000")),
+        )
+
+    @property
+    def degraded(self) -> bool:
+        return self._clock() < self._degraded_until
+
+    def _degrade(self, reason: str) -> None:
+        if not self.degraded:
+            self._stats[f"entered_{reason}"] += 1
+        self._degraded_until = self._clock() + self.hold
+
+    def begin_write(self) -> bool:
+        with self._lock:
+            if self.degraded:
+                return False
+            if self._writers >= self.max_writers:
+                self._degrade("writers")
+                return False
+            self._writers += 1
+            return True
+
+    def end_write(self, elapsed_s: float, failed: bool = False) -> None:
+        with self._lock:
+            self._writers -= 1
+            if failed:
+                self._degrade("locked")
+            elif elapsed_s * 1000 > self.slow_ms:
+                self._degrade("slow")
+
+    def defer(self, api_key_id: int, month: str) -> None:
+        with self._lock:
+            self._deferred[(api_key_id, month)] += 1
+            self._stats["deferred"] += 1
+
+    def drain(self) -> list:
+        """Take the deferred ``(count, api_key_id, month)`` rows if there are any."""
+        with self._lock:
+            if not self._deferred:
+                return []
+            rows = [(count, api_key_id, month) for (api_key_id, month), count in self._deferred.items()]
+            self._deferred.clear()
+            return rows
+
+    def restore(self, rows) -> None:
+        with self._lock:
+            for count, api_key_id, month in rows:
+                self._deferred[(api_key_id, month)] += count
+
+    def state(self) -> dict:
+        with self._lock:
+            return {
+                "degraded": self.degraded,
+                "writers": self._writers,
+                "pending": sum(self._deferred.values()),
+                **self._stats,
+            }
@@ -0,0 +1,271 @@
+import bisect as _bisect
+import sqlite3 as _sqlite3
+import threading as _threading
+import time as _time
+
+# above/below/cross: عبور از یک قیمت ثابت؛ move_pct: تغییر بیشتر از درصد مشخص نسبت به قیمت مرجع
+ALERT_KINDS = ("above", "below", "cross", "move_pct")
+
+
+def parse_price(value) -> float | None:
+    if value is None:
+        return None
+    try:
+        return float(str(value).replace(",", "").strip())
+    except ValueError:
+        return None
+
+
+class _SymbolIndex:
+    """Thresholds of one symbol kept sorted, with the owning rule id alongside."""
+
+    __slots__ = ("keys", "ids")
+
+    def __init__(self):
+        self.keys = []
+        self.ids = []
+
+    def add(self, threshold: float, rule_id: int) -> None:
+        pos = _bisect.bisect_right(self.keys, threshold)
+        self.keys.insert(pos, threshold)
+        self.ids.insert(pos, rule_id)
+
+    def remove(self, threshold: float, rule_id: int) -> None:
+        lo = _bisect.bisect_left(self.keys, threshold)
+        hi = _bisect.bisect_right(self.keys, threshold)
+        for pos in range(lo, hi):
+            if self.ids[pos] == rule_id:
+                del self.keys[pos]
+                del self.ids[pos]
+                return
+
+    def crossed(self, old: float, new: float):
+        """Rule ids whose threshold lies between ``old`` (exclusive) and ``new`` (inclusive)."""
+        if new > old:
+            lo = _bisect.bisect_right(self.keys, old)
+            hi = _bisect.bisect_right(self.keys, new)
+        else:
+            lo = _bisect.bisect_left(self.keys, new)
+            hi = _bisect.bisect_left(self.keys, old)
+        return zip(self.keys[lo:hi], self.ids[lo:hi])
+
+
+class AlertIndex:
+    """Per-symbol sorted threshold index.
+
+    Every rule is reduced to one or two absolute thresholds (a ``move_pct``
+    rule becomes ``reference * (1 ± pct)``), so evaluating a price move from
+    ``old`` to ``new`` is two bisects plus the rules actually crossed,
+    independent of how many rules exist.
+    """
+
+    def __init__(self):
+        self._symbols = {}
+        self._rules = {}
+
+    def __len__(self) -> int:
+        return len(self._rules)
+
+    @staticmethod
+    def _thresholds(rule: dict) -> list:
+        if rule["kind"] != "move_pct":
+            return [rule["value"]]
+        reference = rule.get("reference")
+        if not reference:
+            return []
+        delta = abs(reference) * rule["value"] / 100.0
+        return [reference - delta, reference + delta]
+
+    def add(self, rule: dict) -> None:
+        self.remove(rule["id"])
+        self._rules[rule["id"]] = rule
+        index = self._symbols.setdefault(rule["symbol"], _SymbolIndex())
+        for threshold in self._thresholds(rule):
+            index.add(threshold, rule["id"])
+
+    def remove(self, rule_id: int) -> None:
+        rule = self._rules.pop(rule_id, None)
+        if rule is None:
+            return
+        index = self._symbols.get(rule["symbol"])
+        for threshold in self._thresholds(rule):
+            index.remove(threshold, rule_id)
+
+    def load(self, rules) -> None:
+        """Bulk-build: one sort per symbol instead of one insert per rule."""
+        pending = {}
+        for rule in rules:
+            self._rules[rule["id"]] = rule
+            for threshold in self._thresholds(rule):
+                pending.setdefault(rule["symbol"], []).append((threshold, rule["id"]))
+        for symbol, pairs in pending.items():
+            index = self._symbols.setdefault(symbol, _SymbolIndex())
+            pairs.extend(zip(index.keys, index.ids))
+            pairs.sort()
+            index.keys = [p[0] for p in pairs]
+            index.ids = [p[1] for p in pairs]
+
+    def rule(self, rule_id: int) -> dict | None:
+        return self._rules.get(rule_id)
+
+    def rearm(self, pairs) -> None:
+        """Move ``move_pct`` rules to new references, given ``(rule_id, reference)`` pairs.
+
+        Symbols where a large share of rules moved are rebuilt with a single
+        sort instead of one list insert/delete per rule.
+        """
+        by_symbol = {}
+        for rule_id, reference in pairs:
+            rule = self._rules.get(rule_id)
+            if rule is not None and rule["kind"] == "move_pct":
+                by_symbol.setdefault(rule["symbol"], []).append({**rule, "reference": reference})
+        for symbol, rules in by_symbol.items():
+            # نمادی که فقط قانون move_pct بدون مرجع داشته (مسیر load) هنوز ایندکس ندارد
+            index = self._symbols.setdefault(symbol, _SymbolIndex())
+            if len(rules) * 8 < len(index.keys):
+                for rule in rules:
+                    self.add(rule)
+                continue
+            moved = {rule["id"] for rule in rules}
+            merged = [(k, i) for k, i in zip(index.keys, index.ids) if i not in moved]
+            for rule in rules:
+                self._rules[rule["id"]] = rule
+                merged.extend((threshold, rule["id"]) for threshold in self._thresholds(rule))
+            merged.sort()
+            index.keys = [p[0] for p in merged]
+            index.ids = [p[1] for p in merged]
+
+    def evaluate(self, symbol: str, old: float, new: float) -> list:
+        """Return ``(rule, threshold, direction)`` for every rule crossed by ``old -> new``."""
+        index = self._symbols.get(symbol)
+        if index is None or old == new:
+            return []
+        direction = "up" if new > old else "down"
+        fired = []
+        seen = set()
+        for threshold, rule_id in index.crossed(old, new):
+            rule = self._rules[rule_id]
+            kind = rule["kind"]
+            if (kind == "above" and direction != "up") or (kind == "below" and direction != "down"):
+                continue
+            if rule_id in seen:
+                continue
+            seen.add(rule_id)
+            fired.append((rule, threshold, direction))
+        return fired
+
+
+class AlertEngine:
+    """Keeps an AlertIndex in sync with the ``alerts`` table and records firings.
+
+    Rules are pulled incrementally by their ``rev`` column, so rules created or
+    deleted by any API worker reach the scraper process on the next snapshot.
+    Fired alerts are written to ``alert_events``; that table is the delivery
+    queue. Consumers drain it with the pollable endpoint's ``since`` cursor
+    (ids only grow, so nothing is missed across restarts or API workers), and
+    ``evaluate`` also returns each batch to its caller.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.index = AlertIndex()
+        self._rev = 0
+        self._lock = _threading.Lock()
+        self._last_values = {}
+        self._unarmed = {}
+
+    def _connect(self) -> _sqlite3.Connection:
+        db = _sqlite3.connect(self.db_path, timeout=30)
+        db.row_factory = _sqlite3.Row
+        return db
+
+    def sync(self, db: _sqlite3.Connection) -> None:
+        rows = db.execute(
+            "SELECT id, api_key_id, symbol, kind, value, reference, active, rev FROM alerts WHERE rev > ? ORDER BY rev;",
+            (self._rev,),
+        ).fetchall()
+        if not rows:
+            return
+        fresh = []
+        for r in rows:
+            self._rev = max(self._rev, int(r["rev"]))
+            self.index.remove(int(r["id"]))
+            self._unarmed.get(r["symbol"], {}).pop(int(r["id"]), None)
+            if not int(r["active"]):
+                continue
+            reference = r["reference"]
+            if r["kind"] == "move_pct" and reference is None:
+                reference = self._last_values.get(r["symbol"])
+                if reference is None:
+                    # قیمت مرجع هنوز معلوم نیست؛ با اولین قیمت این نماد مسلح می‌شود
+                    self._unarmed.setdefault(r["symbol"], {})[int(r["id"])] = True
+            fresh.append({
+                "id": int(r["id"]),
+                "api_key_id": int(r["api_key_id"]),
+                "symbol": r["symbol"],
+                "kind": r["kind"],
+                "value": float(r["value"]),
+                "reference": reference,
+            })
+        if len(fresh) > 1000:
+            self.index.load(fresh)
+        else:
+            for rule in fresh:
+                self.index.add(rule)
+
+    def evaluate(self, previous: dict, current: dict) -> list:
+        """Evaluate one snapshot transition; returns the fired events."""
+        with self._lock:
+            db = self._connect()
+            try:
+                self.sync(db)
+                events = []
+                rearm = []
+                now = _time.strftime("%Y-%m-%dT%H:%M:%SZ", _time.gmtime())
+                for symbol, raw in current.items():
+                    new = parse_price(raw)
+                    if new is None:
+                        continue
+                    old = parse_price(previous.get(symbol))
+                    self._last_values[symbol] = new
+                    for rule_id in self._unarmed.pop(symbol, {}):
+                        rearm.append((rule_id, new))
+                    if old is None:
+                        continue
+                    for rule, threshold, direction in self.index.evaluate(symbol, old, new):
+                        events.append({
+                            "alert_id": rule["id"],
+                            "api_key_id": rule["api_key_id"],
+                            "symbol": symbol,
+                            "kind": rule["kind"],
+                            "direction": direction,
+                            "threshold": threshold,
+                            "previous_value": old,
+                            "value": new,
+                            "fired_at": now,
+                        })
+                        if rule["kind"] == "move_pct":
+                            rearm.append((rule["id"], new))
+                # اول رویدادها ثبت می‌شوند تا خطای مسلح‌کردن دوباره، شلیک‌های این snapshot را از بین نبرد
+                try:
+                    if events:
+                        self._record(db, events, rearm)
+                finally:
+                    self.index.rearm(rearm)
+            finally:
+                db.close()
+        return events
+
+    @staticmethod
+    def _record(db: _sqlite3.Connection, events: list, rearm: list) -> None:
+        db.execute("BEGIN IMMEDIATE;")
+        db.executemany(
+            """
+            INSERT INTO alert_events (alert_id, api_key_id, symbol, direction, threshold, previous_value, value, fired_at)
+            VALUES (:alert_id, :api_key_id, :symbol, :direction, :threshold, :previous_value, :value, :fired_at);
+            """,
+            events,
+        )
+        # مرجع جدید move_pct بدون تغییر rev ذخیره می‌شود تا بعد از ری‌استارت دوباره شلیک نکند
+        db.executemany("UPDATE alerts SET reference = ? WHERE id = ?;", [(ref, rule_id) for rule_id, ref in rearm])
+        db.commit()
@@ -1,18 +1,46 @@
+import atexit as _atexit
 import datetime as _dt
 import hashlib as _hashlib
 import hmac as _hmac
 import logging as _logging
+import math as _math
 import os as _os
 import secrets as _secrets
 import sqlite3 as _sqlite3
+import threading as _threading
+import time as _time
 
-import jwt as _jwt
 from flask import Blueprint, current_app, g, jsonify, request, has_request_context
 
-try:
-    from supabase import create_client as _create_supabase_client
-except Exception:  # pragma: no cover - optional dependency
-    _create_supabase_client = None
+from admission import MeteringGovernor
+from alerts import ALERT_KINDS
+from archival import archived_keys, archived_usage, default_archive_path
+from dashboard_cache import CustomerKeysCache, UsageCounters, VerifiedTokenCache
+from quota_lease import QuotaLeaseManager
+from scraper import symbols_for_scope
+from webhooks import WebhookURLError, private_addresses_allowed, resolve_webhook_url
+
+# jwt and supabase are imported on first use so API workers that never see a
+# /me/* request or run without Supabase sync do not pay for them at startup.
+_SUPABASE_IMPORT_FAILED = False
+
+# Set by init_api_manager when QUOTA_LEASE_ENABLED=1; see quota_lease.py.
+_QUOTA_LEASES = None
+
+# Switches metering to deferred in-memory counts while the usage DB is saturated; see admission.py.
+_METERING = MeteringGovernor.from_env()
+# While set (inside _meter_request), usage syncs to Supabase are collected here and sent after
+# the SQLite write is timed, so a slow billing sync is not mistaken for a saturated database.
+_DEFERRED_SYNC = _threading.local()
+
+# Dashboard (/me/*) reads: verified JWTs until exp, /me/keys rows per user, and the
+# latest usage counts seen by metering so cached rows do not need a usage query.
+_JWT_CACHE = VerifiedTokenCache()
+_ME_KEYS = CustomerKeysCache(ttl=float(_os.environ.get("ME_KEYS_CACHE_TTL", "30")))
+_USAGE = UsageCounters()
+
+# Bump when init_db gains tables/columns; databases at this version skip the DDL on boot.
+_SCHEMA_VERSION = 3
 
 bp = Blueprint("api_manager", __name__)
 
@@ -30,10 +58,13 @@ DEFAULT_PLANS = [
     {"slug": "gold-business", "scope": "gold", "name": "API طلا - تجاری", "monthly_quota": 100_000, "rpm_limit": 300, "price_irr": 0, "active": 1},
 ]
 ADDON_EXTRA_REQUESTS = 5_000  # تعداد ریکوئست هر بسته افزودنی
+MAX_WEBHOOKS_PER_KEY = 5
+MAX_ALERTS_PER_KEY = 100
 
 
 def _get_supabase_client():
-    if _create_supabase_client is None:
+    global _SUPABASE_IMPORT_FAILED
+    if _SUPABASE_IMPORT_FAILED:
         return None
     url = _os.environ.get("SUPABASE_URL")
     service_key = _os.environ.get("SUPABASE_SERVICE_ROLE_KEY") or _os.environ.get("SUPABASE_SERVICE_KEY")
@@ -42,6 +73,11 @@ def _get_supabase_client():
     cached = current_app.config.get("SUPABASE_CLIENT")
     if cached is not None:
         return cached
+    try:
+        from supabase import create_client as _create_supabase_client
+    except Exception:  # pragma: no cover - optional dependency
+        _SUPABASE_IMPORT_FAILED = True
+        return None
     client = _create_supabase_client(url, service_key)
     current_app.config["SUPABASE_CLIENT"] = client
     return client
@@ -92,6 +128,14 @@ def _get_db_path() -> str:
     )
 
 
+def _get_archive_db_path() -> str:
+    return (
+        current_app.config.get("API_ARCHIVE_DB_PATH")
+        or _os.environ.get("API_ARCHIVE_DB_PATH")
+        or default_archive_path(_get_db_path())
+    )
+
+
 def _get_pepper_path() -> str:
     return (
         current_app.config.get("API_KEY_PEPPER_PATH")
@@ -194,13 +238,17 @@ def _run_migrations(db: _sqlite3.Connection) -> None:
         db.execute("ALTER TABLE usage_monthly ADD COLUMN extra_quota INTEGER NOT NULL DEFAULT 0;")
 
 
-def init_db() -> None:
+def init_db(sync_plans: bool = False) -> None:
     db_path = _get_db_path()
     _ensure_parent_dir(db_path)
     db = _sqlite3.connect(db_path)
     db.row_factory = _sqlite3.Row
     try:
         db.execute("PRAGMA foreign_keys = ON;")
+        if int(db.execute("PRAGMA user_version;").fetchone()[0]) >= _SCHEMA_VERSION:
+            if sync_plans:
+                _sync_plans_to_supabase(db)
+            return
         db.executescript(
             """
             CREATE TABLE IF NOT EXISTS plans (
@@ -244,12 +292,62 @@ def init_db() -> None:
               extra_quota INTEGER NOT NULL DEFAULT 0,
               PRIMARY KEY (api_key_id, month)
             );
+
+            CREATE TABLE IF NOT EXISTS webhooks (
+              id INTEGER PRIMARY KEY AUTOINCREMENT,
+              api_key_id INTEGER NOT NULL REFERENCES api_keys(id),
+              url TEXT NOT NULL,
+              secret TEXT NOT NULL,
+              active INTEGER NOT NULL DEFAULT 1,
+              created_at TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_webhooks_api_key ON webhooks(api_key_id);
+
+            CREATE TABLE IF NOT EXISTS webhook_dead_letters (
+              id INTEGER PRIMARY KEY AUTOINCREMENT,
+              webhook_id INTEGER NOT NULL REFERENCES webhooks(id),
+              delivery_id TEXT NOT NULL,
+              event TEXT NOT NULL,
+              payload TEXT NOT NULL,
+              attempts INTEGER NOT NULL,
+              last_error TEXT,
+              created_at TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_webhook_dead_letters_webhook ON webhook_dead_letters(webhook_id);
+
+            CREATE TABLE IF NOT EXISTS alerts (
+              id INTEGER PRIMARY KEY AUTOINCREMENT,
+              api_key_id INTEGER NOT NULL REFERENCES api_keys(id),
+              symbol TEXT NOT NULL,
+              kind TEXT NOT NULL,
+              value REAL NOT NULL,
+              reference REAL,
+              active INTEGER NOT NULL DEFAULT 1,
+              rev INTEGER NOT NULL,
+              created_at TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_alerts_api_key ON alerts(api_key_id);
+            CREATE INDEX IF NOT EXISTS idx_alerts_rev ON alerts(rev);
+
+            CREATE TABLE IF NOT EXISTS alert_events (
+              id INTEGER PRIMARY KEY AUTOINCREMENT,
+              alert_id INTEGER NOT NULL REFERENCES alerts(id),
+              api_key_id INTEGER NOT NULL,
+              symbol TEXT NOT NULL,
+              direction TEXT NOT NULL,
+              threshold REAL NOT NULL,
+              previous_value REAL,
+              value REAL NOT NULL,
+              fired_at TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_alert_events_api_key ON alert_events(api_key_id, id);
             """
         )
         _run_migrations(db)
 
         existing = db.execute("SELECT COUNT(1) AS c FROM plans;").fetchone()[0]
         if existing == 0:
+            sync_plans = True
             now = _utcnow_iso()
             for plan in DEFAULT_PLANS:
                 db.execute(
@@ -268,8 +366,10 @@ def init_db() -> None:
                         now,
                     ),
                 )
-        _sync_plans_to_supabase(db)
+        db.execute(f"PRAGMA user_version = {_SCHEMA_VERSION};")
         db.commit()
+        if sync_plans:
+            _sync_plans_to_supabase(db)
     finally:
         db.close()
 
@@ -366,6 +466,10 @@ def _sync_api_key(db: _sqlite3.Connection, api_key_id: int) -> None:
 
 
 def _sync_usage_monthly(db: _sqlite3.Connection, api_key_id: int, month: str) -> None:
+    pending = getattr(_DEFERRED_SYNC, "rows", None)
+    if pending is not None:
+        pending.add((api_key_id, month))
+        return
     row = db.execute(
         """
         SELECT api_key_id, month, request_count, extra_quota
@@ -467,6 +571,8 @@ def _auth_api_key(db: _sqlite3.Connection, api_key: str):
 
 
 def _increment_usage_or_reject(db: _sqlite3.Connection, *, api_key_id: int) -> dict:
+    if _QUOTA_LEASES is not None:
+        return _QUOTA_LEASES.acquire(db, api_key_id=api_key_id)
     month = _month_key()
     db.execute("BEGIN IMMEDIATE;")
     row = db.execute(
@@ -505,6 +611,107 @@ def _increment_usage_or_reject(db: _sqlite3.Connection, *, api_key_id: int) -> d
     return {"ok": True, "month": month, "request_count": new_count, "monthly_quota": monthly_quota}
 
 
+def _flush_deferred_usage(db: _sqlite3.Connection) -> None:
+    rows = _METERING.drain()
+    if not rows:
+        return
+    try:
+        db.execute("BEGIN IMMEDIATE;")
+        db.executemany(
+            """
+            INSERT INTO usage_monthly (api_key_id, month, request_count, extra_quota)
+            VALUES (?, ?, ?, 0)
+            ON CONFLICT(api_key_id, month) DO UPDATE SET request_count = request_count + excluded.request_count;
+            """,
+            [(api_key_id, month, count) for count, api_key_id, month in rows],
+        )
+        db.commit()
+    except _sqlite3.OperationalError:
+        db.rollback()
+        _METERING.restore(rows)
+        raise
+    for _count, api_key_id, month in rows:
+        _sync_usage_monthly(db, api_key_id, month)
+
+
+def _meter_request(db: _sqlite3.Connection, *, api_key_id: int) -> dict:
+    """Metered increment, or a deferred count checked against the last known usage while the DB is saturated."""
+    month = _month_key()
+    if _METERING.begin_write():
+        failed = False
+        _DEFERRED_SYNC.rows = set()
+        started = _time.perf_counter()
+        try:
+            # یک نوشتن کند نباید رشته را تا timeout پیش‌فرض ۵ ثانیه‌ای sqlite نگه دارد
+            db.execute(f"PRAGMA busy_timeout = {_METERING.busy_timeout_ms};")
+            _flush_deferred_usage(db)
+            usage = _increment_usage_or_reject(db, api_key_id=api_key_id)
+        except _sqlite3.OperationalError as exc:
+            if "locked" not in str(exc) and "busy" not in str(exc):
+                raise
+            failed = True
+            if db.in_transaction:
+                db.rollback()
+        finally:
+            # فقط نوشتن محلی SQLite زمان‌گیری می‌شود؛ همگام‌سازی Supabase بعد از آن
+            _METERING.end_write(_time.perf_counter() - started, failed)
+            pending, _DEFERRED_SYNC.rows = _DEFERRED_SYNC.rows, None
+        for synced_key_id, synced_month in sorted(pending):
+            _sync_usage_monthly(db, synced_key_id, synced_month)
+        if not failed:
+            if "request_count" in usage:
+                _USAGE.observe(api_key_id, usage["month"], int(usage["request_count"]), usage.get("monthly_quota"))
+            return usage
+    rejected = _degraded_quota_check(db, api_key_id, month)
+    if rejected is not None:
+        return rejected
+    _METERING.defer(api_key_id, month)
+    _USAGE.bump(api_key_id, month)
+    return {"ok": True, "month": month, "degraded": True}
+
+
+def _degraded_quota_check(db: _sqlite3.Connection, api_key_id: int, month: str) -> dict | None:
+    """Rejection for a key whose last known usage plus deferred requests has reached its quota."""
+    monthly_quota = _USAGE.quota(api_key_id, month)
+    if monthly_quota is None:
+        # این پروسه هنوز سهمیه‌ی کلید را ندیده؛ یک خواندن کوتاه (نوشتنی در کار نیست)
+        try:
+            db.execute(f"PRAGMA busy_timeout = {_METERING.busy_timeout_ms};")
+            row = db.execute(
+                """
+                SELECT plans.monthly_quota AS base_quota,
+                       COALESCE(usage_monthly.request_count, 0) AS request_count,
+                       COALESCE(usage_monthly.extra_quota, 0) AS extra_quota
+                FROM api_keys
+                JOIN plans ON plans.id = api_keys.plan_id
+                LEFT JOIN usage_monthly ON usage_monthly.api_key_id = api_keys.id AND usage_monthly.month = ?
+                WHERE api_keys.id = ?;
+                """,
+                (month, api_key_id),
+            ).fetchone()
+        except _sqlite3.OperationalError:
+            return None
+        if row is None:
+            return None
+        monthly_quota = int(row["base_quota"]) + int(row["extra_quota"])
+        _USAGE.observe(api_key_id, month, int(row["request_count"]), monthly_quota)
+    request_count = _USAGE.get(api_key_id, month)
+    if request_count < monthly_quota:
+        return None
+    return {
+        "ok": False,
+        "error": "Monthly quota exceeded.",
+        "month": month,
+        "request_count": request_count,
+        "monthly_quota": monthly_quota,
+        "degraded": True,
+    }
+
+
+def metering_state() -> dict:
+    return _METERING.state()
+
+
 def auth_api_key_value(api_key: str):
     db = get_db()
     return _auth_api_key(db, api_key)
@@ -512,7 +719,7 @@ def auth_api_key_value(api_key: str):
 
 def increment_usage_for_key(api_key_id: int) -> dict:
     db = get_db()
-    return _increment_usage_or_reject(db, api_key_id=api_key_id)
+    return _meter_request(db, api_key_id=api_key_id)
 
 
 def require_api_key(view_func):
@@ -537,7 +744,7 @@ def require_metered_api_key(view_func):
     @require_api_key
     def wrapped(*args, **kwargs):
         db = get_db()
-        usage = _increment_usage_or_reject(db, api_key_id=int(g.api_key["api_key_id"]))
+        usage = _meter_request(db, api_key_id=int(g.api_key["api_key_id"]))
         if not usage.get("ok"):
             return jsonify({"error": usage.get("error"), "usage": usage}), 429
         g.api_usage = usage
@@ -547,7 +754,7 @@ def require_metered_api_key(view_func):
     return wrapped
 
 
-def _require_admin(view_func):
+def require_admin(view_func):
     def wrapped(*args, **kwargs):
         admin_token = _os.environ.get("ADMIN_TOKEN")
         if not admin_token:
@@ -570,11 +777,17 @@ def _verify_supabase_jwt() -> dict | None:
     secret = _os.environ.get("SUPABASE_JWT_SECRET")
     if not secret:
         return None
+    cached = _JWT_CACHE.get(token)
+    if cached is not None:
+        return cached
+    import jwt as _jwt
+
     try:
         payload = _jwt.decode(token, secret, algorithms=["HS256"], audience="authenticated")
-        return payload
     except Exception:
         return None
+    _JWT_CACHE.put(token, payload)
+    return payload
 
 
 def require_supabase_jwt(view_func):
@@ -677,6 +890,7 @@ def me_purchase():
     )
     key = _create_api_key(db, customer_id=customer_id, plan_id=int(plan["id"]))
     db.commit()
+    _ME_KEYS.invalidate_user(user_id)
     _sync_customer(db, customer_id)
     _sync_api_key(db, int(key["api_key_id"]))
     return jsonify(
@@ -690,17 +904,10 @@ def me_purchase():
     )
 
 
-@bp.get("/me/keys")
-@require_supabase_jwt
-def me_list_keys():
-    """List API keys and usage for the logged-in user."""
-    db = get_db()
-    user_id = g.supabase_user_id
-    month = _month_key()
-
+def _load_customer_keys(db: _sqlite3.Connection, user_id: str, month: str) -> tuple:
     row = db.execute("SELECT id FROM customers WHERE supabase_user_id = ?;", (user_id,)).fetchone()
     if not row:
-        return jsonify({"keys": []})
+        return None, []
 
     customer_id = int(row["id"])
     rows = db.execute(
@@ -719,11 +926,6 @@ def me_list_keys():
 
     keys = []
     for r in rows:
-        base = int(r["monthly_quota"])
-        extra = int(r["extra_quota"])
-        used = int(r["request_count"])
-        total = base + extra
-        remaining = max(0, total - used)
         api_url = r["api_url"] or (_build_api_url(r["api_key"]) if r["api_key"] else None)
         keys.append(
             {
@@ -734,14 +936,40 @@ def me_list_keys():
                 "status": r["status"],
                 "created_at": r["created_at"],
                 "plan": {"slug": r["plan_slug"], "scope": r["scope"] or "all", "name": r["plan_name"]},
-                "usage": {
-                    "month": month,
-                    "request_count": used,
-                    "monthly_quota": total,
-                    "remaining": remaining,
-                },
+                "monthly_quota": int(r["monthly_quota"]) + int(r["extra_quota"]),
+                "request_count": int(r["request_count"]),
             }
         )
+    return customer_id, keys
+
+
+@bp.get("/me/keys")
+@require_supabase_jwt
+def me_list_keys():
+    """List API keys and usage for the logged-in user."""
+    user_id = g.supabase_user_id
+    month = _month_key()
+
+    cached = _ME_KEYS.get(user_id, month)
+    if cached is None:
+        customer_id, rows = _load_customer_keys(get_db(), user_id, month)
+        _ME_KEYS.put(user_id, month, customer_id, rows)
+    else:
+        customer_id, rows = cached
+
+    keys = []
+    for r in rows:
+        total = r["monthly_quota"]
+        # شمارش‌های متری این پروسه از ردیف کش شده جدیدترند
+        used = max(r["request_count"], _USAGE.get(r["api_key_id"], month))
+        key = {k: v for k, v in r.items() if k not in ("monthly_quota", "request_count")}
+        key["usage"] = {
+            "month": month,
+            "request_count": used,
+            "monthly_quota": total,
+            "remaining": max(0, total - used),
+        }
+        keys.append(key)
     return jsonify({"keys": keys})
 
 
@@ -774,6 +1002,7 @@ def me_add_requests(api_key_id: int):
         (api_key_id, month, ADDON_EXTRA_REQUESTS, ADDON_EXTRA_REQUESTS),
     )
     db.commit()
+    _ME_KEYS.invalidate_user(user_id)
     _sync_usage_monthly(db, api_key_id, month)
 
     row = db.execute(
@@ -789,6 +1018,8 @@ def me_add_requests(api_key_id: int):
     ).fetchone()
     used = int(row["request_count"])
     total = int(row["base_quota"]) + int(row["extra_quota"])
+    # سهمیه‌ی جدید فوراً در حالت degraded هم دیده شود
+    _USAGE.observe(api_key_id, month, used, total)
     return jsonify(
         {
             "ok": True,
@@ -842,9 +1073,22 @@ def self_rotate():
         return jsonify({"error": "Invalid or inactive API key."}), 401
 
     db.execute("BEGIN IMMEDIATE;")
-    db.execute("UPDATE api_keys SET status = 'revoked', revoked_at = ? WHERE id = ?;", (_utcnow_iso(), int(auth_row["api_key_id"])))
+    cur = db.execute(
+        "UPDATE api_keys SET status = 'revoked', revoked_at = ? WHERE id = ? AND status = 'active';",
+        (_utcnow_iso(), int(auth_row["api_key_id"])),
+    )
+    if cur.rowcount == 0:
+        # درخواست هم‌زمان دیگری همین کلید را زودتر چرخانده است
+        db.execute("ROLLBACK;")
+        return jsonify({"error": "Invalid or inactive API key."}), 401
     key = _create_api_key(db, customer_id=int(auth_row["customer_id"]), plan_id=int(auth_row["plan_id"]))
+    db.execute("UPDATE webhooks SET api_key_id = ? WHERE api_key_id = ?;", (int(key["api_key_id"]), int(auth_row["api_key_id"])))
+    db.execute(
+        "UPDATE alerts SET api_key_id = ?, rev = (SELECT COALESCE(MAX(rev), 0) + 1 FROM alerts) WHERE api_key_id = ? AND active = 1;",
+        (int(key["api_key_id"]), int(auth_row["api_key_id"])),
+    )
     db.commit()
+    _ME_KEYS.invalidate_customer(int(auth_row["customer_id"]))
     _sync_api_key(db, int(auth_row["api_key_id"]))
     _sync_api_key(db, int(key["api_key_id"]))
     return jsonify(
@@ -858,8 +1102,186 @@ def self_rotate():
     )
 
 
+def _webhook_json(r) -> dict:
+    return {"id": int(r["id"]), "url": r["url"], "active": bool(r["active"]), "created_at": r["created_at"]}
+
+
+@bp.get("/self/webhooks")
+@require_api_key
+def self_list_webhooks():
+    db = get_db()
+    rows = db.execute(
+        "SELECT id, url, active, created_at FROM webhooks WHERE api_key_id = ? AND active = 1 ORDER BY id;",
+        (int(g.api_key["api_key_id"]),),
+    ).fetchall()
+    return jsonify({"webhooks": [_webhook_json(r) for r in rows]})
+
+
+@bp.post("/self/webhooks")
+@require_api_key
+def self_create_webhook():
+    """Register a webhook; the signing secret is only returned here."""
+    payload = request.get_json(silent=True) or {}
+    url = (payload.get("url") or "").strip()
+    try:
+        resolve_webhook_url(url, allow_private=private_addresses_allowed())
+    except WebhookURLError as exc:
+        return jsonify({"error": str(exc)}), 400
+
+    db = get_db()
+    api_key_id = int(g.api_key["api_key_id"])
+    count = db.execute("SELECT COUNT(1) FROM webhooks WHERE api_key_id = ? AND active = 1;", (api_key_id,)).fetchone()[0]
+    if count >= MAX_WEBHOOKS_PER_KEY:
+        return jsonify({"error": f"At most {MAX_WEBHOOKS_PER_KEY} webhooks per API key."}), 400
+
+    secret = f"whsec_{_secrets.token_urlsafe(32)}"
+    now = _utcnow_iso()
+    cur = db.execute(
+        "INSERT INTO webhooks (api_key_id, url, secret, active, created_at) VALUES (?, ?, ?, 1, ?);",
+        (api_key_id, url, secret, now),
+    )
+    db.commit()
+    return jsonify({"id": int(cur.lastrowid), "url": url, "secret": secret, "scope": g.api_key["scope"] or "all", "created_at": now}), 201
+
+
+@bp.delete("/self/webhooks/<int:webhook_id>")
+@require_api_key
+def self_delete_webhook(webhook_id: int):
+    db = get_db()
+    cur = db.execute(
+        "UPDATE webhooks SET active = 0 WHERE id = ? AND api_key_id = ? AND active = 1;",
+        (webhook_id, int(g.api_key["api_key_id"])),
+    )
+    db.commit()
+    if cur.rowcount == 0:
+        return jsonify({"error": "Webhook not found."}), 404
+    return jsonify({"ok": True})
+
+
+@bp.get("/self/webhooks/dead-letters")
+@require_api_key
+def self_webhook_dead_letters():
+    db = get_db()
+    rows = db.execute(
+        """
+        SELECT webhook_dead_letters.id, webhook_dead_letters.webhook_id, webhook_dead_letters.delivery_id,
+               webhook_dead_letters.event, webhook_dead_letters.attempts, webhook_dead_letters.last_error,
+               webhook_dead_letters.created_at
+        FROM webhook_dead_letters
+        JOIN webhooks ON webhooks.id = webhook_dead_letters.webhook_id
+        WHERE webhooks.api_key_id = ?
+        ORDER BY webhook_dead_letters.id DESC
+        LIMIT 100;
+        """,
+        (int(g.api_key["api_key_id"]),),
+    ).fetchall()
+    return jsonify({"dead_letters": [dict(r) for r in rows]})
+
+
+def _alert_json(r) -> dict:
+    return {
+        "id": int(r["id"]),
+        "symbol": r["symbol"],
+        "kind": r["kind"],
+        "value": r["value"],
+        "reference": r["reference"],
+        "created_at": r["created_at"],
+    }
+
+
+@bp.get("/self/alerts")
+@require_api_key
+def self_list_alerts():
+    db = get_db()
+    rows = db.execute(
+        "SELECT id, symbol, kind, value, reference, created_at FROM alerts WHERE api_key_id = ? AND active = 1 ORDER BY id;",
+        (int(g.api_key["api_key_id"]),),
+    ).fetchall()
+    return jsonify({"alerts": [_alert_json(r) for r in rows]})
+
+
+@bp.post("/self/alerts")
+@require_api_key
+def self_create_alert():
+    """Create a threshold (above/below/cross) or percentage-move (move_pct) alert."""
+    payload = request.get_json(silent=True) or {}
+    symbol = (payload.get("symbol") or "").strip().lower()
+    kind = (payload.get("kind") or "").strip().lower()
+    try:
+        value = float(payload.get("value"))
+    except (TypeError, ValueError):
+        return jsonify({"error": "value must be a number."}), 400
+    if not _math.isfinite(value):
+        # float() رشته‌های "nan" و "inf" را هم می‌پذیرد
+        return jsonify({"error": "value must be a finite number."}), 400
+
+    if kind not in ALERT_KINDS:
+        return jsonify({"error": f"kind must be one of: {', '.join(ALERT_KINDS)}."}), 400
+    if symbol not in symbols_for_scope(g.api_key["scope"] or "all"):
+        return jsonify({"error": "Symbol is not available for this plan's scope."}), 400
+    if value <= 0:
+        return jsonify({"error": "value must be positive."}), 400
+
+    db = get_db()
+    api_key_id = int(g.api_key["api_key_id"])
+    count = db.execute("SELECT COUNT(1) FROM alerts WHERE api_key_id = ? AND active = 1;", (api_key_id,)).fetchone()[0]
+    if count >= MAX_ALERTS_PER_KEY:
+        return jsonify({"error": f"At most {MAX_ALERTS_PER_KEY} alerts per API key."}), 400
+
+    now = _utcnow_iso()
+    db.execute("BEGIN IMMEDIATE;")
+    cur = db.execute(
+        """
+        INSERT INTO alerts (api_key_id, symbol, kind, value, reference, active, rev, created_at)
+        VALUES (?, ?, ?, ?, NULL, 1, (SELECT COALESCE(MAX(rev), 0) + 1 FROM alerts), ?);
+        """,
+        (api_key_id, symbol, kind, value, now),
+    )
+    db.commit()
+    return jsonify({"id": int(cur.lastrowid), "symbol": symbol, "kind": kind, "value": value, "created_at": now}), 201
+
+
+@bp.delete("/self/alerts/<int:alert_id>")
+@require_api_key
+def self_delete_alert(alert_id: int):
+    db = get_db()
+    db.execute("BEGIN IMMEDIATE;")
+    cur = db.execute(
+        """
+        UPDATE alerts SET active = 0, rev = (SELECT COALESCE(MAX(rev), 0) + 1 FROM alerts)
+        WHERE id = ? AND api_key_id = ? AND active = 1;
+        """,
+        (alert_id, int(g.api_key["api_key_id"])),
+    )
+    db.commit()
+    if cur.rowcount == 0:
+        return jsonify({"error": "Alert not found."}), 404
+    return jsonify({"ok": True})
+
+
+@bp.get("/self/alerts/events")
+@require_api_key
+def self_alert_events():
+    """Poll fired alerts: pass the returned ``next_since`` back as ``since``."""
+    since = request.args.get("since", default=0, type=int)
+    limit = min(max(request.args.get("limit", default=100, type=int), 1), 1000)
+    db = get_db()
+    rows = db.execute(
+        """
+        SELECT id, alert_id, symbol, direction, threshold, previous_value, value, fired_at
+        FROM alert_events
+        WHERE api_key_id = ? AND id > ?
+        ORDER BY id
+        LIMIT ?;
+        """,
+        (int(g.api_key["api_key_id"]), since, limit),
+    ).fetchall()
+    events = [dict(r) for r in rows]
+    return jsonify({"events": events, "next_since": events[-1]["id"] if events else since})
+
+
 @bp.get("/admin/keys")
-@_require_admin
+@require_admin
 def admin_list_keys():
     db = get_db()
     rows = db.execute(
@@ -875,22 +1297,85 @@ def admin_list_keys():
         LIMIT 200;
         """
     ).fetchall()
-    return jsonify(
-        {
-            "keys": [
-                {
-                    "api_key_id": int(r["api_key_id"]),
-                    "masked": f"{r['key_prefix']}_…{r['key_last4']}",
-                    "status": r["status"],
-                    "created_at": r["created_at"],
-                    "revoked_at": r["revoked_at"],
-                    "customer": {"email": r["email"]},
-                    "plan": {"slug": r["plan_slug"], "name": r["plan_name"]},
-                }
-                for r in rows
-            ]
-        }
+    body = {
+        "keys": [
+            {
+                "api_key_id": int(r["api_key_id"]),
+                "masked": f"{r['key_prefix']}_…{r['key_last4']}",
+                "status": r["status"],
+                "created_at": r["created_at"],
+                "revoked_at": r["revoked_at"],
+                "customer": {"email": r["email"]},
+                "plan": {"slug": r["plan_slug"], "name": r["plan_name"]},
+            }
+            for r in rows
+        ]
+    }
+    if request.args.get("archived") in ("1", "true"):
+        archived = archived_keys(_get_archive_db_path())
+        customers = {
+            int(r["id"]): r["email"]
+            for r in db.execute(
+                f"SELECT id, email FROM customers WHERE id IN ({','.join('?' * len(archived))});",
+                [a["customer_id"] for a in archived],
+            )
+        } if archived else {}
+        plans = {int(r["id"]): r for r in db.execute("SELECT id, slug, name FROM plans;")}
+        body["archived_keys"] = [
+            {
+                "api_key_id": a["id"],
+                "masked": f"{a['key_prefix']}_…{a['key_last4']}",
+                "status": a["status"],
+                "created_at": a["created_at"],
+                "revoked_at": a["revoked_at"],
+                "archived_at": a["archived_at"],
+                "customer": {"email": customers.get(a["customer_id"])},
+                "plan": {"slug": plans[a["plan_id"]]["slug"], "name": plans[a["plan_id"]]["name"]} if a["plan_id"] in plans else None,
+            }
+            for a in archived
+        ]
+    return jsonify(body)
+
+
+@bp.get("/admin/usage")
+@require_admin
+def admin_usage():
+    """Monthly usage of one key or of every key in one month, live rows and archived rows together."""
+    api_key_id = request.args.get("api_key_id", type=int)
+    month = request.args.get("month")
+    if api_key_id is None and not month:
+        return jsonify({"error": "Pass api_key_id or month."}), 400
+    db = get_db()
+    where, params = [], []
+    if api_key_id is not None:
+        where.append("api_key_id = ?")
+        params.append(api_key_id)
+    if month:
+        where.append("month = ?")
+        params.append(month)
+    live = db.execute(
+        f"SELECT api_key_id, month, request_count, extra_quota FROM usage_monthly WHERE {' AND '.join(where)};",
+        params,
+    ).fetchall()
+    rows = [{**dict(r), "archived": False} for r in live]
+    seen = {(r["api_key_id"], r["month"]) for r in rows}
+    for r in archived_usage(_get_archive_db_path(), api_key_id=api_key_id, month=month or None):
+        if (r["api_key_id"], r["month"]) not in seen:
+            rows.append({**r, "archived": True})
+    rows.sort(key=lambda r: (r["month"], r["api_key_id"]))
+    return jsonify({"usage": rows, "total_requests": sum(int(r["request_count"]) for r in rows)})
+
+
+def _enable_quota_leases(db_path: str) -> None:
+    global _QUOTA_LEASES
+    if _QUOTA_LEASES is not None:
+        return
+    _QUOTA_LEASES = QuotaLeaseManager(
+        ttl=float(_os.environ.get("QUOTA_LEASE_TTL", "10")),
+        max_lease=int(_os.environ.get("QUOTA_LEASE_MAX", "100")),
+        on_grant=_sync_usage_monthly,
     )
+    _atexit.register(_QUOTA_LEASES.release_all, db_path)
 
 
 def init_api_manager(app) -> None:
@@ -898,13 +1383,20 @@ def init_api_manager(app) -> None:
         "API_DB_PATH",
         _os.environ.get("API_DB_PATH") or _os.path.join(app.root_path, "data", "api_manager.db"),
     )
+    app.config.setdefault(
+        "API_ARCHIVE_DB_PATH",
+        _os.environ.get("API_ARCHIVE_DB_PATH") or default_archive_path(app.config["API_DB_PATH"]),
+    )
     app.config.setdefault(
         "API_KEY_PEPPER_PATH",
         _os.environ.get("API_KEY_PEPPER_PATH") or _os.path.join(app.root_path, "data", "api_key_pepper"),
     )
 
+    sync_plans = _os.environ.get("SUPABASE_SYNC_PLANS_ON_BOOT", "").strip().lower() in ("1", "true", "yes", "on")
+    if _os.environ.get("QUOTA_LEASE_ENABLED", "").strip().lower() in ("1", "true", "yes", "on"):
+        _enable_quota_leases(app.config["API_DB_PATH"])
     with app.app_context():
-        init_db()
+        init_db(sync_plans=sync_plans)
         _load_or_create_pepper()
     app.teardown_appcontext(close_db)
     app.register_blueprint(bp)
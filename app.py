@@ -1,16 +1,34 @@
-from flask import Flask, g, jsonify
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
+from flask import Flask, Response, g, jsonify, request
+import datetime
 import threading
 import time
 import logging
+import os
 
-from api_manager import init_api_manager, require_metered_api_key, auth_api_key_value, increment_usage_for_key
+from api_manager import init_api_manager, get_db, require_admin, require_api_key, auth_api_key_value, increment_usage_for_key, metering_state
+from scraper import SCOPE_KEYS
+from scrape_plan import ScrapePlan
+from scheduler import ScrapeScheduler
+from snapshot_store import load_snapshot, save_snapshot
+from freshness import SymbolTracker
+from webhooks import EVENT_PRICES_UPDATED, WebhookDispatcher, render_prices_body
+from alerts import AlertEngine
+from replication import SnapshotReplicator
+from body_variants import BodyVariants
+from admission import AdmissionController
+from history_store import HistoryStore
+from archival import ArchiveJob, table_sizes
+from symbol_selection import SelectionError, SymbolSelector
 
 app = Flask(__name__)
+app.config.setdefault(
+    "SNAPSHOT_PATH",
+    os.environ.get("SNAPSHOT_PATH") or os.path.join(app.root_path, "data", "latest_prices.json"),
+)
+app.config.setdefault(
+    "HISTORY_DB_PATH",
+    os.environ.get("HISTORY_DB_PATH") or os.path.join(app.root_path, "data", "history.db"),
+)
 init_api_manager(app)
 
 # تنظیمات لاگینگ
@@ -20,67 +38,40 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 LATEST_PRICES = {
     "data": {},
     "last_updated": None,
-    "status": "Initializing"
+    "next_update": None,
+    "status": "Initializing",
+    "source": None,
 }
 
-# لیست تمام آیتم‌های موجود در عکس و ID آن‌ها در سایت Bonbast
-# کلید سمت چپ: نامی که در API می‌گیرید
-# مقدار سمت راست: ID المنت در HTML سایت
-TARGETS = {
-    # --- ارزهای اصلی (ستون چپ) ---
-    "usd": "usd1",         # دلار آمریکا
-    "eur": "eur1",         # یورو
-    "gbp": "gbp1",         # پوند انگلیس
-    "chf": "chf1",         # فرانک سوئیس
-    "cad": "cad1",         # دلار کانادا
-    "aud": "aud1",         # دلار استرالیا
-    "sek": "sek1",         # کرون سوئد
-    "nok": "nok1",         # کرون نروژ
-    "rub": "rub1",         # روبل روسیه
-    "thb": "thb1",         # بات تایلند
-    "sgd": "sgd1",         # دلار سنگاپور
-    "hkd": "hkd1",         # دلار هنگ کنگ
-    "azn": "azn1",         # منات آذربایجان
-    "amd": "amd1",         # درام ارمنستان
-
-    # --- ارزهای دیگر (ستون راست) ---
-    "dkk": "dkk1",         # کرون دانمارک
-    "aed": "aed1",         # درهم امارات
-    "jpy": "jpy1",         # ین ژاپن
-    "try": "try1",         # لیر ترکیه
-    "cny": "cny1",         # یوان چین
-    "sar": "sar1",         # ریال عربستان
-    "inr": "inr1",         # روپیه هند
-    "myr": "myr1",         # رینگیت مالزی
-    "afn": "afn1",         # افغانی افغانستان
-    "kwd": "kwd1",         # دینار کویت
-    "iqd": "iqd1",         # دینار عراق
-    "bhd": "bhd1",         # دینار بحرین
-    "omr": "omr1",         # ریال عمان
-    "qar": "qar1",         # ریال قطر
-
-    # --- طلا و سکه ---
-    "gold_ounce": "ounce",      # انس طلا
-    "gold_gram_18k": "gol18",   # گرم طلا ۱۸
-    "gold_mithqal": "mithqal",  # مثقال طلا
-    "coin_emami": "emami1",     # سکه امامی
-    "coin_azadi": "azadi1",     # سکه بهار آزادی (طرح قدیم)
-    "coin_half": "azadi1_2",    # نیم سکه
-    "coin_quarter": "azadi1_4", # ربع سکه
-    "coin_gram": "azadi1g",     # سکه گرمی
-    
-    # --- کریپتو (پایین صفحه) ---
-    "bitcoin": "bitcoin"        # بیت‌کوین
-}
+# منابع اسکرپ (SCRAPE_PLAN_PATH)؛ به طور پیش‌فرض فقط صفحه‌ی bonbast با مرورگر خوانده می‌شود
+SCRAPE_PLAN = ScrapePlan.from_env()
 
-# محدوده هر scope برای فیلتر خروجی API
-SCOPE_KEYS = {
-    "currency": ["usd", "eur", "gbp", "chf", "cad", "aud", "sek", "nok", "rub", "thb", "sgd", "hkd", "azn", "amd",
-                 "dkk", "aed", "jpy", "try", "cny", "sar", "inr", "myr", "afn", "kwd", "iqd", "bhd", "omr", "qar"],
-    "crypto": ["bitcoin"],
-    "gold": ["gold_ounce", "gold_gram_18k", "gold_mithqal", "coin_emami", "coin_azadi", "coin_half", "coin_quarter", "coin_gram"],
-}
+# آخرین مقدار سالم هر نماد + زمان مشاهده، منبع و تعداد خطای پشت سر هم
+TRACKER = SymbolTracker(SCRAPE_PLAN.symbols, stale_after=float(os.environ.get("SYMBOL_STALE_AFTER", "300")))
+
+# ارسال وبهوک‌ها و ارزیابی هشدارها (فقط در پروسه‌ای که اسکرپ می‌کند ساخته می‌شوند)
+WEBHOOKS = None
+ALERTS = None
+
+# انتقال مصرف ماه‌های گذشته و کلیدهای قدیمی باطل‌شده به پایگاه آرشیو (فقط در پروسه‌ی اسکرپر زمان‌بندی می‌شود)
+ARCHIVE = None
+
+# تکثیر snapshot بین نودها (REPLICATION_MODE=redis)؛ فقط رهبر منتخب اسکرپ و منتشر می‌کند
+REPLICATOR = None
+
+# قیمت روزانه‌ی هر نماد (از backfill.py و آخرین اسکرپ هر روز)
+HISTORY = HistoryStore(app.config["HISTORY_DB_PATH"])
+HISTORY_MAX_DAYS = int(os.environ.get("HISTORY_MAX_DAYS", "366"))
 
+# زمان‌بندی اسکرپ (fixed-rate + backoff + فاصله‌ی تطبیقی)
+SCHEDULER = ScrapeScheduler.from_env()
+
+# سقف درخواست‌های هم‌زمان با صف اولویت‌دار (تجاری > استارتر > بدون کلید)؛ ADMISSION_MAX_IN_FLIGHT=0 غیرفعال می‌کند
+ADMISSION = AdmissionController.from_env()
+_ADMISSION_EXEMPT = {"health"}
+
+# اندپوینت‌هایی که هدر کش بر اساس زمان اسکرپ بعدی می‌گیرند
+_PRICE_ENDPOINTS = {"get_prices": "public", "get_prices_v1": "private", "get_prices_by_key": "private"}
 
 def _filter_prices_by_scope(data: dict, scope: str) -> dict:
     if scope == "all" or not scope:
@@ -89,73 +80,382 @@ def _filter_prices_by_scope(data: dict, scope: str) -> dict:
     return {k: v for k, v in data.items() if k in keys}
 
 
-def create_driver():
-    options = Options()
-    options.add_argument("--headless")
-    options.add_argument("--no-sandbox")
-    options.add_argument("--disable-dev-shm-usage")
-    options.add_argument("--disable-gpu")
-    options.page_load_strategy = 'eager'
-    prefs = {"profile.managed_default_content_settings.images": 2}
-    options.add_experimental_option("prefs", prefs)
-    return webdriver.Chrome(options=options)
+# ?symbols= به یک bitmask روی نمادهای SCRAPE_PLAN تبدیل می‌شود؛ کلید کش بدنه‌ها همین mask است
+SELECTOR = SymbolSelector(SCRAPE_PLAN.symbols, SCOPE_KEYS)
+_SELECTION = "symbols"
+SELECTION_WARM = int(os.environ.get("SELECTION_WARM", "32"))
+
+
+def _selection_key(visibility: str, scope: str, raw: str | None) -> tuple:
+    """Body cache key for a ``symbols=`` value (None: the whole scope); raises SelectionError."""
+    if raw is None:
+        return (visibility, scope)
+    mask = SELECTOR.parse(raw, scope)
+    named = SELECTOR.scope_for(mask)
+    # انتخابی که دقیقا برابر یک scope است همان بدنه‌ی آماده‌ی آن scope را می‌گیرد (بدنه‌ی عمومی فقط all دارد)
+    if named == "all" or (named is not None and visibility == "private"):
+        return (visibility, named)
+    return (visibility, _SELECTION, mask)
+
+
+def _price_payload(key: tuple) -> dict:
+    visibility, scope = key[0], key[1]
+    data = LATEST_PRICES.get("data", {})
+    if scope == _SELECTION:
+        wanted = SELECTOR.symbols(key[2])
+        filtered_data = {k: data[k] for k in wanted if k in data}
+    elif visibility == "public":
+        return {**LATEST_PRICES, "freshness": TRACKER.freshness()}
+    else:
+        filtered_data = _filter_prices_by_scope(data, scope)
+    if visibility == "public":
+        return {**LATEST_PRICES, "data": filtered_data, "freshness": TRACKER.freshness(filtered_data)}
+    return {
+        "data": filtered_data,
+        "last_updated": LATEST_PRICES.get("last_updated"),
+        "next_update": LATEST_PRICES.get("next_update"),
+        "status": LATEST_PRICES.get("status"),
+        "freshness": TRACKER.freshness(filtered_data),
+    }
+
+
+# بدنه‌ی پاسخ‌های قیمت در هر snapshot برای هر کلید و هر فرمت/فشرده‌سازی مذاکره‌شده فقط یک بار ساخته می‌شود
+# بدنه‌ها فقط وقتی زودتر از snapshot بعدی دور ریخته می‌شوند که نمادی stale شود (freshness داخل بدنه عوض می‌شود)
+BODIES = BodyVariants.from_env(
+    _price_payload,
+    lambda payload: app.json.dumps(payload, separators=(",", ":")),
+    expires_in=TRACKER.seconds_until_stale,
+)
+_BODY_KEYS = [("public", "all"), ("private", "all"), *(("private", scope) for scope in SCOPE_KEYS)]
+BODIES.pin(_BODY_KEYS)
+
+
+def _refresh_bodies() -> None:
+    BODIES.invalidate()
+    try:
+        # همه‌ی فرمت‌ها و فشرده‌سازی‌های scopeها موقع انتشار ساخته می‌شوند تا هیچ درخواستی هزینه‌ی brotli را ندهد؛
+        # انتخاب‌های نمادی که اخیرا زیاد خواسته شده‌اند هم در همان حالت‌هایی که سرو شده‌اند از پیش ساخته می‌شوند
+        BODIES.warm(_BODY_KEYS, all_variants=True)
+        hot = [key for key in BODIES.hot_keys(len(_BODY_KEYS) + SELECTION_WARM) if key not in _BODY_KEYS]
+        BODIES.warm(hot[:SELECTION_WARM])
+    except Exception as e:
+        logging.warning(f"Could not pre-encode price bodies: {e}")
+
+
+def _negotiated_response(key: tuple | None = None, payload: dict | None = None) -> Response:
+    media_type, coding = BODIES.negotiate(request.accept_mimetypes, request.accept_encodings)
+    if key is not None:
+        body, coding = BODIES.get(key, media_type, coding)
+    else:
+        body, coding = BODIES.render(payload, media_type, coding)
+    response = Response(body, content_type=media_type)
+    if coding != "identity":
+        response.headers["Content-Encoding"] = coding
+    response.vary.update(("Accept", "Accept-Encoding"))
+    return response
+
+
+def _snapshot_mtime() -> int | None:
+    try:
+        return os.stat(app.config["SNAPSHOT_PATH"]).st_mtime_ns
+    except OSError:
+        return None
+
+
+# mtime فایل snapshot در آخرین بارگذاری؛ دنبال‌کننده فقط بعد از تغییر آن دوباره می‌خواند
+_SNAPSHOT_MTIME = None
+
+
+def _restore_snapshot() -> None:
+    # شروع گرم: آخرین قیمت‌های سالم تا اولین اسکرپ زنده سرو می‌شوند
+    global _SNAPSHOT_MTIME
+    _SNAPSHOT_MTIME = _snapshot_mtime()
+    snapshot = load_snapshot(app.config["SNAPSHOT_PATH"])
+    if not snapshot:
+        return
+    observed_at = None
+    if snapshot.get("last_updated"):
+        try:
+            observed_at = time.mktime(time.strptime(snapshot["last_updated"], "%Y-%m-%d %H:%M:%S"))
+        except ValueError:
+            pass
+    TRACKER.load(snapshot.get("symbols"), values=snapshot["data"], observed_at=observed_at)
+    LATEST_PRICES["data"] = TRACKER.values()
+    LATEST_PRICES["last_updated"] = snapshot.get("last_updated")
+    LATEST_PRICES["next_update"] = snapshot.get("next_update")
+    LATEST_PRICES["status"] = snapshot.get("status") or "Success"
+    LATEST_PRICES["source"] = "snapshot"
+    logging.info(f"Restored {len(snapshot['data'])} items from snapshot ({snapshot.get('last_updated')}).")
+
+
+def _snapshot_document() -> dict:
+    return {
+        "data": LATEST_PRICES["data"],
+        "symbols": TRACKER.dump(),
+        "last_updated": LATEST_PRICES["last_updated"],
+        "next_update": LATEST_PRICES["next_update"],
+        "status": "Success",
+    }
+
+
+def _persist_snapshot(document: dict) -> None:
+    try:
+        save_snapshot(app.config["SNAPSHOT_PATH"], document)
+    except OSError as e:
+        logging.warning(f"Could not persist snapshot: {e}")
+
+
+def _apply_replicated_snapshot(document: dict) -> None:
+    # نسخه‌ی منتشر شده توسط نود رهبر جایگزین داده‌ی محلی می‌شود
+    TRACKER.load(document.get("symbols"), values=document.get("data"))
+    LATEST_PRICES["data"] = TRACKER.values()
+    LATEST_PRICES["last_updated"] = document.get("last_updated")
+    LATEST_PRICES["next_update"] = document.get("next_update")
+    LATEST_PRICES["status"] = document.get("status") or "Success"
+    LATEST_PRICES["source"] = "replica"
+    _persist_snapshot(document)
+    _refresh_bodies()
+
+
+def _share_snapshot() -> None:
+    # بعد از تعیین next_update ذخیره و منتشر می‌شود تا فایل و نودهای دیگر زمان اسکرپ بعدی درست را ببینند
+    document = _snapshot_document()
+    _persist_snapshot(document)
+    if REPLICATOR is not None:
+        try:
+            REPLICATOR.publish(document)
+        except Exception as e:
+            logging.error(f"Snapshot replication failed: {e}")
+
+
+def _publish_snapshot(observed: dict, sources: dict | None = None) -> bool:
+    """Merge one scrape into the tracker and publish it; returns whether any value changed."""
+    previous = TRACKER.values()
+    changed = TRACKER.observe(observed, sources=sources)
+    LATEST_PRICES["data"] = TRACKER.values()
+    LATEST_PRICES["last_updated"] = time.strftime("%Y-%m-%d %H:%M:%S")
+    LATEST_PRICES["status"] = "Success"
+    LATEST_PRICES["source"] = "live"
+    if changed and WEBHOOKS is not None:
+        WEBHOOKS.publish(_webhook_renderer(dict(LATEST_PRICES["data"]), LATEST_PRICES["last_updated"]))
+    if changed and ALERTS is not None:
+        try:
+            fired = ALERTS.evaluate(previous, LATEST_PRICES["data"])
+            if fired:
+                logging.info(f"{len(fired)} alerts fired.")
+        except Exception as e:
+            logging.error(f"Alert evaluation failed: {e}")
+    return changed
+
+
+def _webhook_renderer(data: dict, last_updated: str):
+    def render(scope: str) -> bytes:
+        return render_prices_body(EVENT_PRICES_UPDATED, {
+            "data": _filter_prices_by_scope(data, scope),
+            "last_updated": last_updated,
+        })
+    return render
+
 
 def scraper_worker():
     global LATEST_PRICES
     while True:
-        driver = None
+        if REPLICATOR is not None and not REPLICATOR.is_leader:
+            # فقط نود رهبر اسکرپ می‌کند؛ بقیه نسخه‌ها را از کانال pub/sub می‌گیرند
+            time.sleep(REPLICATOR.heartbeat)
+            continue
+        published = False
         try:
             logging.info("Starting extensive background scrape...")
-            driver = create_driver()
-            driver.get("https://www.bonbast.com")
-
-            # صبر برای لود شدن حداقل یکی از المان‌های اصلی (مثلا دلار)
-            wait = WebDriverWait(driver, 20)
-            wait.until(EC.presence_of_element_located((By.ID, "usd1")))
-
-            temp_data = {}
-            
-            # حلقه برای گرفتن تمام آیتم‌های تعریف شده در دیکشنری TARGETS
-            for api_key, html_id in TARGETS.items():
-                try:
-                    element = driver.find_element(By.ID, html_id)
-                    temp_data[api_key] = element.text
-                except:
-                    temp_data[api_key] = "N/A"
+            result = SCRAPE_PLAN.run()
+            for name, stat in result["stats"].items():
+                if not stat["ok"]:
+                    logging.warning(f"Source {name} failed after {stat['elapsed']}s: {stat['error']}")
+            if not any(stat["ok"] for stat in result["stats"].values()):
+                raise RuntimeError("every scrape source failed")
+            temp_data = result["values"]
+            failed = [k for k, v in temp_data.items() if v is None]
+            if failed:
+                logging.warning(f"Could not read {len(failed)} items, keeping last good values: {', '.join(failed)}")
 
             # اضافه کردن زمان بروزرسانی
-            LATEST_PRICES["data"] = temp_data
-            LATEST_PRICES["last_updated"] = time.strftime("%Y-%m-%d %H:%M:%S")
-            LATEST_PRICES["status"] = "Success"
-            logging.info(f"Successfully scraped {len(temp_data)} items.")
+            changed = _publish_snapshot(temp_data, result["sources"])
+            published = True
+            try:
+                HISTORY.record_live(time.strftime("%Y-%m-%d"), temp_data)
+            except Exception as e:
+                logging.error(f"Recording price history failed: {e}")
+            interval = SCHEDULER.record_success(changed)
+            logging.info(f"Successfully scraped {len(temp_data) - len(failed)} items from {len(result['stats'])} sources in {result['elapsed']}s (changed={changed}, next in {interval:.0f}s).")
 
         except Exception as e:
-            logging.error(f"Scrape failed: {e}")
+            TRACKER.fail_all()
+            delay = SCHEDULER.record_failure()
+            logging.error(f"Scrape failed: {e} (retry in {delay:.0f}s)")
             LATEST_PRICES["status"] = f"Error: {str(e)}"
         
         finally:
-            if driver:
-                driver.quit()
-            # آپدیت هر ۶۰ ثانیه
-            time.sleep(60)
+            LATEST_PRICES["next_update"] = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(SCHEDULER.next_run_epoch()))
+            if published:
+                _share_snapshot()
+            _refresh_bodies()
+            SCHEDULER.wait()
+
+
+def _env_flag(name: str, default: bool) -> bool:
+    value = os.environ.get(name)
+    if value is None or not value.strip():
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+_SCRAPER_THREAD = None
+
+
+def start_scraper() -> None:
+    global _SCRAPER_THREAD, WEBHOOKS, ALERTS, ARCHIVE
+    if _SCRAPER_THREAD is not None:
+        return
+    ALERTS = AlertEngine(app.config["API_DB_PATH"])
+    ARCHIVE = ArchiveJob.from_env(app.config["API_DB_PATH"], app.config["API_ARCHIVE_DB_PATH"])
+    if ARCHIVE is not None:
+        ARCHIVE.start()
+    if REPLICATOR is not None:
+        REPLICATOR.enable_candidacy()
+    if _env_flag("WEBHOOKS_ENABLED", True):
+        WEBHOOKS = WebhookDispatcher.from_env(app.config["API_DB_PATH"])
+        WEBHOOKS.start()
+    # شروع ترد پس‌زمینه
+    _SCRAPER_THREAD = threading.Thread(target=scraper_worker, daemon=True)
+    _SCRAPER_THREAD.start()
+
+
+SNAPSHOT_POLL = float(os.environ.get("SNAPSHOT_POLL", "1"))
+_FOLLOWER_THREAD = None
+
+
+def _follow_snapshot_file() -> None:
+    # پروسه‌ای که اسکرپ نمی‌کند و REPLICATION_MODE ندارد، فایل snapshot نوشته شده توسط پروسه‌ی اسکرپر را دنبال می‌کند
+    while _SCRAPER_THREAD is None and REPLICATOR is None:
+        time.sleep(SNAPSHOT_POLL)
+        mtime = _snapshot_mtime()
+        if mtime is None or mtime == _SNAPSHOT_MTIME:
+            continue
+        try:
+            _restore_snapshot()
+            _refresh_bodies()
+        except Exception as e:
+            logging.error(f"Reloading snapshot failed: {e}")
+
+
+def start_snapshot_follower() -> None:
+    global _FOLLOWER_THREAD
+    if _FOLLOWER_THREAD is not None or _SCRAPER_THREAD is not None or REPLICATOR is not None:
+        return
+    _FOLLOWER_THREAD = threading.Thread(target=_follow_snapshot_file, name="snapshot-follower", daemon=True)
+    _FOLLOWER_THREAD.start()
+
+
+_restore_snapshot()
+
+REPLICATOR = SnapshotReplicator.from_env(_apply_replicated_snapshot)
+if REPLICATOR is not None:
+    REPLICATOR.start()
+
+# در پروسه‌های فقط-API اسکرپر (و selenium) بارگذاری نمی‌شود مگر SCRAPER_ENABLED=1 باشد؛
+# این پروسه‌ها به جایش snapshot پروسه‌ی اسکرپر را دنبال می‌کنند (اگر بعدا start_scraper صدا زده شود، دنبال‌کننده متوقف می‌شود)
+if _env_flag("SCRAPER_ENABLED", False):
+    start_scraper()
+else:
+    start_snapshot_follower()
+
+
+def _request_api_key() -> str | None:
+    return request.headers.get("x-api-key") or (request.view_args or {}).get("api_key")
+
+
+@app.before_request
+def _admit_request():
+    if ADMISSION is None or request.endpoint in _ADMISSION_EXEMPT:
+        return None
+    priority = ADMISSION.classify(
+        _request_api_key(),
+        bearer=request.headers.get("Authorization", "").startswith("Bearer "),
+    )
+    if not ADMISSION.acquire(priority):
+        response = jsonify({"error": "Server is overloaded, retry later."})
+        response.status_code = 503
+        response.headers["Retry-After"] = str(ADMISSION.retry_after_seconds(priority))
+        return response
+    g.admitted = True
+    return None
+
+
+@app.teardown_request
+def _release_admission(_exc=None):
+    if g.pop("admitted", False):
+        ADMISSION.release()
+
+
+@app.after_request
+def _remember_key_priority(response):
+    auth_row = g.get("api_key")
+    api_key = _request_api_key()
+    if ADMISSION is not None and auth_row and api_key:
+        ADMISSION.remember(api_key, auth_row["plan_slug"])
+    return response
+
+
+def _seconds_until_next() -> int:
+    # از next_update خود snapshot خوانده می‌شود، نه از SCHEDULER که در پروسه‌های فقط-API اجرا نمی‌شود
+    next_update = LATEST_PRICES.get("next_update")
+    if not next_update:
+        return 0
+    try:
+        return max(0, int(time.mktime(time.strptime(next_update, "%Y-%m-%d %H:%M:%S")) - time.time()))
+    except ValueError:
+        return 0
+
+
+@app.after_request
+def _add_cache_headers(response):
+    visibility = _PRICE_ENDPOINTS.get(request.endpoint)
+    if visibility and response.status_code == 200:
+        response.headers["Cache-Control"] = f"{visibility}, max-age={_seconds_until_next()}"
+    return response
+
+
+def _selection_error(error: SelectionError):
+    return jsonify({"error": str(error)}), error.status
+
+
+def _meter_current_key():
+    """Meter the request of ``g.api_key`` after its parameters were validated; a 429 response or None."""
+    usage = increment_usage_for_key(api_key_id=int(g.api_key["api_key_id"]))
+    if not usage.get("ok"):
+        return jsonify({"error": usage.get("error"), "usage": usage}), 429
+    g.api_usage = usage
+    return None
 
-# شروع ترد پس‌زمینه
-threading.Thread(target=scraper_worker, daemon=True).start()
 
 @app.route('/prices', methods=['GET'])
 def get_prices():
-    return jsonify(LATEST_PRICES)
+    try:
+        key = _selection_key("public", "all", request.args.get("symbols"))
+    except SelectionError as e:
+        return _selection_error(e)
+    return _negotiated_response(key)
 
 @app.route('/v1/prices', methods=['GET'])
-@require_metered_api_key
+@require_api_key
 def get_prices_v1():
-    scope = g.api_key.get("scope") or "all"
-    filtered_data = _filter_prices_by_scope(LATEST_PRICES.get("data", {}), scope)
-    return jsonify({
-        "data": filtered_data,
-        "last_updated": LATEST_PRICES.get("last_updated"),
-        "status": LATEST_PRICES.get("status"),
-    })
+    scope = g.api_key["scope"] or "all"
+    try:
+        key = _selection_key("private", scope, request.args.get("symbols"))
+    except SelectionError as e:
+        return _selection_error(e)
+    # درخواست نامعتبر (400/403) از سهمیه کم نمی‌کند
+    return _meter_current_key() or _negotiated_response(key)
 
 
 @app.route('/v1/key/<api_key>/prices', methods=['GET'])
@@ -163,21 +463,66 @@ def get_prices_by_key(api_key: str):
     auth_row = auth_api_key_value(api_key)
     if not auth_row:
         return jsonify({"error": "Invalid or inactive API key."}), 401
+    g.api_key = auth_row
+    scope = auth_row["scope"] or "all"
+    try:
+        key = _selection_key("private", scope, request.args.get("symbols"))
+    except SelectionError as e:
+        return _selection_error(e)
     usage = increment_usage_for_key(api_key_id=int(auth_row["api_key_id"]))
     if not usage.get("ok"):
         return jsonify({"error": usage.get("error"), "usage": usage}), 429
-    scope = auth_row.get("scope") or "all"
-    filtered_data = _filter_prices_by_scope(LATEST_PRICES.get("data", {}), scope)
-    return jsonify({
-        "data": filtered_data,
-        "last_updated": LATEST_PRICES.get("last_updated"),
-        "status": LATEST_PRICES.get("status"),
-        "usage": usage,
+    # بدنه شامل usage همین درخواست است و کش نمی‌شود؛ فقط فرمت و فشرده‌سازی مذاکره می‌شود
+    return _negotiated_response(payload={**_price_payload(key), "usage": usage})
+
+@app.route('/v1/history', methods=['GET'])
+@require_api_key
+def get_history_v1():
+    try:
+        end = datetime.date.fromisoformat(request.args.get("to") or time.strftime("%Y-%m-%d"))
+        start = datetime.date.fromisoformat(request.args.get("from") or (end - datetime.timedelta(days=29)).isoformat())
+    except ValueError:
+        return jsonify({"error": "from and to must be YYYY-MM-DD dates."}), 400
+    if start > end:
+        return jsonify({"error": "from is after to."}), 400
+    if (end - start).days >= HISTORY_MAX_DAYS:
+        return jsonify({"error": f"At most {HISTORY_MAX_DAYS} days per request."}), 400
+    scope = g.api_key["scope"] or "all"
+    try:
+        raw = request.args.get("symbols")
+        symbols = SELECTOR.symbols(SELECTOR.parse(raw, scope) if raw is not None else SELECTOR.scope_masks.get(scope, 0))
+    except SelectionError as e:
+        return _selection_error(e)
+    rejected = _meter_current_key()
+    if rejected is not None:
+        return rejected
+    return _negotiated_response(payload={
+        "data": HISTORY.query(symbols, start.isoformat(), end.isoformat()),
+        "from": start.isoformat(),
+        "to": end.isoformat(),
     })
 
 @app.route('/health', methods=['GET'])
 def health():
-    return jsonify({"ok": True, "status": LATEST_PRICES.get("status")})
+    body = {"ok": True, "status": LATEST_PRICES.get("status"), "scheduler": SCHEDULER.state(), "metering": metering_state()}
+    body["scrape"] = SCRAPE_PLAN.state()
+    if ADMISSION is not None:
+        body["admission"] = ADMISSION.state()
+    if REPLICATOR is not None:
+        body["replication"] = REPLICATOR.state()
+    return jsonify(body)
+
+@app.route('/admin/body-variants', methods=['GET'])
+@require_admin
+def body_variant_stats():
+    return jsonify(BODIES.stats())
+
+@app.route('/admin/archive', methods=['GET'])
+@require_admin
+def archive_report():
+    return jsonify({"sizes": table_sizes(get_db()), "job": ARCHIVE.state() if ARCHIVE is not None else None})
 
 if __name__ == '__main__':
+    if _env_flag("SCRAPER_ENABLED", True):
+        start_scraper()
     app.run(host='0.0.0.0', port=5001)
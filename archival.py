@@ -0,0 +1,422 @@
+"""Move cold API rows into a compressed archive database.
+
+Past-month ``usage_monthly`` rows and keys revoked long ago are copied to
+the archive file and then deleted from the API database, in small batches
+so no write lock is held for long. Run once from the command line, or let
+``start_scraper`` schedule it (``ARCHIVE_INTERVAL``).
+
+    python archival.py --report
+    python archival.py --keep-months 2 --revoked-days 30 --vacuum
+"""
+import argparse
+import datetime as _dt
+import json as _json
+import logging as _logging
+import os as _os
+import sqlite3 as _sqlite3
+import sys
+import threading as _threading
+import time as _time
+import zlib as _zlib
+
+_ARCHIVE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS archived_usage (
+  api_key_id INTEGER PRIMARY KEY,
+  months BLOB NOT NULL,
+  month_count INTEGER NOT NULL,
+  total_requests INTEGER NOT NULL,
+  first_month TEXT NOT NULL,
+  last_month TEXT NOT NULL,
+  updated_at TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS archived_api_keys (
+  id INTEGER PRIMARY KEY,
+  customer_id INTEGER NOT NULL,
+  plan_id INTEGER NOT NULL,
+  key_hash TEXT NOT NULL,
+  key_prefix TEXT NOT NULL,
+  key_last4 TEXT NOT NULL,
+  status TEXT NOT NULL,
+  created_at TEXT NOT NULL,
+  revoked_at TEXT,
+  archived_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_archived_api_keys_customer ON archived_api_keys(customer_id);
+"""
+
+# جدول‌هایی که اندازه‌شان قبل و بعد از آرشیو گزارش می‌شود
+_REPORTED_TABLES = ("api_keys", "usage_monthly")
+
+
+def _utcnow_iso(now: _dt.datetime | None = None) -> str:
+    return (now or _dt.datetime.utcnow()).replace(microsecond=0).isoformat() + "Z"
+
+
+def _month_cutoff(keep_months: int, now: _dt.datetime | None = None) -> str:
+    """First month that stays in the API database; earlier months are archived."""
+    now = now or _dt.datetime.utcnow()
+    index = now.year * 12 + (now.month - 1) - max(0, keep_months)
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+
+def pack_months(months: dict) -> bytes:
+    """``{month: [request_count, extra_quota]}`` as a zlib-compressed JSON blob."""
+    return _zlib.compress(_json.dumps(months, separators=(",", ":"), sort_keys=True).encode("utf-8"), 9)
+
+
+def unpack_months(blob: bytes) -> dict:
+    return _json.loads(_zlib.decompress(blob).decode("utf-8"))
+
+
+def default_archive_path(db_path: str) -> str:
+    """``api_archive.db`` next to the API database, so both live on the same volume."""
+    return _os.path.join(_os.path.dirname(db_path), "api_archive.db")
+
+
+def connect_archive(archive_path: str) -> _sqlite3.Connection:
+    parent = _os.path.dirname(archive_path)
+    if parent:
+        _os.makedirs(parent, exist_ok=True)
+    db = _sqlite3.connect(archive_path, timeout=30, isolation_level=None)
+    db.row_factory = _sqlite3.Row
+    db.executescript(_ARCHIVE_SCHEMA)
+    return db
+
+
+def table_sizes(db: _sqlite3.Connection, tables=_REPORTED_TABLES) -> dict:
+    """Bytes used by each table and its indexes, plus row counts and free pages."""
+    page_size = db.execute("PRAGMA page_size;").fetchone()[0]
+    out = {
+        "file_bytes": db.execute("PRAGMA page_count;").fetchone()[0] * page_size,
+        "free_bytes": db.execute("PRAGMA freelist_count;").fetchone()[0] * page_size,
+        "tables": {},
+    }
+    for table in tables:
+        out["tables"][table] = {"rows": db.execute(f"SELECT COUNT(*) FROM {table};").fetchone()[0]}
+    try:
+        rows = db.execute(
+            """
+            SELECT s.tbl_name AS tbl, s.type AS type, dbstat.name AS name, SUM(dbstat.pgsize) AS bytes
+            FROM dbstat JOIN sqlite_master AS s ON s.name = dbstat.name
+            GROUP BY dbstat.name;
+            """
+        ).fetchall()
+    except _sqlite3.OperationalError:
+        # sqlite بدون dbstat ساخته شده؛ فقط تعداد ردیف‌ها و اندازه‌ی کل فایل گزارش می‌شود
+        return out
+    for tbl, kind, name, size in rows:
+        entry = out["tables"].get(tbl)
+        if entry is None:
+            continue
+        if kind == "table":
+            entry["table_bytes"] = int(size)
+        else:
+            entry.setdefault("index_bytes", {})[name] = int(size)
+    return out
+
+
+class ArchiveJob:
+    """Batched move of cold usage and revoked keys into the archive database.
+
+    The archive is attached to the API connection and each usage batch is
+    merged into it and deleted from ``usage_monthly`` in one short
+    ``BEGIN IMMEDIATE`` transaction, so an interrupted run never counts a
+    month twice (this relies on the API database's rollback journal; SQLite
+    does not commit attached WAL databases atomically). Revoked keys are
+    copied first and deleted afterwards; a crash in between only copies
+    them again, which replaces the same rows. Usage of the last
+    ``keep_months`` months before the current one stays in place (quota
+    leases and deferred metering may still write to it). A revoked key is
+    only moved once it has no usage, webhook or alert rows left pointing at
+    it.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        archive_path: str,
+        *,
+        keep_months: int = 1,
+        revoked_days: int = 90,
+        batch_size: int = 500,
+        pause: float = 0.05,
+        interval: float = 86400.0,
+    ):
+        self.db_path = db_path
+        self.archive_path = archive_path
+        self.keep_months = int(keep_months)
+        self.revoked_days = int(revoked_days)
+        self.batch_size = max(1, int(batch_size))
+        self.pause = float(pause)
+        self.interval = float(interval)
+        self._stop = _threading.Event()
+        self._thread = None
+        self._lock = _threading.Lock()
+        self._last = None
+
+    @classmethod
+    def from_env(cls, db_path: str, archive_path: str) -> "ArchiveJob | None":
+        """None when ``ARCHIVE_INTERVAL=0`` (no scheduled runs)."""
+        interval = float(_os.environ.get("ARCHIVE_INTERVAL", "86400"))
+        if interval <= 0:
+            return None
+        return cls(
+            db_path,
+            archive_path,
+            keep_months=int(_os.environ.get("ARCHIVE_KEEP_MONTHS", "1")),
+            revoked_days=int(_os.environ.get("ARCHIVE_REVOKED_DAYS", "90")),
+            batch_size=int(_os.environ.get("ARCHIVE_BATCH_SIZE", "500")),
+            pause=float(_os.environ.get("ARCHIVE_BATCH_PAUSE", "0.05")),
+            interval=interval,
+        )
+
+    def _connect(self) -> _sqlite3.Connection:
+        db = _sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        db.row_factory = _sqlite3.Row
+        db.execute("PRAGMA foreign_keys = ON;")
+        return db
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = _threading.Thread(target=self._run, name="archive-job", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        # اولین اجرا کمی بعد از بالا آمدن سرویس، بعد هر interval ثانیه
+        delay = min(self.interval, 300.0)
+        while not self._stop.wait(delay):
+            try:
+                report = self.run_once()
+                _logging.info(
+                    f"Archived {report['usage_rows']} usage rows and {report['keys']} revoked keys in {report['elapsed_s']}s."
+                )
+            except Exception as e:
+                _logging.error(f"Archive job failed: {e}")
+            delay = self.interval
+
+    def run_once(self, now: _dt.datetime | None = None, vacuum: bool = False) -> dict:
+        now = now or _dt.datetime.utcnow()
+        started = _time.monotonic()
+        main = self._connect()
+        archive = connect_archive(self.archive_path)
+        try:
+            before = table_sizes(main)
+            main.execute("ATTACH DATABASE ? AS archive;", (self.archive_path,))
+            try:
+                usage_rows = self._archive_usage(main, _month_cutoff(self.keep_months, now), now)
+            finally:
+                main.execute("DETACH DATABASE archive;")
+            keys, kept = self._archive_keys(main, archive, _utcnow_iso(now - _dt.timedelta(days=self.revoked_days)), now)
+            if vacuum:
+                main.execute("VACUUM;")
+            else:
+                main.execute("PRAGMA optimize;")
+            report = {
+                "finished_at": _utcnow_iso(),
+                "usage_rows": usage_rows,
+                "keys": keys,
+                "keys_kept_with_references": kept,
+                "elapsed_s": round(_time.monotonic() - started, 3),
+                "before": before,
+                "after": table_sizes(main),
+                "archive_bytes": table_sizes(archive, ("archived_usage", "archived_api_keys"))["file_bytes"],
+            }
+        finally:
+            main.close()
+            archive.close()
+        with self._lock:
+            self._last = report
+        return report
+
+    def _archive_usage(self, main: _sqlite3.Connection, cutoff: str, now) -> int:
+        moved = 0
+        while not self._stop.is_set():
+            # کپی به آرشیو و حذف از دیتابیس API در یک تراکنش (آرشیو روی همین اتصال ATTACH شده)؛
+            # یا هر دو انجام می‌شوند یا هیچ‌کدام، پس ماهی دو بار جمع نمی‌شود
+            main.execute("BEGIN IMMEDIATE;")
+            try:
+                rows = main.execute(
+                    """
+                    SELECT rowid, api_key_id, month, request_count, extra_quota FROM usage_monthly
+                    WHERE month < ? ORDER BY rowid LIMIT ?;
+                    """,
+                    (cutoff, self.batch_size),
+                ).fetchall()
+                if not rows:
+                    main.execute("COMMIT;")
+                    break
+                by_key = {}
+                for r in rows:
+                    by_key.setdefault(int(r["api_key_id"]), {})[r["month"]] = [int(r["request_count"]), int(r["extra_quota"])]
+                for api_key_id, months in by_key.items():
+                    existing = main.execute(
+                        "SELECT months FROM archive.archived_usage WHERE api_key_id = ?;", (api_key_id,)
+                    ).fetchone()
+                    merged = unpack_months(existing["months"]) if existing else {}
+                    # ردیفی که بعد از آرشیو دوباره ساخته شده (مثلا me_add_requests دیرهنگام) مصرف تازه است و جمع می‌شود
+                    for month, (count, extra) in months.items():
+                        old_count, old_extra = merged.get(month, (0, 0))
+                        merged[month] = [old_count + count, old_extra + extra]
+                    main.execute(
+                        """
+                        INSERT OR REPLACE INTO archive.archived_usage
+                          (api_key_id, months, month_count, total_requests, first_month, last_month, updated_at)
+                        VALUES (?, ?, ?, ?, ?, ?, ?);
+                        """,
+                        (
+                            api_key_id,
+                            pack_months(merged),
+                            len(merged),
+                            sum(count for count, _extra in merged.values()),
+                            min(merged),
+                            max(merged),
+                            _utcnow_iso(now),
+                        ),
+                    )
+                main.executemany("DELETE FROM usage_monthly WHERE rowid = ?;", [(r["rowid"],) for r in rows])
+                main.execute("COMMIT;")
+            except BaseException:
+                main.execute("ROLLBACK;")
+                raise
+            moved += len(rows)
+            if self.pause:
+                _time.sleep(self.pause)
+        return moved
+
+    def _archive_keys(self, main: _sqlite3.Connection, archive: _sqlite3.Connection, revoked_before: str, now) -> tuple:
+        moved = 0
+        after_id = 0
+        while not self._stop.is_set():
+            rows = main.execute(
+                """
+                SELECT id, customer_id, plan_id, key_hash, key_prefix, key_last4, status, created_at, revoked_at
+                FROM api_keys
+                WHERE status = 'revoked' AND revoked_at < ? AND id > ?
+                  AND NOT EXISTS (SELECT 1 FROM usage_monthly WHERE usage_monthly.api_key_id = api_keys.id)
+                  AND NOT EXISTS (SELECT 1 FROM webhooks WHERE webhooks.api_key_id = api_keys.id)
+                  AND NOT EXISTS (SELECT 1 FROM alerts WHERE alerts.api_key_id = api_keys.id)
+                ORDER BY id LIMIT ?;
+                """,
+                (revoked_before, after_id, self.batch_size),
+            ).fetchall()
+            if not rows:
+                break
+            after_id = int(rows[-1]["id"])
+            archived_at = _utcnow_iso(now)
+            # کلید متنی (api_key / api_url) کلید باطل‌شده به آرشیو نمی‌رود؛ hash و prefix برای ممیزی کافی است
+            archive.execute("BEGIN IMMEDIATE;")
+            try:
+                archive.executemany(
+                    """
+                    INSERT OR REPLACE INTO archived_api_keys
+                      (id, customer_id, plan_id, key_hash, key_prefix, key_last4, status, created_at, revoked_at, archived_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
+                    """,
+                    [(*tuple(r), archived_at) for r in rows],
+                )
+                archive.execute("COMMIT;")
+            except BaseException:
+                archive.execute("ROLLBACK;")
+                raise
+
+            main.execute("BEGIN IMMEDIATE;")
+            try:
+                for r in rows:
+                    try:
+                        main.execute("SAVEPOINT key;")
+                        cursor = main.execute("DELETE FROM api_keys WHERE id = ? AND status = 'revoked';", (r["id"],))
+                        main.execute("RELEASE key;")
+                        moved += cursor.rowcount
+                    except _sqlite3.IntegrityError:
+                        # بین انتخاب و حذف ردیفی به این کلید اشاره کرده؛ این بار می‌ماند
+                        main.execute("ROLLBACK TO key;")
+                        main.execute("RELEASE key;")
+                main.execute("COMMIT;")
+            except BaseException:
+                main.execute("ROLLBACK;")
+                raise
+            if self.pause:
+                _time.sleep(self.pause)
+
+        kept = main.execute(
+            "SELECT COUNT(*) FROM api_keys WHERE status = 'revoked' AND revoked_at < ?;", (revoked_before,)
+        ).fetchone()[0]
+        return moved, int(kept)
+
+    def state(self) -> dict:
+        with self._lock:
+            last = self._last
+        return {
+            "interval": self.interval,
+            "keep_months": self.keep_months,
+            "revoked_days": self.revoked_days,
+            "last_run": last,
+        }
+
+
+def archived_usage(archive_path: str, *, api_key_id: int | None = None, month: str | None = None) -> list:
+    """Archived ``{api_key_id, month, request_count, extra_quota}`` rows, filtered like ``usage_monthly``."""
+    if not _os.path.exists(archive_path):
+        return []
+    db = connect_archive(archive_path)
+    try:
+        if api_key_id is not None:
+            rows = db.execute("SELECT api_key_id, months FROM archived_usage WHERE api_key_id = ?;", (api_key_id,)).fetchall()
+        elif month is not None:
+            rows = db.execute(
+                "SELECT api_key_id, months FROM archived_usage WHERE first_month <= ? AND last_month >= ?;", (month, month)
+            ).fetchall()
+        else:
+            rows = db.execute("SELECT api_key_id, months FROM archived_usage;").fetchall()
+    finally:
+        db.close()
+    out = []
+    for r in rows:
+        for row_month, (count, extra) in sorted(unpack_months(r["months"]).items()):
+            if month is None or row_month == month:
+                out.append({"api_key_id": int(r["api_key_id"]), "month": row_month, "request_count": count, "extra_quota": extra})
+    return out
+
+
+def archived_keys(archive_path: str, limit: int = 200) -> list:
+    if not _os.path.exists(archive_path):
+        return []
+    db = connect_archive(archive_path)
+    try:
+        return [dict(r) for r in db.execute("SELECT * FROM archived_api_keys ORDER BY id DESC LIMIT ?;", (limit,))]
+    finally:
+        db.close()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=_os.environ.get("API_DB_PATH") or _os.path.join("data", "api_manager.db"))
+    parser.add_argument("--archive", default=_os.environ.get("API_ARCHIVE_DB_PATH"))
+    parser.add_argument("--keep-months", type=int, default=int(_os.environ.get("ARCHIVE_KEEP_MONTHS", "1")))
+    parser.add_argument("--revoked-days", type=int, default=int(_os.environ.get("ARCHIVE_REVOKED_DAYS", "90")))
+    parser.add_argument("--batch-size", type=int, default=int(_os.environ.get("ARCHIVE_BATCH_SIZE", "500")))
+    parser.add_argument("--vacuum", action="store_true", help="VACUUM the API database afterwards (locks it while it runs)")
+    parser.add_argument("--report", action="store_true", help="only print current table and index sizes")
+    args = parser.parse_args(argv)
+    args.archive = args.archive or default_archive_path(args.db)
+
+    if args.report:
+        db = _sqlite3.connect(args.db)
+        try:
+            print(_json.dumps(table_sizes(db), indent=2))
+        finally:
+            db.close()
+        return 0
+    job = ArchiveJob(args.db, args.archive, keep_months=args.keep_months, revoked_days=args.revoked_days,
+                     batch_size=args.batch_size, interval=0)
+    print(_json.dumps(job.run_once(vacuum=args.vacuum), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
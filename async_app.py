@@ -0,0 +1,222 @@
+import asyncio
+import concurrent.futures
+import logging
+import os
+
+# این پروسه کنار app.py اجرا می‌شود و به طور پیش‌فرض خودش اسکرپ نمی‌کند؛ قیمت‌ها از فایل snapshot
+# (یا REPLICATION_MODE) می‌آیند. باید قبل از import کردن app ست شود.
+os.environ["SCRAPER_ENABLED"] = os.environ.get("ASYNC_SCRAPER_ENABLED", "0")
+
+from aiohttp import web
+from werkzeug.datastructures import Accept, MIMEAccept
+from werkzeug.http import parse_accept_header
+
+import app as flask_app
+from api_manager import auth_api_key_value, increment_usage_for_key, metering_state
+
+EXECUTOR = web.AppKey("executor", concurrent.futures.ThreadPoolExecutor)
+STREAM_UPDATES = web.AppKey("stream_updates", asyncio.Condition)
+SHUTTING_DOWN = web.AppKey("shutting_down", asyncio.Event)
+
+_SNAPSHOT_POLL = float(os.environ.get("ASYNC_SNAPSHOT_POLL", "1"))
+_MAX_PENDING = int(os.environ.get("ASYNC_MAX_PENDING", "256"))
+_STREAM_KEEPALIVE = float(os.environ.get("ASYNC_STREAM_KEEPALIVE", "15"))
+_pending = 0
+
+
+def _init_db_thread() -> None:
+    # هر رشته‌ی executor یک app context دائمی دارد، پس get_db() یک اتصال sqlite ثابت برای همان رشته نگه می‌دارد
+    flask_app.app.app_context().push()
+
+
+def _authorize_and_meter(api_key: str, symbols: str | None) -> tuple:
+    """``(auth_row, body key, usage)``; an invalid ``symbols=`` raises SelectionError before metering."""
+    auth_row = auth_api_key_value(api_key)
+    if not auth_row:
+        return None, None, None
+    key = flask_app._selection_key("private", auth_row["scope"] or "all", symbols)
+    usage = increment_usage_for_key(api_key_id=int(auth_row["api_key_id"]))
+    return dict(auth_row), key, usage
+
+
+async def _run_db(request: web.Request, func, *args):
+    """Run blocking api_manager work on the bounded executor; None when the backlog is full."""
+    global _pending
+    if _pending >= _MAX_PENDING:
+        return None
+    _pending += 1
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(request.app[EXECUTOR], func, *args)
+    finally:
+        _pending -= 1
+
+
+def _overloaded() -> web.Response:
+    return web.json_response(
+        {"error": "Server is overloaded, retry later."},
+        status=503,
+        headers={"Retry-After": os.environ.get("ADMISSION_RETRY_AFTER", "2")},
+    )
+
+
+def _negotiated(request: web.Request, visibility: str, key: tuple | None = None, payload: dict | None = None) -> web.Response:
+    bodies = flask_app.BODIES
+    media_type, coding = bodies.negotiate(
+        parse_accept_header(request.headers.get("Accept"), MIMEAccept),
+        parse_accept_header(request.headers.get("Accept-Encoding"), Accept),
+    )
+    if key is not None:
+        body, coding = bodies.get(key, media_type, coding)
+    else:
+        body, coding = bodies.render(payload, media_type, coding)
+    headers = {
+        "Content-Type": media_type,
+        "Vary": "Accept, Accept-Encoding",
+        "Cache-Control": f"{visibility}, max-age={flask_app._seconds_until_next()}",
+    }
+    if coding != "identity":
+        headers["Content-Encoding"] = coding
+    return web.Response(body=body, headers=headers)
+
+
+def _selection_error(error) -> web.Response:
+    return web.json_response({"error": str(error)}, status=error.status)
+
+
+def _selection(request: web.Request, visibility: str, scope: str) -> tuple:
+    """``(key, None)`` for the request's ``symbols=`` selection, or ``(None, error response)``."""
+    try:
+        return flask_app._selection_key(visibility, scope, request.query.get("symbols")), None
+    except flask_app.SelectionError as e:
+        return None, _selection_error(e)
+
+
+async def _authorize_and_meter_request(request: web.Request, api_key: str):
+    """``(auth_row, key, usage)``, or an error response (overload, invalid selection)."""
+    try:
+        result = await _run_db(request, _authorize_and_meter, api_key, request.query.get("symbols"))
+    except flask_app.SelectionError as e:
+        return _selection_error(e)
+    return _overloaded() if result is None else result
+
+
+async def get_prices(request: web.Request) -> web.Response:
+    key, error = _selection(request, "public", "all")
+    return error or _negotiated(request, "public", key=key)
+
+
+async def get_prices_v1(request: web.Request) -> web.Response:
+    api_key = request.headers.get("x-api-key")
+    if not api_key:
+        return web.json_response({"error": "Missing x-api-key header."}, status=401)
+    result = await _authorize_and_meter_request(request, api_key)
+    if isinstance(result, web.Response):
+        return result
+    auth_row, key, usage = result
+    if not auth_row:
+        return web.json_response({"error": "Invalid or inactive API key."}, status=401)
+    if not usage.get("ok"):
+        return web.json_response({"error": usage.get("error"), "usage": usage}, status=429)
+    return _negotiated(request, "private", key=key)
+
+
+async def get_prices_by_key(request: web.Request) -> web.Response:
+    result = await _authorize_and_meter_request(request, request.match_info["api_key"])
+    if isinstance(result, web.Response):
+        return result
+    auth_row, key, usage = result
+    if not auth_row:
+        return web.json_response({"error": "Invalid or inactive API key."}, status=401)
+    if not usage.get("ok"):
+        return web.json_response({"error": usage.get("error"), "usage": usage}, status=429)
+    payload = {**flask_app._price_payload(key), "usage": usage}
+    return _negotiated(request, "private", payload=payload)
+
+
+async def stream_prices(request: web.Request) -> web.StreamResponse:
+    """Server-sent events: the public price body on connect and after every new snapshot."""
+    key, error = _selection(request, "public", "all")
+    if error is not None:
+        return error
+    response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+    await response.prepare(request)
+    updates = request.app[STREAM_UPDATES]
+    closing = request.app[SHUTTING_DOWN]
+    try:
+        while not closing.is_set():
+            body, _coding = flask_app.BODIES.get(key, "application/json", "identity")
+            await response.write(b"event: prices\ndata: " + body + b"\n\n")
+            while not closing.is_set():
+                async with updates:
+                    try:
+                        await asyncio.wait_for(updates.wait(), _STREAM_KEEPALIVE)
+                        break
+                    except asyncio.TimeoutError:
+                        pass
+                await response.write(b": keep-alive\n\n")
+    except ConnectionResetError:
+        pass
+    return response
+
+
+async def health(request: web.Request) -> web.Response:
+    body = {
+        "ok": True,
+        "status": flask_app.LATEST_PRICES.get("status"),
+        "source": flask_app.LATEST_PRICES.get("source"),
+        "metering": metering_state(),
+        "pending_db": _pending,
+    }
+    if flask_app.REPLICATOR is not None:
+        body["replication"] = flask_app.REPLICATOR.state()
+    return web.json_response(body)
+
+
+async def _follow_snapshots(app: web.Application) -> None:
+    # فایل snapshot را ترد دنبال‌کننده‌ی app.py (یا تکثیر) بارگذاری می‌کند؛ اینجا فقط جریان‌های SSE بیدار می‌شوند
+    last_generation = flask_app.BODIES.generation
+    while True:
+        generation = flask_app.BODIES.generation
+        if generation != last_generation:
+            last_generation = generation
+            async with app[STREAM_UPDATES]:
+                app[STREAM_UPDATES].notify_all()
+        await asyncio.sleep(_SNAPSHOT_POLL)
+
+
+async def _background(app: web.Application):
+    task = asyncio.create_task(_follow_snapshots(app))
+    yield
+    task.cancel()
+    app[EXECUTOR].shutdown(wait=False)
+
+
+async def _close_streams(app: web.Application) -> None:
+    app[SHUTTING_DOWN].set()
+    async with app[STREAM_UPDATES]:
+        app[STREAM_UPDATES].notify_all()
+
+
+def create_app() -> web.Application:
+    app = web.Application()
+    app[EXECUTOR] = concurrent.futures.ThreadPoolExecutor(
+        max_workers=int(os.environ.get("ASYNC_DB_WORKERS", "8")),
+        thread_name_prefix="api-db",
+        initializer=_init_db_thread,
+    )
+    app[STREAM_UPDATES] = asyncio.Condition()
+    app[SHUTTING_DOWN] = asyncio.Event()
+    app.cleanup_ctx.append(_background)
+    app.on_shutdown.append(_close_streams)
+    app.router.add_get("/prices", get_prices)
+    app.router.add_get("/prices/stream", stream_prices)
+    app.router.add_get("/v1/prices", get_prices_v1)
+    app.router.add_get("/v1/key/{api_key}/prices", get_prices_by_key)
+    app.router.add_get("/health", health)
+    return app
+
+
+if __name__ == "__main__":
+    logging.info("Starting async price server")
+    web.run_app(create_app(), host="0.0.0.0", port=int(os.environ.get("ASYNC_PORT", "5002")), access_log=None)
@@ -0,0 +1,266 @@
+"""Import daily historical rates from bonbast's archive pages into the history store.
+
+Days are fetched concurrently under a shared request-rate limit and written
+in batches; each batch commits its prices together with the list of days it
+covers, so rerunning the same command after an interruption only fetches
+days that were not committed yet.
+
+    python backfill.py --start 2023-01-01 --end 2023-12-31
+    python backfill.py --start 2024-01-01 --workers 8 --rate 4 --batch-days 60
+    BONBAST_ARCHIVE_URL='http://127.0.0.1:8000/archive/{date:%Y/%m/%d}' python backfill.py --start 2024-01-01
+"""
+import argparse
+import concurrent.futures
+import datetime
+import html.parser
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from history_store import HistoryStore
+from scrape_plan import extract_html
+from scraper import BONBAST_URL, TARGETS
+
+# {date} یک datetime.date است، پس قالب می‌تواند هر فرمت strftime را داشته باشد
+ARCHIVE_URL = os.environ.get("BONBAST_ARCHIVE_URL") or BONBAST_URL.rstrip("/") + "/archive/{date:%Y/%m/%d}"
+DEFAULT_HISTORY_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "history.db")
+
+# کدهای سه‌حرفی ارزها در جدول‌های آرشیو (برای صفحه‌هایی که ID المنت ندارند)
+_ROW_CODES = {symbol.upper(): symbol for symbol in TARGETS if len(symbol) == 3}
+
+# خطاهایی که تکرار درخواست برایشان معنی دارد
+_RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+class ArchiveFetchError(Exception):
+    pass
+
+
+class RateLimiter:
+    """Spaces requests at most ``rate`` per second across all worker threads."""
+
+    def __init__(self, rate: float, clock=time.monotonic, sleep=time.sleep):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def acquire(self) -> None:
+        with self._lock:
+            now = self._clock()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            self._sleep(slot - now)
+
+    def pause(self, seconds: float) -> None:
+        """Push every worker's next request back, e.g. after a 429 with Retry-After."""
+        with self._lock:
+            self._next = max(self._next, self._clock() + seconds)
+
+
+class _ArchiveRowParser(html.parser.HTMLParser):
+    """Table rows as lists of cell texts."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.rows = []
+        self._row = None
+        self._cell = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "tr":
+            self._row = []
+        elif tag in ("td", "th") and self._row is not None:
+            self._cell = []
+
+    def handle_endtag(self, tag):
+        if tag in ("td", "th") and self._row is not None and self._cell is not None:
+            self._row.append(" ".join("".join(self._cell).split()))
+            self._cell = None
+        elif tag == "tr" and self._row is not None:
+            self.rows.append(self._row)
+            self._row = None
+
+    def handle_data(self, data):
+        if self._cell is not None:
+            self._cell.append(data)
+
+
+def _looks_like_price(text: str) -> bool:
+    digits = text.replace(",", "").replace(".", "", 1)
+    return digits.isdigit()
+
+
+def parse_archive_page(body: str) -> dict:
+    """Values for every TARGETS symbol; None for symbols the page does not have.
+
+    Pages that use the live element ids are read like the live page; for
+    the rest, currency rows are matched by their code in the first cell and
+    take the first price-looking cell after it.
+    """
+    values = extract_html(body, TARGETS)
+    if all(value is not None for value in values.values()):
+        return values
+    parser = _ArchiveRowParser()
+    parser.feed(body)
+    parser.close()
+    for row in parser.rows:
+        symbol = _ROW_CODES.get(row[0].upper()) if row else None
+        if symbol is None or values[symbol] is not None:
+            continue
+        values[symbol] = next((cell for cell in row[1:] if _looks_like_price(cell)), None)
+    return values
+
+
+def fetch_day(day: datetime.date, *, url_template: str, limiter: RateLimiter, timeout: float, retries: int) -> dict:
+    """Fetch and parse one archive day; a 404 counts as a day without prices."""
+    url = url_template.format(date=day)
+    request = urllib.request.Request(url, headers={"User-Agent": "bonbast-backfill"})
+    last_error = None
+    for attempt in range(retries + 1):
+        limiter.acquire()
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                body = response.read().decode(response.headers.get_content_charset() or "utf-8", errors="replace")
+            return parse_archive_page(body)
+        except urllib.error.HTTPError as exc:
+            if exc.code == 404:
+                return {symbol: None for symbol in TARGETS}
+            if exc.code not in _RETRY_STATUSES:
+                raise ArchiveFetchError(f"{url}: HTTP {exc.code}") from exc
+            last_error = f"HTTP {exc.code}"
+            retry_after = exc.headers.get("Retry-After") if exc.headers else None
+            if exc.code == 429 and retry_after and retry_after.isdigit():
+                # سرور خواسته آهسته‌تر برویم؛ همه‌ی workerها عقب می‌افتند نه فقط این یکی
+                limiter.pause(float(retry_after))
+                continue
+        except (urllib.error.URLError, TimeoutError, ConnectionError) as exc:
+            last_error = str(exc)
+        time.sleep(min(30.0, 0.5 * 2 ** attempt) * (0.5 + random.random()))
+    raise ArchiveFetchError(f"{url}: {last_error} after {retries + 1} attempts")
+
+
+def _days(start: datetime.date, end: datetime.date):
+    day = start
+    while day <= end:
+        yield day
+        day += datetime.timedelta(days=1)
+
+
+def backfill(
+    store: HistoryStore,
+    start: datetime.date,
+    end: datetime.date,
+    *,
+    url_template: str = ARCHIVE_URL,
+    workers: int = 4,
+    rate: float = 2.0,
+    batch_days: int = 30,
+    timeout: float = 20.0,
+    retries: int = 4,
+    force: bool = False,
+) -> dict:
+    """Import ``start..end`` (inclusive) and return a summary.
+
+    Days that fail after all retries are not checkpointed, so the next run
+    picks them up again. At most ``workers * 2`` days are in flight at once,
+    which keeps an interrupted run from losing more than that plus one
+    uncommitted batch of work.
+    """
+    imported = set() if force else store.imported_days(start.isoformat(), end.isoformat())
+    todo = [day for day in _days(start, end) if day.isoformat() not in imported]
+    limiter = RateLimiter(rate)
+    summary = {"requested": (end - start).days + 1, "skipped": len(imported), "fetched": 0, "rows": 0, "failed": []}
+    batch = {}
+    started = time.monotonic()
+
+    def flush() -> None:
+        if batch:
+            summary["rows"] += store.write_days(batch)
+            batch.clear()
+
+    pending = iter(todo)
+    in_flight = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="backfill") as pool:
+        try:
+            while True:
+                while len(in_flight) < workers * 2:
+                    day = next(pending, None)
+                    if day is None:
+                        break
+                    future = pool.submit(fetch_day, day, url_template=url_template, limiter=limiter,
+                                         timeout=timeout, retries=retries)
+                    in_flight[future] = day
+                if not in_flight:
+                    break
+                done, _ = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    day = in_flight.pop(future)
+                    try:
+                        batch[day.isoformat()] = future.result()
+                        summary["fetched"] += 1
+                    except ArchiveFetchError as exc:
+                        logging.warning(f"Backfill of {day} failed: {exc}")
+                        summary["failed"].append(day.isoformat())
+                if len(batch) >= batch_days:
+                    flush()
+                    logging.info(f"Backfill: {summary['fetched']}/{len(todo)} days fetched, {summary['rows']} rows written.")
+        finally:
+            for future in in_flight:
+                future.cancel()
+            # روزهای کامل‌شده حتی در صورت قطع شدن (Ctrl+C) ذخیره می‌شوند
+            flush()
+    summary["elapsed_s"] = round(time.monotonic() - started, 2)
+    summary["failed"].sort()
+    return summary
+
+
+def _date(text: str) -> datetime.date:
+    return datetime.date.fromisoformat(text)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--start", type=_date, required=True, help="first day, YYYY-MM-DD")
+    parser.add_argument("--end", type=_date, default=datetime.date.today() - datetime.timedelta(days=1),
+                        help="last day, YYYY-MM-DD (default: yesterday)")
+    parser.add_argument("--url", default=ARCHIVE_URL, help="archive URL template with a {date} field")
+    parser.add_argument("--db", default=None, help="history database (default: HISTORY_DB_PATH or data/history.db)")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--rate", type=float, default=2.0, help="max archive requests per second")
+    parser.add_argument("--batch-days", type=int, default=30, help="days per write transaction")
+    parser.add_argument("--timeout", type=float, default=20.0)
+    parser.add_argument("--retries", type=int, default=4)
+    parser.add_argument("--force", action="store_true", help="refetch days that were already imported")
+    args = parser.parse_args(argv)
+    if args.end < args.start:
+        parser.error("--end is before --start")
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    store = HistoryStore(args.db) if args.db else HistoryStore.from_env(DEFAULT_HISTORY_DB)
+    summary = backfill(
+        store,
+        args.start,
+        args.end,
+        url_template=args.url,
+        workers=args.workers,
+        rate=args.rate,
+        batch_days=args.batch_days,
+        timeout=args.timeout,
+        retries=args.retries,
+        force=args.force,
+    )
+    print(json.dumps(summary))
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,74 @@
+"""Alert index benchmark: build time and per-snapshot evaluation cost.
+
+    python bench/alert_bench.py --rules 1000000 --snapshots 200
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from alerts import ALERT_KINDS, AlertIndex  # noqa: E402
+from scraper import TARGETS  # noqa: E402
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rules", type=int, default=1_000_000)
+    parser.add_argument("--snapshots", type=int, default=200)
+    parser.add_argument("--volatility", type=float, default=0.003, help="stdev of per-snapshot relative moves")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    symbols = list(TARGETS)
+    prices = {s: rng.uniform(1_000, 100_000) for s in symbols}
+
+    rules = []
+    for rule_id in range(1, args.rules + 1):
+        symbol = rng.choice(symbols)
+        kind = rng.choice(ALERT_KINDS)
+        if kind == "move_pct":
+            rules.append({"id": rule_id, "symbol": symbol, "kind": kind, "value": rng.uniform(0.5, 5), "reference": prices[symbol]})
+        else:
+            rules.append({"id": rule_id, "symbol": symbol, "kind": kind, "value": prices[symbol] * rng.uniform(0.9, 1.1)})
+
+    index = AlertIndex()
+    started = time.perf_counter()
+    index.load(rules)
+    build_s = time.perf_counter() - started
+
+    timings = []
+    rearm_timings = []
+    fired_total = 0
+    for _ in range(args.snapshots):
+        new_prices = {s: p * (1 + rng.gauss(0, args.volatility)) for s, p in prices.items()}
+        started = time.perf_counter()
+        rearm = []
+        for symbol, new in new_prices.items():
+            for rule, _threshold, _direction in index.evaluate(symbol, prices[symbol], new):
+                fired_total += 1
+                if rule["kind"] == "move_pct":
+                    rearm.append((rule["id"], new))
+        evaluated = time.perf_counter()
+        index.rearm(rearm)
+        timings.append(evaluated - started)
+        rearm_timings.append(time.perf_counter() - evaluated)
+        prices = new_prices
+
+    timings.sort()
+    print(f"rules: {len(index):,}  build: {build_s:.2f}s")
+    print(
+        f"evaluate per snapshot: mean {statistics.fmean(timings) * 1000:.2f} ms, "
+        f"p50 {timings[len(timings) // 2] * 1000:.2f} ms, max {timings[-1] * 1000:.2f} ms"
+    )
+    print(f"re-arm move_pct rules per snapshot: mean {statistics.fmean(rearm_timings) * 1000:.2f} ms")
+    print(f"fired: {fired_total:,} total, {fired_total / args.snapshots:,.0f} per snapshot")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,179 @@
+"""Seed a large API database, archive it, and compare before and after.
+
+Creates ``--customers`` customers with a key rotated ``--rotations`` times
+each (older keys revoked long ago) and ``--months`` months of usage per key,
+then runs the archive job while a thread keeps metering one key. Reports:
+hot-path query latency before/after (key auth, /me/keys listing, metered
+increment), the worst increment latency seen while the job ran (how long
+its write locks held others up), table and index sizes, and whether
+admin usage totals per month are unchanged once archived rows are merged in.
+
+    python bench/archive_bench.py --customers 2000 --months 24
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+
+def _months_back(count: int) -> list:
+    now = time.gmtime()
+    index = now.tm_year * 12 + now.tm_mon - 1
+    return [f"{(index - i) // 12:04d}-{(index - i) % 12 + 1:02d}" for i in range(count)]
+
+
+def _seed(db, customers: int, rotations: int, months: list) -> tuple:
+    plan_id = db.execute("SELECT id FROM plans WHERE slug = 'all-business';").fetchone()[0]
+    db.execute("UPDATE plans SET monthly_quota = 100000000 WHERE id = ?;", (plan_id,))
+    rng = random.Random(7)
+    active = []
+    db.execute("BEGIN;")
+    for c in range(customers):
+        cur = db.execute(
+            "INSERT INTO customers (email, supabase_user_id, created_at) VALUES (?, ?, '2020-01-01T00:00:00Z');",
+            (f"c{c}@example.com", f"user-{c}"),
+        )
+        customer_id = cur.lastrowid
+        for r in range(rotations + 1):
+            revoked = r < rotations
+            cur = db.execute(
+                """
+                INSERT INTO api_keys (customer_id, plan_id, key_hash, key_prefix, key_last4, status, created_at, revoked_at)
+                VALUES (?, ?, ?, 'bb_live', ?, ?, '2020-01-01T00:00:00Z', ?);
+                """,
+                (customer_id, plan_id, f"hash-{c}-{r}", f"{r:04d}", "revoked" if revoked else "active",
+                 "2021-01-01T00:00:00Z" if revoked else None),
+            )
+            key_id = cur.lastrowid
+            # کلیدهای باطل‌شده فقط در ماه‌های قدیمی مصرف داشته‌اند
+            for month in (months[2 + rotations - r::rotations + 1] if revoked else months):
+                db.execute(
+                    "INSERT INTO usage_monthly (api_key_id, month, request_count, extra_quota) VALUES (?, ?, ?, 0);",
+                    (key_id, month, rng.randint(1, 50_000)),
+                )
+            if not revoked:
+                active.append((key_id, f"user-{c}", customer_id, f"hash-{c}-{r}"))
+    db.execute("COMMIT;")
+    return active
+
+
+def _time_queries(db, active: list, month: str, samples: int) -> dict:
+    import api_manager
+
+    picks = random.Random(1).sample(active, min(samples, len(active)))
+    out = {}
+
+    def timed(name, fn):
+        durations = []
+        for key_id, user_id, customer_id, key_hash in picks:
+            started = time.perf_counter()
+            fn(key_id, user_id, customer_id, key_hash)
+            durations.append(time.perf_counter() - started)
+        out[name + "_p50_us"] = round(statistics.median(durations) * 1e6, 1)
+
+    timed("auth", lambda k, u, c, h: db.execute(
+        "SELECT api_keys.id, plans.slug FROM api_keys JOIN plans ON plans.id = api_keys.plan_id WHERE api_keys.key_hash = ?;",
+        (h,)).fetchone())
+    timed("me_keys", lambda k, u, c, h: api_manager._load_customer_keys(db, u, month))
+    timed("increment", lambda k, u, c, h: api_manager._increment_usage_or_reject(db, api_key_id=k))
+    return out
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--customers", type=int, default=2000)
+    parser.add_argument("--rotations", type=int, default=3, help="revoked keys per customer")
+    parser.add_argument("--months", type=int, default=24)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--samples", type=int, default=500)
+    parser.add_argument("--meter-interval", type=float, default=0.002, help="pause between metered requests during the job")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args(argv)
+
+    tmp = tempfile.mkdtemp(prefix="archive_bench_")
+    os.environ.update({
+        "API_DB_PATH": os.path.join(tmp, "api.db"),
+        "API_ARCHIVE_DB_PATH": os.path.join(tmp, "archive.db"),
+        "API_KEY_PEPPER_PATH": os.path.join(tmp, "pepper"),
+    })
+    from flask import Flask
+
+    import api_manager
+    from archival import ArchiveJob
+
+    app = Flask("archive_bench", root_path=REPO_ROOT)
+    api_manager.init_api_manager(app)
+    months = _months_back(args.months)
+    with app.test_request_context():
+        db = api_manager.get_db()
+        db.isolation_level = None
+        active = _seed(db, args.customers, args.rotations, months)
+        db.isolation_level = ""
+        totals_before = {m: db.execute("SELECT SUM(request_count) FROM usage_monthly WHERE month = ?;", (m,)).fetchone()[0]
+                         for m in months}
+        before = _time_queries(db, active, months[0], args.samples)
+
+    job = ArchiveJob(os.environ["API_DB_PATH"], os.environ["API_ARCHIVE_DB_PATH"], batch_size=args.batch_size,
+                     revoked_days=90, interval=0)
+    stop = threading.Event()
+    waits = []
+
+    def meter() -> None:
+        with app.test_request_context():
+            conn = api_manager.get_db()
+            key_id = active[0][0]
+            while not stop.is_set():
+                started = time.perf_counter()
+                api_manager._increment_usage_or_reject(conn, api_key_id=key_id)
+                waits.append(time.perf_counter() - started)
+                time.sleep(args.meter_interval)
+
+    metering = threading.Thread(target=meter)
+    metering.start()
+    report = job.run_once()
+    stop.set()
+    metering.join()
+
+    with app.test_request_context():
+        db = api_manager.get_db()
+        after = _time_queries(db, active, months[0], args.samples)
+        client = app.test_client()
+        os.environ["ADMIN_TOKEN"] = "bench"
+        mismatched = []
+        for m in months[1:]:
+            body = client.get(f"/admin/usage?month={m}", headers={"x-admin-token": "bench"}).get_json()
+            if body["total_requests"] != totals_before[m]:
+                mismatched.append(m)
+
+    waits.sort()
+    results = {
+        "archived_usage_rows": report["usage_rows"],
+        "archived_keys": report["keys"],
+        "job_s": report["elapsed_s"],
+        "increments_during_job": len(waits),
+        "increment_max_ms_during_job": round(waits[-1] * 1000, 2) if waits else None,
+        "increment_p99_ms_during_job": round(waits[int(len(waits) * 0.99)] * 1000, 2) if waits else None,
+        "before": before,
+        "after": after,
+        "sizes_before": report["before"]["tables"],
+        "sizes_after": report["after"]["tables"],
+        "archive_bytes": report["archive_bytes"],
+        "admin_totals_match": not mismatched,
+    }
+    print(json.dumps(results, indent=2))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    return 0 if not mismatched else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,193 @@
+"""End-to-end check of backfill.py against a local stand-in archive server.
+
+The stand-in serves one deterministic archive page per day: currencies as
+code rows without element ids, gold, coins and bitcoin with the live ids,
+and a 404 on Fridays. It can inject 503s and 429s with Retry-After. The
+backfill runs as a subprocess, is killed with SIGKILL part way through,
+then rerun to completion; afterwards every day's values are compared with
+what the server generated, and the request log is checked for refetches and
+for the request rate staying under ``--rate``.
+
+    python bench/backfill_bench.py --days 365 --rate 50 --workers 8
+    python bench/backfill_bench.py --days 120 --rate 20 --error-rate 0.05 --kill-after 2
+"""
+import argparse
+import collections
+import datetime
+import hashlib
+import http.server
+import json
+import os
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from scraper import TARGETS  # noqa: E402
+
+_CURRENCIES = [symbol for symbol in TARGETS if len(symbol) == 3]
+
+
+def expected_value(day: str, symbol: str) -> str:
+    digest = hashlib.blake2b(f"{day}:{symbol}".encode(), digest_size=4).digest()
+    return f"{10_000 + int.from_bytes(digest, 'big') % 9_990_000:,}"
+
+
+def archive_page(day: str) -> str:
+    rows = []
+    for symbol in _CURRENCIES:
+        sell = expected_value(day, symbol)
+        rows.append(f"<tr><td>{symbol.upper()}</td><td>{symbol} name</td><td>{sell}</td><td>{sell}</td></tr>")
+    for symbol, element_id in TARGETS.items():
+        if symbol not in _CURRENCIES:
+            rows.append(f'<tr><td>{symbol}</td><td id="{element_id}">{expected_value(day, symbol)}</td></tr>')
+    return f"<html><body><h1>Archive {day}</h1><table>{''.join(rows)}</table></body></html>"
+
+
+class ArchiveHandler(http.server.BaseHTTPRequestHandler):
+    error_rate = 0.0
+    throttle_every = 0
+    log = []
+    lock = threading.Lock()
+
+    def do_GET(self):
+        parts = self.path.strip("/").split("/")
+        if len(parts) != 4 or parts[0] != "archive":
+            self.send_error(404)
+            return
+        day = "-".join(parts[1:])
+        with self.lock:
+            self.log.append((time.monotonic(), day))
+            n = len(self.log)
+        if self.throttle_every and n % self.throttle_every == 0:
+            self.send_response(429)
+            self.send_header("Retry-After", "1")
+            self.end_headers()
+            return
+        # خطای قطعی بر اساس شماره‌ی درخواست تا تکرار درخواست همان روز موفق شود
+        if self.error_rate and (n * 2654435761) % 1000 < self.error_rate * 1000:
+            self.send_error(503)
+            return
+        if datetime.date.fromisoformat(day).weekday() == 4:
+            self.send_error(404)
+            return
+        body = archive_page(day).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _run_backfill(args, base: str, db: str, start: datetime.date, end: datetime.date, kill_after: float | None) -> int:
+    cmd = [
+        sys.executable, os.path.join(REPO_ROOT, "backfill.py"),
+        "--start", start.isoformat(), "--end", end.isoformat(),
+        "--url", base + "/archive/{date:%Y/%m/%d}", "--db", db,
+        "--workers", str(args.workers), "--rate", str(args.rate), "--batch-days", str(args.batch_days),
+    ]
+    proc = subprocess.Popen(cmd, cwd=REPO_ROOT, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    if kill_after is None:
+        out, _ = proc.communicate()
+        print("  summary:", out.strip().splitlines()[-1] if out.strip() else "-")
+        return proc.returncode
+    try:
+        proc.wait(timeout=kill_after)
+    except subprocess.TimeoutExpired:
+        proc.send_signal(signal.SIGKILL)
+        proc.wait()
+    return proc.returncode
+
+
+def _max_rate(times: list, window: float = 1.0) -> int:
+    best, lo = 0, 0
+    for hi, t in enumerate(times):
+        while t - times[lo] > window:
+            lo += 1
+        best = max(best, hi - lo + 1)
+    return best
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=50)
+    parser.add_argument("--batch-days", type=int, default=30)
+    parser.add_argument("--error-rate", type=float, default=0.02, help="share of requests answered with 503")
+    parser.add_argument("--throttle-every", type=int, default=97, help="answer every Nth request with 429 (0: never)")
+    parser.add_argument("--kill-after", type=float, default=None, help="seconds before the first run is killed")
+    args = parser.parse_args(argv)
+
+    ArchiveHandler.error_rate = args.error_rate
+    ArchiveHandler.throttle_every = args.throttle_every
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), ArchiveHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+
+    end = datetime.date(2024, 12, 31)
+    start = end - datetime.timedelta(days=args.days - 1)
+    db = os.path.join(tempfile.mkdtemp(prefix="backfill_bench_"), "history.db")
+    kill_after = args.kill_after if args.kill_after is not None else args.days / args.rate / 2
+
+    print(f"run 1 (killed after {kill_after:.1f}s)")
+    started = time.monotonic()
+    _run_backfill(args, base, db, start, end, kill_after)
+    with sqlite3.connect(db) as conn:
+        committed = conn.execute("SELECT COUNT(*) FROM backfill_days;").fetchone()[0]
+    requests_before = len(ArchiveHandler.log)
+    print(f"  {committed} days committed, {requests_before} requests")
+
+    print("run 2 (resume)")
+    code = _run_backfill(args, base, db, start, end, None)
+    elapsed = time.monotonic() - started
+    server.shutdown()
+
+    problems = []
+    with sqlite3.connect(db) as conn:
+        stored = collections.defaultdict(dict)
+        for symbol, day, value in conn.execute("SELECT symbol, day, value FROM price_history;"):
+            stored[day][symbol] = value
+        statuses = dict(conn.execute("SELECT day, status FROM backfill_days;").fetchall())
+    for offset in range(args.days):
+        day = (start + datetime.timedelta(days=offset)).isoformat()
+        if datetime.date.fromisoformat(day).weekday() == 4:
+            if statuses.get(day) != "empty" or stored.get(day):
+                problems.append(f"{day}: expected an empty day")
+            continue
+        if statuses.get(day) != "done":
+            problems.append(f"{day}: not imported ({statuses.get(day)})")
+            continue
+        wrong = [s for s in TARGETS if stored[day].get(s) != expected_value(day, s)]
+        if wrong:
+            problems.append(f"{day}: wrong values for {', '.join(wrong[:5])}")
+
+    fetched = collections.Counter(day for _t, day in ArchiveHandler.log)
+    refetched = sum(1 for count in fetched.values() if count > 1)
+    peak = _max_rate(sorted(t for t, _day in ArchiveHandler.log))
+    if peak > args.rate + 1:
+        problems.append(f"request rate {peak}/s exceeded --rate {args.rate}")
+    report = {
+        "days": args.days,
+        "exit_code": code,
+        "elapsed_s": round(elapsed, 2),
+        "requests": len(ArchiveHandler.log),
+        "days_requested_more_than_once": refetched,
+        "peak_requests_per_s": peak,
+        "problems": problems[:10],
+    }
+    print(json.dumps(report, indent=2))
+    return 1 if problems or code != 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
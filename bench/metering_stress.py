@@ -0,0 +1,436 @@
+"""Concurrency stress suite for metering, add-requests and key rotation.
+
+For every worker count in ``--workers`` and every mode in ``--modes``
+(``threads``: one process with N threads, ``processes``: N single-threaded
+processes) a fresh temp database is seeded with ``--keys`` customers. The
+workers then call ``_increment_usage_or_reject`` on random customers' current
+keys for ``--seconds``. Meanwhile the parent buys add-on requests through
+``POST /me/keys/<id>/add-requests`` and rotates keys through
+``POST /self/rotate``, sending ``--racers`` concurrent rotations with the
+same key the way a retrying client would.
+
+Every ``BEGIN IMMEDIATE`` is timed on the connection, so the lock wait
+reported is the time spent waiting for the write lock itself. After each run
+these invariants are checked against the database:
+
+- no lost increments: ``request_count`` equals the admitted calls per key
+- no over-admission: ``request_count <= monthly_quota + extra_quota``
+- no reads of revoked keys: no call admitted on a key after its rotation returned
+- one rotation per key: at most one of the racing rotations succeeds, and
+  every customer ends with a single active key
+
+Throughput and lock wait per worker count go to ``--json`` and, if
+matplotlib is installed, to a ``--plot`` image. With ``--baseline`` (an
+earlier ``--json`` file) the run fails when throughput drops or p99 lock
+wait grows beyond ``--tolerance``.
+
+    python bench/metering_stress.py --workers 1,2,4,8,16 --seconds 3 --plot stress.png --json stress.json
+    python bench/metering_stress.py --modes processes --journal wal --baseline stress.json
+"""
+import argparse
+import collections
+import json
+import multiprocessing
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+JWT_SECRET = "metering-stress-suite-signing-secret"
+
+
+class _TimedConnection(sqlite3.Connection):
+    """Records how long each ``BEGIN IMMEDIATE`` waited for the write lock."""
+
+    lock_waits = None
+
+    def execute(self, sql, *args):
+        if self.lock_waits is None or not sql.startswith("BEGIN IMMEDIATE"):
+            return super().execute(sql, *args)
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, *args)
+        finally:
+            self.lock_waits.append(time.perf_counter() - started)
+
+
+def _make_app(tmp: str):
+    from flask import Flask
+
+    app = Flask("metering_stress", root_path=REPO_ROOT)
+    app.config.update(
+        API_DB_PATH=os.path.join(tmp, "api.db"),
+        API_KEY_PEPPER_PATH=os.path.join(tmp, "pepper"),
+        PROPAGATE_EXCEPTIONS=True,
+    )
+    return app
+
+
+def _seed(app, customers: int, quota: int, journal: str) -> dict:
+    import api_manager
+
+    with app.app_context():
+        db = api_manager.get_db()
+        db.execute(f"PRAGMA journal_mode = {journal};")
+        plan_id = db.execute("SELECT id FROM plans WHERE slug = 'all-business';").fetchone()[0]
+        db.execute("UPDATE plans SET monthly_quota = ? WHERE id = ?;", (quota, plan_id))
+        seeded = {}
+        for c in range(customers):
+            customer_id = db.execute(
+                "INSERT INTO customers (email, supabase_user_id, created_at) VALUES (?, ?, '2026-01-01T00:00:00Z');",
+                (f"stress{c}@example.com", f"stress-user-{c}"),
+            ).lastrowid
+            key = api_manager._create_api_key(db, customer_id=customer_id, plan_id=plan_id)
+            seeded[customer_id] = {"user": f"stress-user-{c}", "api_key": key["api_key"], "api_key_id": key["api_key_id"]}
+        db.commit()
+    return seeded
+
+
+def _active_key(db, customer_id: int):
+    row = db.execute(
+        "SELECT id FROM api_keys WHERE customer_id = ? AND status = 'active' ORDER BY id DESC LIMIT 1;",
+        (customer_id,),
+    ).fetchone()
+    return int(row[0]) if row else None
+
+
+def _worker(tmp: str, customers: list, threads: int, seconds: float, busy_timeout: float, seed: int, barrier, results) -> None:
+    import api_manager
+
+    app = _make_app(tmp)
+    outcomes = []
+
+    def run(slot: int) -> None:
+        rng = random.Random(seed * 1000 + slot)
+        counts = collections.Counter()
+        admitted = collections.Counter()
+        last_ok = {}
+        key_ids = {}
+        waits = []
+        with app.app_context():
+            db = sqlite3.connect(app.config["API_DB_PATH"], timeout=busy_timeout, factory=_TimedConnection)
+            db.row_factory = sqlite3.Row
+            db.lock_waits = waits
+            barrier.wait()
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                customer_id = rng.choice(customers)
+                key_id = key_ids.get(customer_id) or _active_key(db, customer_id)
+                if key_id is None:
+                    continue
+                key_ids[customer_id] = key_id
+                started = time.time()
+                try:
+                    usage = api_manager._increment_usage_or_reject(db, api_key_id=key_id)
+                except sqlite3.OperationalError:
+                    # مثل بسته شدن اتصال در teardown درخواست؛ تراکنش نیمه‌کاره نباید بماند
+                    db.rollback()
+                    counts["locked"] += 1
+                    continue
+                counts["calls"] += 1
+                if usage.get("ok"):
+                    admitted[key_id] += 1
+                    last_ok[key_id] = max(last_ok.get(key_id, 0.0), started)
+                elif usage.get("error") == "API key not active.":
+                    counts["revoked"] += 1
+                    key_ids.pop(customer_id, None)
+                else:
+                    counts["over_quota"] += 1
+            db.close()
+        outcomes.append((dict(counts), dict(admitted), last_ok, waits))
+
+    pool = [threading.Thread(target=run, args=(i,)) for i in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    results.put(outcomes)
+
+
+def _churn(app, seeded: dict, seconds: float, rotate_every: float, add_every: float, racers: int, barrier) -> dict:
+    """Rotate keys and buy add-ons while the workers meter; returns what happened."""
+    import jwt
+
+    lock = threading.Lock()
+    report = {"rotations": collections.Counter(), "adds": collections.Counter(), "revoked_at": {},
+              "double_rotations": [], "latencies": {"rotate": [], "add": []}}
+    rng = random.Random(99)
+
+    def rotate_once(customer_id: int) -> None:
+        with lock:
+            old_key, old_id = seeded[customer_id]["api_key"], seeded[customer_id]["api_key_id"]
+        replies = []
+
+        def send() -> None:
+            started = time.perf_counter()
+            try:
+                response = app.test_client().post("/self/rotate", headers={"x-api-key": old_key})
+                replies.append((response.status_code, response.get_json()))
+            except sqlite3.OperationalError:
+                replies.append((None, None))
+            report["latencies"]["rotate"].append(time.perf_counter() - started)
+
+        pool = [threading.Thread(target=send) for _ in range(racers)]
+        for t in pool:
+            t.start()
+        for t in pool:
+            t.join()
+        done = time.time()
+        accepted = [body for status, body in replies if status == 200]
+        for status, _body in replies:
+            report["rotations"]["ok" if status == 200 else "rejected" if status == 401 else "locked"] += 1
+        if len(accepted) > 1:
+            report["double_rotations"].append(old_id)
+        if accepted:
+            report["revoked_at"][old_id] = done
+            with lock:
+                seeded[customer_id].update(api_key=accepted[-1]["api_key"], api_key_id=accepted[-1]["api_key_id"])
+
+    def rotator() -> None:
+        barrier.wait()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() + rotate_every < deadline:
+            time.sleep(rotate_every)
+            rotate_once(rng.choice(list(seeded)))
+
+    def adder() -> None:
+        client = app.test_client()
+        add_rng = random.Random(7)
+        barrier.wait()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() + add_every < deadline:
+            time.sleep(add_every)
+            with lock:
+                entry = dict(seeded[add_rng.choice(list(seeded))])
+            token = jwt.encode({"sub": entry["user"], "aud": "authenticated", "exp": int(time.time()) + 600},
+                               JWT_SECRET, algorithm="HS256")
+            started = time.perf_counter()
+            try:
+                response = client.post(f"/me/keys/{entry['api_key_id']}/add-requests",
+                                       headers={"Authorization": f"Bearer {token}"})
+            except sqlite3.OperationalError:
+                report["adds"]["locked"] += 1
+                continue
+            finally:
+                report["latencies"]["add"].append(time.perf_counter() - started)
+            # 404 یعنی کلید همین الان چرخیده است
+            report["adds"]["ok" if response.status_code == 200 else "stale_key" if response.status_code == 404 else "error"] += 1
+
+    pool = [threading.Thread(target=rotator), threading.Thread(target=adder)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return report
+
+
+def _percentile_ms(values: list, q: float):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * q))] * 1000, 2)
+
+
+def _check(db_path: str, admitted: collections.Counter, last_ok: dict, churn: dict) -> list:
+    db = sqlite3.connect(db_path)
+    problems = []
+    rows = db.execute(
+        """
+        SELECT usage_monthly.api_key_id, usage_monthly.month, usage_monthly.request_count,
+               usage_monthly.extra_quota, plans.monthly_quota
+        FROM usage_monthly
+        JOIN api_keys ON api_keys.id = usage_monthly.api_key_id
+        JOIN plans ON plans.id = api_keys.plan_id;
+        """
+    ).fetchall()
+    counted = collections.Counter()
+    for api_key_id, month, request_count, extra_quota, base_quota in rows:
+        counted[api_key_id] += request_count
+        if request_count > base_quota + extra_quota:
+            problems.append(f"over-admission: key {api_key_id} counted {request_count} > quota {base_quota + extra_quota} in {month}")
+    for api_key_id in set(counted) | set(admitted):
+        if counted[api_key_id] != admitted[api_key_id]:
+            problems.append(f"lost increments: key {api_key_id} admitted {admitted[api_key_id]}, counted {counted[api_key_id]}")
+    for api_key_id, revoked_at in churn["revoked_at"].items():
+        if last_ok.get(api_key_id, 0.0) > revoked_at:
+            late = last_ok[api_key_id] - revoked_at
+            problems.append(f"revoked read: key {api_key_id} admitted a call started {late * 1000:.1f}ms after its rotation")
+    for api_key_id in churn["double_rotations"]:
+        problems.append(f"double rotation: key {api_key_id} was rotated by more than one request")
+    for customer_id, active in db.execute(
+        "SELECT customer_id, COUNT(*) FROM api_keys WHERE status = 'active' GROUP BY customer_id HAVING COUNT(*) > 1;"
+    ):
+        problems.append(f"customer {customer_id} has {active} active keys")
+    db.close()
+    return problems
+
+
+def run_point(args, mode: str, workers: int) -> dict:
+    import api_manager
+
+    tmp = tempfile.mkdtemp(prefix="metering_stress_")
+    app = _make_app(tmp)
+    api_manager.init_api_manager(app)
+    seeded = _seed(app, args.keys, args.quota, args.journal)
+    processes, threads = (workers, 1) if mode == "processes" else (1, workers)
+
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    barrier = ctx.Barrier(processes * threads + 2, timeout=120)
+    procs = [
+        ctx.Process(target=_worker, args=(tmp, list(seeded), threads, args.seconds, args.busy_timeout, i, barrier, results))
+        for i in range(processes)
+    ]
+    for p in procs:
+        p.start()
+    started = time.perf_counter()
+    churn = _churn(app, seeded, args.seconds, args.rotate_every, args.add_every, args.racers, barrier)
+    outcomes = [o for _ in procs for o in results.get()]
+    for p in procs:
+        p.join()
+    elapsed = time.perf_counter() - started
+
+    counts = collections.Counter()
+    admitted = collections.Counter()
+    last_ok = {}
+    waits = []
+    for c, a, l, w in outcomes:
+        counts.update(c)
+        admitted.update(a)
+        for api_key_id, t in l.items():
+            last_ok[api_key_id] = max(last_ok.get(api_key_id, 0.0), t)
+        waits.extend(w)
+    problems = _check(app.config["API_DB_PATH"], admitted, last_ok, churn)
+    return {
+        "mode": mode,
+        "workers": workers,
+        "journal": args.journal,
+        "calls": counts["calls"],
+        "admitted": sum(admitted.values()),
+        "over_quota": counts["over_quota"],
+        "revoked_key": counts["revoked"],
+        "locked_errors": counts["locked"],
+        "throughput_rps": round(counts["calls"] / elapsed, 1),
+        "lock_wait_ms": {
+            "p50": _percentile_ms(waits, 0.5),
+            "p99": _percentile_ms(waits, 0.99),
+            "max": _percentile_ms(waits, 1.0),
+            "mean": round(statistics.fmean(waits) * 1000, 3) if waits else None,
+        },
+        "rotations": dict(churn["rotations"]),
+        "adds": dict(churn["adds"]),
+        "churn_ms": {
+            kind: {"p50": _percentile_ms(values, 0.5), "p99": _percentile_ms(values, 0.99)}
+            for kind, values in churn["latencies"].items()
+        },
+        "problems": problems,
+    }
+
+
+def _churn_p99(point: dict):
+    """Slowest p99 of the rotate and add-requests calls, which wait behind the metering writers."""
+    values = [v["p99"] for v in point["churn_ms"].values() if v["p99"] is not None]
+    return max(values) if values else None
+
+
+def _plot(points: list, path: str) -> bool:
+    try:
+        import matplotlib
+
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print("matplotlib is not installed; skipping --plot")
+        return False
+    fig, (left, right) = plt.subplots(1, 2, figsize=(11, 4))
+    for mode in sorted({p["mode"] for p in points}):
+        series = sorted((p for p in points if p["mode"] == mode), key=lambda p: p["workers"])
+        xs = [p["workers"] for p in series]
+        left.plot(xs, [p["throughput_rps"] for p in series], marker="o", label=mode)
+        right.plot(xs, [p["lock_wait_ms"]["p99"] or 0 for p in series], marker="o", label=f"{mode} p99")
+        right.plot(xs, [p["lock_wait_ms"]["p50"] or 0 for p in series], marker=".", linestyle="--", label=f"{mode} p50")
+        right.plot(xs, [_churn_p99(p) or 0 for p in series], marker="x", linestyle=":", label=f"{mode} rotate/add p99")
+    for ax, title in ((left, "metered calls/s"), (right, "lock wait (ms)")):
+        ax.set_xscale("log", base=2)
+        if ax is right:
+            ax.set_yscale("symlog", linthresh=0.1)
+        ax.set_xlabel("workers")
+        ax.set_title(title)
+        ax.grid(True, alpha=0.3)
+        ax.legend()
+    fig.tight_layout()
+    fig.savefig(path, dpi=120)
+    return True
+
+
+def _regressions(points: list, baseline_path: str, tolerance: float) -> list:
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {(p["mode"], p["workers"], p["journal"]): p for p in json.load(f)["points"]}
+    found = []
+    for p in points:
+        old = baseline.get((p["mode"], p["workers"], p["journal"]))
+        if old is None:
+            continue
+        label = f"{p['mode']} x{p['workers']}"
+        if p["throughput_rps"] < old["throughput_rps"] * (1 - tolerance):
+            found.append(f"{label}: throughput {p['throughput_rps']} < baseline {old['throughput_rps']}")
+        old_p99, new_p99 = old["lock_wait_ms"]["p99"] or 0, p["lock_wait_ms"]["p99"] or 0
+        # یک میلی‌ثانیه حاشیه تا نوسان زمان‌بندی سیستم‌عامل روی عددهای خیلی کوچک خطا نشود
+        if new_p99 > old_p99 * (1 + tolerance) + 1.0:
+            found.append(f"{label}: p99 lock wait {new_p99}ms > baseline {old_p99}ms")
+    return found
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", default="1,2,4,8,16", help="comma separated worker counts")
+    parser.add_argument("--modes", default="threads,processes")
+    parser.add_argument("--seconds", type=float, default=3.0, help="duration of each run")
+    parser.add_argument("--keys", type=int, default=4, help="customers (one key each) shared by all workers")
+    parser.add_argument("--quota", type=int, default=5000, help="plan monthly_quota, small enough to be hit")
+    parser.add_argument("--journal", default="delete", choices=("delete", "wal"), help="journal mode of the temp API DB")
+    parser.add_argument("--busy-timeout", type=float, default=5.0, help="sqlite3 connect timeout of the workers")
+    parser.add_argument("--rotate-every", type=float, default=0.25, help="seconds between rotations")
+    parser.add_argument("--racers", type=int, default=2, help="concurrent rotate requests sent with the same key")
+    parser.add_argument("--add-every", type=float, default=0.05, help="seconds between add-requests purchases")
+    parser.add_argument("--plot", help="write throughput and lock wait charts to this image")
+    parser.add_argument("--baseline", help="earlier --json output to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative regression against --baseline")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args(argv)
+
+    os.environ["SUPABASE_JWT_SECRET"] = JWT_SECRET
+    points = []
+    print(f"{'mode':<10} {'workers':>7} {'calls/s':>9} {'wait p50':>9} {'wait p99':>9} {'locked':>7} {'rotations':>10} {'adds':>5} {'churn p99':>10}  problems")
+    for mode in args.modes.split(","):
+        for workers in (int(w) for w in args.workers.split(",")):
+            p = run_point(args, mode, workers)
+            points.append(p)
+            print(f"{mode:<10} {workers:>7} {p['throughput_rps']:>9,.0f} {p['lock_wait_ms']['p50']!s:>9} "
+                  f"{p['lock_wait_ms']['p99']!s:>9} {p['locked_errors']:>7} {p['rotations'].get('ok', 0):>10} "
+                  f"{p['adds'].get('ok', 0):>5} {_churn_p99(p)!s:>10}  {len(p['problems'])}")
+            for problem in p["problems"][:5]:
+                print(f"    {problem}")
+
+    regressions = _regressions(points, args.baseline, args.tolerance) if args.baseline else []
+    for regression in regressions:
+        print(f"regression: {regression}")
+    if args.plot and _plot(points, args.plot):
+        print(f"plot written to {args.plot}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "points": points, "regressions": regressions}, f, indent=2)
+    failed = any(p["problems"] for p in points) or regressions
+    print("FAIL" if failed else "OK")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
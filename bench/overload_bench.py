@@ -0,0 +1,124 @@
+"""Overload drill: priority admission, deferred metering and 503 shedding.
+
+Business, starter and anonymous clients hit the price endpoints from many
+threads through the Flask test client while a background connection holds
+the SQLite write lock for ``--lock-seconds`` out of every ``--lock-every``
+seconds, like a burst of slow writers. Reports per-class latency and
+outcomes, plus how many metered requests were served in degraded mode, and
+checks that every metered 200 ends up in ``usage_monthly`` once deferred
+counts are flushed.
+
+    python bench/overload_bench.py --seconds 10 --business 16 --starter 32 --anonymous 64
+    ADMISSION_MAX_IN_FLIGHT=0 python bench/overload_bench.py   # no admission control
+"""
+import argparse
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+
+def _percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct))]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--business", type=int, default=16, help="client threads with a business key")
+    parser.add_argument("--starter", type=int, default=32, help="client threads with a starter key")
+    parser.add_argument("--anonymous", type=int, default=64, help="client threads on /prices")
+    parser.add_argument("--lock-seconds", type=float, default=1.5)
+    parser.add_argument("--lock-every", type=float, default=3.0)
+    args = parser.parse_args(argv)
+
+    tmp = tempfile.mkdtemp()
+    os.environ.update(
+        API_DB_PATH=os.path.join(tmp, "api.db"),
+        API_KEY_PEPPER_PATH=os.path.join(tmp, "pepper"),
+        SNAPSHOT_PATH=os.path.join(tmp, "snapshot.json"),
+        SCRAPER_ENABLED="0",
+    )
+    import api_manager
+    import app as app_module
+
+    app_module._publish_snapshot({symbol: "1,000" for symbol in app_module.SCRAPE_PLAN.symbols})
+    db_path = os.environ["API_DB_PATH"]
+    keys = {}
+    with app_module.app.app_context():
+        db = api_manager.get_db()
+        for label, slug in (("business", "all-business"), ("starter", "all-starter")):
+            plan_id = db.execute("SELECT id FROM plans WHERE slug = ?;", (slug,)).fetchone()[0]
+            db.execute("UPDATE plans SET monthly_quota = 10000000 WHERE id = ?;", (plan_id,))
+            customer_id = api_manager._get_or_create_customer(db, email=f"{label}@example.com")
+            keys[label] = api_manager._create_api_key(db, customer_id=customer_id, plan_id=plan_id)
+        db.commit()
+
+    stop = threading.Event()
+    results = {label: [] for label in ("business", "starter", "anonymous")}
+
+    def locker() -> None:
+        conn = sqlite3.connect(db_path, timeout=30)
+        while not stop.wait(args.lock_every - args.lock_seconds):
+            conn.execute("BEGIN IMMEDIATE;")
+            stop.wait(args.lock_seconds)
+            conn.commit()
+        conn.close()
+
+    def client(label: str) -> None:
+        client = app_module.app.test_client()
+        headers = {"x-api-key": keys[label]["api_key"]} if label in keys else {}
+        path = "/v1/prices" if label in keys else "/prices"
+        out = results[label]
+        while not stop.is_set():
+            started = time.perf_counter()
+            response = client.get(path, headers=headers)
+            degraded = response.status_code == 200 and label in keys and app_module.metering_state()["degraded"]
+            out.append((response.status_code, time.perf_counter() - started, degraded))
+
+    threads = [threading.Thread(target=locker, daemon=True)]
+    for label in results:
+        threads += [threading.Thread(target=client, args=(label,)) for _ in range(getattr(args, label))]
+    for t in threads:
+        t.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for t in threads[1:]:
+        t.join()
+
+    print(f"admission: {'off' if app_module.ADMISSION is None else app_module.ADMISSION.max_in_flight} in flight")
+    for label, rows in results.items():
+        ok = [latency for status, latency, _ in rows if status == 200]
+        shed = sum(1 for status, _, _ in rows if status == 503)
+        degraded = sum(1 for _, _, d in rows if d)
+        other = len(rows) - len(ok) - shed
+        print(
+            f"{label:>9}: {len(rows):>7,} req  ok {len(ok):>7,}  503 {shed:>6,}  other {other:>4,}  "
+            f"served-degraded ~{degraded:,}  p50 {_percentile(ok, 0.5) * 1000:7.1f} ms  "
+            f"p99 {_percentile(ok, 0.99) * 1000:7.1f} ms  mean {statistics.fmean(ok) * 1000 if ok else 0:7.1f} ms"
+        )
+
+    with app_module.app.app_context():
+        api_manager._flush_deferred_usage(api_manager.get_db())
+    conn = sqlite3.connect(db_path)
+    counted = conn.execute("SELECT COALESCE(SUM(request_count), 0) FROM usage_monthly;").fetchone()[0]
+    conn.close()
+    metered_ok = sum(1 for label in keys for status, _, _ in results[label] if status == 200)
+    print(f"metering: {app_module.metering_state()}")
+    print(f"metered 200s: {metered_ok:,}  counted in usage_monthly: {counted:,}")
+    ok = counted == metered_ok
+    print("OK" if ok else "FAIL: usage does not match served metered requests")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
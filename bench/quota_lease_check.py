@@ -0,0 +1,130 @@
+"""Multi-process quota accuracy check for metered increments, with and without leases.
+
+Several processes with several threads each hammer one API key whose quota
+is smaller than the total demand. The check asserts that no more requests
+were admitted than the quota allows and that, once every worker has
+returned its leases, ``usage_monthly.request_count`` equals the number of
+admitted requests exactly.
+
+    python bench/quota_lease_check.py --processes 8 --threads 8 --quota 20000
+    python bench/quota_lease_check.py --no-lease
+"""
+import argparse
+import multiprocessing
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+
+def _make_app(tmp: str):
+    from flask import Flask
+
+    app = Flask("quota_lease_check", root_path=REPO_ROOT)
+    app.config.update(API_DB_PATH=os.path.join(tmp, "api.db"), API_KEY_PEPPER_PATH=os.path.join(tmp, "pepper"))
+    return app
+
+
+def _seed(db_path: str, quota: int) -> int:
+    db = sqlite3.connect(db_path)
+    now = "2026-01-01T00:00:00Z"
+    plan_id = db.execute("SELECT id FROM plans WHERE slug = 'all-business';").fetchone()[0]
+    db.execute("UPDATE plans SET monthly_quota = ? WHERE id = ?;", (quota, plan_id))
+    customer_id = db.execute("INSERT INTO customers (email, created_at) VALUES ('check@example.com', ?);", (now,)).lastrowid
+    api_key_id = db.execute(
+        "INSERT INTO api_keys (customer_id, plan_id, key_hash, key_prefix, key_last4, status, created_at) VALUES (?, ?, 'check', 'bb', '0000', 'active', ?);",
+        (customer_id, plan_id, now),
+    ).lastrowid
+    db.commit()
+    db.close()
+    return api_key_id
+
+
+def _worker(tmp: str, api_key_id: int, threads: int, attempts: int, use_leases: bool, results) -> None:
+    import api_manager
+
+    app = _make_app(tmp)
+    if use_leases:
+        api_manager._enable_quota_leases(app.config["API_DB_PATH"])
+
+    admitted = [0] * threads
+    errors = [0] * threads
+
+    def run(slot: int) -> None:
+        with app.app_context():
+            db = sqlite3.connect(app.config["API_DB_PATH"], timeout=30)
+            db.row_factory = sqlite3.Row
+            for _ in range(attempts):
+                try:
+                    usage = api_manager._increment_usage_or_reject(db, api_key_id=api_key_id)
+                except sqlite3.OperationalError:
+                    errors[slot] += 1
+                    continue
+                if usage.get("ok"):
+                    admitted[slot] += 1
+            db.close()
+
+    pool = [threading.Thread(target=run, args=(i,)) for i in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    if use_leases:
+        api_manager._QUOTA_LEASES.release_all(app.config["API_DB_PATH"])
+    results.put((sum(admitted), sum(errors)))
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--attempts", type=int, default=2000, help="requests per thread")
+    parser.add_argument("--quota", type=int, default=20_000)
+    parser.add_argument("--no-lease", action="store_true")
+    args = parser.parse_args(argv)
+
+    from api_manager import init_api_manager
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = _make_app(tmp)
+        init_api_manager(app)
+        api_key_id = _seed(app.config["API_DB_PATH"], args.quota)
+
+        ctx = multiprocessing.get_context("spawn")
+        results = ctx.Queue()
+        procs = [
+            ctx.Process(target=_worker, args=(tmp, api_key_id, args.threads, args.attempts, not args.no_lease, results))
+            for _ in range(args.processes)
+        ]
+        started = time.perf_counter()
+        for p in procs:
+            p.start()
+        outcomes = [results.get() for _ in procs]
+        for p in procs:
+            p.join()
+        elapsed = time.perf_counter() - started
+
+        admitted = sum(o[0] for o in outcomes)
+        lock_errors = sum(o[1] for o in outcomes)
+        db = sqlite3.connect(app.config["API_DB_PATH"])
+        counted = db.execute("SELECT COALESCE(SUM(request_count), 0) FROM usage_monthly WHERE api_key_id = ?;", (api_key_id,)).fetchone()[0]
+        db.close()
+
+    demand = args.processes * args.threads * args.attempts
+    mode = "direct" if args.no_lease else "leased"
+    print(f"mode={mode} workers={args.processes}x{args.threads} demand={demand:,} quota={args.quota:,}")
+    print(f"admitted={admitted:,} counted={counted:,} lock_errors={lock_errors:,} elapsed={elapsed:.2f}s ({demand / elapsed:,.0f} req/s)")
+    ok = admitted <= args.quota and counted == admitted
+    if demand >= args.quota:
+        print(f"under-admission: {args.quota - admitted:,}")
+    print("OK" if ok else "FAIL: admitted/counted mismatch or quota exceeded")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,161 @@
+"""Replication failover drill over the in-memory backend or a Redis server.
+
+Starts several replicator nodes on one shared backend, lets the leader
+publish snapshots, then silences it (no more heartbeats, as if the process
+froze or was partitioned). Reports how long the cluster went without a
+leader, checks that every follower converged on the new leader's data, and
+checks that a late publish from the old leader is rejected as stale.
+
+With ``--backend redis`` every node gets its own connections to
+``--redis-url`` (as separate processes would), and the drill also kills the
+pub/sub connections with ``CLIENT KILL``: the snapshot published during the
+outage must arrive through reconcile, and the next one live over the
+re-established subscription.
+
+    python bench/replication_failover.py --nodes 3 --heartbeat 0.2 --lease-ttl 0.6
+    python bench/replication_failover.py --backend redis --redis-url redis://localhost:6379/0
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from replication import MemoryBackend, RedisBackend, SnapshotReplicator  # noqa: E402
+
+
+class _Node:
+    def __init__(self, name: str, backend, prefix: str, heartbeat: float, lease_ttl: float, reconcile: float):
+        self.name = name
+        self.applied = []
+        self.replicator = SnapshotReplicator(
+            backend,
+            self.applied.append,
+            prefix=prefix,
+            node_id=name,
+            heartbeat=heartbeat,
+            lease_ttl=lease_ttl,
+            reconcile_interval=reconcile,
+        )
+
+    def freeze(self) -> None:
+        """Stop heartbeating without releasing the lock, like a stalled process."""
+        self.replicator._stop.set()
+        self.replicator._thread.join()
+
+
+def _wait_for_leader(nodes, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        leaders = [n for n in nodes if n.replicator.is_leader]
+        if leaders:
+            return leaders
+        time.sleep(0.005)
+    return []
+
+
+def _wait_converged(nodes, last_updated: str, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while True:
+        if all(n.applied and n.applied[-1]["last_updated"] == last_updated for n in nodes):
+            return True
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.01)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nodes", type=int, default=3)
+    parser.add_argument("--heartbeat", type=float, default=0.2)
+    parser.add_argument("--lease-ttl", type=float, default=0.6)
+    parser.add_argument("--reconcile", type=float, default=2.0, help="follower reconcile interval in seconds")
+    parser.add_argument("--backend", choices=("memory", "redis"), default="memory")
+    parser.add_argument("--redis-url", default=os.environ.get("REDIS_URL", "redis://localhost:6379/0"))
+    args = parser.parse_args(argv)
+
+    # هر اجرا prefix خودش را دارد تا کلیدهای اجرای قبلی روی Redis مشترک اثری نگذارند
+    prefix = f"failover-drill-{os.getpid()}-{int(time.time())}"
+    if args.backend == "redis":
+        import redis
+
+        admin = redis.Redis.from_url(args.redis_url)
+        make_backend = lambda: RedisBackend(args.redis_url)  # noqa: E731
+    else:
+        admin = None
+        shared = MemoryBackend()
+        make_backend = lambda: shared  # noqa: E731
+    nodes = [
+        _Node(f"node-{i}", make_backend(), prefix, args.heartbeat, args.lease_ttl, args.reconcile)
+        for i in range(args.nodes)
+    ]
+    for node in nodes:
+        node.replicator.start()
+        node.replicator.enable_candidacy()
+
+    leaders = _wait_for_leader(nodes, args.lease_ttl * 5)
+    if len(leaders) != 1:
+        print(f"FAIL: expected one leader, got {len(leaders)}")
+        return 1
+    old = leaders[0]
+    # فالوئرها باید قبل از انتشار subscribe کرده باشند (روی ترد heartbeat انجام می‌شود)
+    time.sleep(args.heartbeat * 2)
+    for i in range(5):
+        old.replicator.publish({"data": {"usd1": str(60_000 + i)}, "last_updated": f"t{i}"})
+    followers = [n for n in nodes if n is not old]
+    delivered = _wait_converged(followers, "t4", args.reconcile + 2)
+    print(f"leader: {old.name} fence={old.replicator._fence}; followers received its snapshots: {delivered}")
+
+    resubscribed = True
+    if admin is not None:
+        # اتصال pub/sub همه‌ی نودها قطع می‌شود؛ پیامی که در این فاصله منتشر شود فقط با reconcile می‌رسد
+        killed = admin.client_kill_filter(_type="pubsub")
+        old.replicator.publish({"data": {"usd1": "60500"}, "last_updated": "t-during-outage"})
+        reconciled = _wait_converged(followers, "t-during-outage", args.reconcile + 5)
+        # بعد از وصل شدن دوباره‌ی subscriberها پیام‌ها باید مستقیم از pub/sub برسند (زودتر از reconcile بعدی)
+        channel = f"{prefix}:snapshots"
+        deadline = time.monotonic() + 35
+        while admin.pubsub_numsub(channel)[0][1] < len(nodes) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        old.replicator.publish({"data": {"usd1": "60600"}, "last_updated": "t-after-reconnect"})
+        live = _wait_converged(followers, "t-after-reconnect", args.reconcile / 2)
+        resubscribed = reconciled and live
+        print(
+            f"killed {killed} pub/sub connections; missed snapshot reconciled: {reconciled}; "
+            f"live delivery after reconnect: {live}"
+        )
+
+    frozen_at = time.monotonic()
+    old.freeze()
+    others = [n for n in nodes if n is not old]
+    leaders = _wait_for_leader(others, args.lease_ttl * 5)
+    failover_s = time.monotonic() - frozen_at
+    if len(leaders) != 1:
+        print(f"FAIL: expected one new leader, got {len(leaders)}")
+        return 1
+    new = leaders[0]
+    print(f"new leader: {new.name} fence={new.replicator._fence} after {failover_s * 1000:.0f} ms")
+
+    new.replicator.publish({"data": {"usd1": "61000"}, "last_updated": "t-new"})
+    # رهبر قبلی هنوز خودش را رهبر می‌داند و یک snapshot قدیمی می‌فرستد
+    stale_accepted = old.replicator.publish({"data": {"usd1": "1"}, "last_updated": "t-stale"})
+    print(f"stale publish from old leader accepted: {stale_accepted}; old leader stepped down: {not old.replicator.is_leader}")
+
+    converged = _wait_converged([n for n in nodes if n is not new], "t-new", args.reconcile + 2)
+    print(f"followers converged on new leader's snapshot: {converged}")
+
+    for node in others:
+        node.replicator.stop()
+    old.replicator.backend.close()
+    if admin is not None:
+        admin.delete(*(f"{prefix}:{suffix}" for suffix in ("leader", "fence", "snapshot")))
+        admin.close()
+
+    ok = delivered and resubscribed and not stale_accepted and converged and failover_s <= args.lease_ttl + 2 * args.heartbeat
+    print("OK" if ok else "FAIL")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
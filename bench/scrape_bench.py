@@ -0,0 +1,238 @@
+"""Offline scraper benchmark against the fixture pages in bench/fixtures.
+
+Serves the fixtures from a local HTTP server and times each scrape phase
+(driver startup, navigation, ready wait, TARGETS extraction) over many
+iterations, then prints latency distributions and peak memory.
+
+    python bench/scrape_bench.py --iterations 20
+    python bench/scrape_bench.py --scenario slow --scenario broken --reuse-driver
+    python bench/scrape_bench.py --record https://www.bonbast.com
+"""
+import argparse
+import functools
+import http.server
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scraper import TARGETS, create_driver, load_page, wait_until_ready, extract_prices  # noqa: E402
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+# name -> path on the fixture server
+SCENARIOS = {
+    "normal": "/bonbast.html",
+    "slow": "/bonbast_slow.html",
+    "slow-network": "/trickle/bonbast.html",
+    "broken": "/bonbast_broken.html",
+}
+
+PHASES = ("startup", "navigation", "wait", "extraction", "total")
+
+
+class FixtureHandler(http.server.SimpleHTTPRequestHandler):
+    """Static fixture server; ``/trickle/<file>`` streams the body slowly."""
+
+    trickle_chunk = 512
+    trickle_delay = 0.05
+
+    def do_GET(self):
+        if not self.path.startswith("/trickle/"):
+            return super().do_GET()
+        path = self.translate_path(self.path[len("/trickle"):])
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        with open(path, "rb") as f:
+            body = f.read()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        for i in range(0, len(body), self.trickle_chunk):
+            self.wfile.write(body[i:i + self.trickle_chunk])
+            self.wfile.flush()
+            time.sleep(self.trickle_delay)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_fixture_server(host: str = "127.0.0.1", port: int = 0):
+    handler = functools.partial(FixtureHandler, directory=FIXTURES_DIR)
+    server = http.server.ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _browser_rss_bytes(driver) -> int:
+    """RSS of chromedriver and its browser children; 0 when psutil is missing."""
+    try:
+        import psutil
+    except ImportError:
+        return 0
+    try:
+        root = psutil.Process(driver.service.process.pid)
+        procs = [root] + root.children(recursive=True)
+    except Exception:
+        return 0
+    total = 0
+    for proc in procs:
+        try:
+            total += proc.memory_info().rss
+        except psutil.Error:
+            continue
+    return total
+
+
+def run_scenario(url: str, iterations: int, reuse_driver: bool, wait_timeout: float) -> dict:
+    timings = {phase: [] for phase in PHASES}
+    failures = []
+    missing = []
+    peak_browser_rss = 0
+
+    tracemalloc.start()
+    driver = None
+    try:
+        for _ in range(iterations):
+            started = time.perf_counter()
+            try:
+                if driver is None:
+                    driver = create_driver()
+                t_startup = time.perf_counter()
+                load_page(driver, url)
+                t_nav = time.perf_counter()
+                wait_until_ready(driver, timeout=wait_timeout)
+                t_wait = time.perf_counter()
+                data = extract_prices(driver)
+                t_extract = time.perf_counter()
+            except Exception as exc:
+                failures.append(type(exc).__name__)
+                if driver is not None:
+                    driver.quit()
+                    driver = None
+                continue
+
+            peak_browser_rss = max(peak_browser_rss, _browser_rss_bytes(driver))
+            timings["startup"].append(t_startup - started)
+            timings["navigation"].append(t_nav - t_startup)
+            timings["wait"].append(t_wait - t_nav)
+            timings["extraction"].append(t_extract - t_wait)
+            timings["total"].append(t_extract - started)
+            missing.append(sum(1 for v in data.values() if v is None))
+
+            if not reuse_driver:
+                driver.quit()
+                driver = None
+    finally:
+        if driver is not None:
+            driver.quit()
+        _, peak_python = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return {
+        "url": url,
+        "iterations": iterations,
+        "succeeded": len(timings["total"]),
+        "failures": failures,
+        "missing_symbols": {"max": max(missing, default=0), "of": len(TARGETS)},
+        "phases": {phase: _summarize(values) for phase, values in timings.items()},
+        "peak_python_bytes": peak_python,
+        "peak_browser_rss_bytes": peak_browser_rss,
+    }
+
+
+def _summarize(values: list) -> dict:
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def pct(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+    return {
+        "n": len(ordered),
+        "mean": statistics.fmean(ordered),
+        "stdev": statistics.stdev(ordered) if len(ordered) > 1 else 0.0,
+        "min": ordered[0],
+        "p50": pct(50),
+        "p90": pct(90),
+        "p99": pct(99),
+        "max": ordered[-1],
+    }
+
+
+def _print_report(name: str, result: dict) -> None:
+    print(f"\n== {name}  ({result['succeeded']}/{result['iterations']} ok)  {result['url']}")
+    if result["failures"]:
+        counts = {f: result["failures"].count(f) for f in set(result["failures"])}
+        print(f"   failures: {counts}")
+    print(f"   missing symbols (worst run): {result['missing_symbols']['max']}/{result['missing_symbols']['of']}")
+    print(f"   {'phase':<11}{'mean':>9}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}  (ms)")
+    for phase in PHASES:
+        s = result["phases"].get(phase)
+        if not s:
+            continue
+        print(
+            f"   {phase:<11}"
+            + "".join(f"{s[k] * 1000:>9.1f}" for k in ("mean", "p50", "p90", "p99", "max"))
+        )
+    print(f"   peak python heap: {result['peak_python_bytes'] / 1024:.0f} KiB")
+    if result["peak_browser_rss_bytes"]:
+        print(f"   peak browser rss: {result['peak_browser_rss_bytes'] / 1024 / 1024:.1f} MiB")
+
+
+def record_page(url: str, name: str) -> str:
+    """Save the rendered page source of ``url`` as a new fixture."""
+    driver = create_driver()
+    try:
+        load_page(driver, url)
+        wait_until_ready(driver)
+        html = driver.page_source
+    finally:
+        driver.quit()
+    path = os.path.join(FIXTURES_DIR, name)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(html)
+    return path
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help="repeatable; default: all")
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--reuse-driver", action="store_true", help="keep one Chrome across iterations")
+    parser.add_argument("--wait-timeout", type=float, default=5.0)
+    parser.add_argument("--json", dest="json_path", help="also write raw results to this file")
+    parser.add_argument("--record", metavar="URL", help="save a live page as a fixture and exit")
+    parser.add_argument("--record-name", default="bonbast_recorded.html")
+    args = parser.parse_args(argv)
+
+    if args.record:
+        print(record_page(args.record, args.record_name))
+        return 0
+
+    server = start_fixture_server()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    results = {}
+    try:
+        for name in args.scenario or list(SCENARIOS):
+            results[name] = run_scenario(base + SCENARIOS[name], args.iterations, args.reuse_driver, args.wait_timeout)
+            _print_report(name, results[name])
+    finally:
+        server.shutdown()
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
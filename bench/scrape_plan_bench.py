@@ -0,0 +1,121 @@
+"""Cycle time of a multi-source scrape plan, one worker versus a pool.
+
+Serves the bench fixtures over local HTTP with an artificial per-request
+delay (``/delay/<ms>/<file>``) plus a small JSON price feed, builds a plan
+of ``http`` sources with different latencies (and optionally one that never
+answers within its timeout), and times ``ScrapePlan.run()`` with
+``--workers 1`` and the pooled setting. With a pool the cycle should take
+about as long as the slowest source, not the sum.
+
+    python bench/scrape_plan_bench.py --cycles 5
+    python bench/scrape_plan_bench.py --delays 200,500,900 --hung
+"""
+import argparse
+import functools
+import http.server
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from scrape_bench import FIXTURES_DIR, FixtureHandler  # noqa: E402
+from scrape_plan import HTTP, ScrapePlan, Source  # noqa: E402
+from scraper import SCOPE_KEYS, TARGETS  # noqa: E402
+
+_FEED = {"crypto": {"bitcoin": {"sell": "1,234,567"}}, "gold": {"ounce": "2,345"}}
+
+
+class DelayedFixtureHandler(FixtureHandler):
+    """Fixture server where ``/delay/<ms>/<path>`` answers after ``ms`` and ``/feed.json`` is a JSON feed."""
+
+    def do_GET(self):
+        parts = self.path.split("/", 3)
+        if len(parts) == 4 and parts[1] == "delay":
+            time.sleep(int(parts[2]) / 1000)
+            self.path = "/" + parts[3]
+        if self.path != "/feed.json":
+            try:
+                return super().do_GET()
+            except BrokenPipeError:
+                # کلاینتی که مهلتش تمام شده اتصال را بسته است
+                return None
+        body = json.dumps(_FEED).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def _build_plan(base: str, delays: list, hung: bool, workers: int) -> ScrapePlan:
+    scopes = list(SCOPE_KEYS.items())
+    sources = []
+    for i, delay in enumerate(delays):
+        # هر منبع بخشی از نمادها را می‌خواند تا ادغام و انتساب منبع هم سنجیده شود
+        name, symbols = scopes[i % len(scopes)]
+        targets = {symbol: TARGETS[symbol] for symbol in symbols}
+        sources.append(Source(f"{name}-{i}", f"{base}/delay/{delay}/bonbast.html", targets, kind=HTTP, timeout=5))
+    sources.append(Source(
+        "feed", f"{base}/delay/{min(delays)}/feed.json", {"bitcoin": "crypto.bitcoin.sell", "gold_ounce": "gold.ounce"},
+        kind=HTTP, fmt="json", timeout=5,
+    ))
+    if hung:
+        sources.append(Source("hung", f"{base}/delay/3000/bonbast.html", {"usd": "usd1"}, kind=HTTP, timeout=1))
+    return ScrapePlan(sources, max_workers=workers)
+
+
+def _measure(plan: ScrapePlan, cycles: int) -> dict:
+    elapsed = []
+    result = None
+    for _ in range(cycles):
+        result = plan.run()
+        elapsed.append(result["elapsed"])
+    plan.close()
+    return {
+        "workers": plan.max_workers,
+        "cycle_p50_s": round(statistics.median(elapsed), 3),
+        "cycle_max_s": round(max(elapsed), 3),
+        "symbols": sum(1 for value in result["values"].values() if value is not None),
+        "by_source": {name: stat["ok"] and stat["symbols"] or stat["error"] for name, stat in result["stats"].items()},
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--delays", default="300,600,900", help="comma separated per-source delays in ms")
+    parser.add_argument("--hung", action="store_true", help="add a source that always exceeds its 1s timeout")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--cycles", type=int, default=3)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args(argv)
+
+    handler = functools.partial(DelayedFixtureHandler, directory=FIXTURES_DIR)
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    delays = [int(d) for d in args.delays.split(",") if d.strip()]
+
+    results = {}
+    try:
+        for label, workers in (("sequential", 1), ("pooled", args.workers)):
+            results[label] = _measure(_build_plan(base, delays, args.hung, workers), args.cycles)
+            print(f"{label:>10}: {json.dumps(results[label])}")
+    finally:
+        server.shutdown()
+
+    # منبع feed هم با کمترین تاخیر خوانده می‌شود
+    print(f"sum of delays {(sum(delays) + min(delays)) / 1000:.2f}s, slowest {max(delays) / 1000:.2f}s")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"delays_ms": delays, "hung": args.hung, "results": results}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
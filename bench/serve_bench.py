@@ -0,0 +1,186 @@
+"""Side-by-side load test of the threaded Flask server and the async server.
+
+Both servers are started as subprocesses on one temporary database and
+snapshot file, a metered API key is created, and each server is driven by
+the same closed-loop aiohttp client: ``--concurrency`` keep-alive
+connections issuing requests back to back for ``--seconds``. Optionally
+``--streams`` idle SSE clients are held open against the async server while
+it is measured (the threaded server would need one thread per stream).
+
+    python bench/serve_bench.py --concurrency 200 --seconds 10
+    python bench/serve_bench.py --path /v1/prices --concurrency 64 --streams 2000
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+_FLASK = "import app; app.app.run(host='127.0.0.1', port={port}, threaded=True)"
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _prepare(tmp: str) -> str:
+    """Seed a snapshot and a business key; returns the raw API key."""
+    from flask import Flask
+
+    import api_manager
+    from scraper import TARGETS
+    from snapshot_store import save_snapshot
+
+    save_snapshot(os.environ["SNAPSHOT_PATH"], {
+        "data": {symbol: f"{random.randint(10_000, 9_999_999):,}" for symbol in TARGETS},
+        "last_updated": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "status": "Success",
+    })
+    app = Flask("serve_bench", root_path=REPO_ROOT)
+    api_manager.init_api_manager(app)
+    with app.app_context():
+        db = api_manager.get_db()
+        plan_id = db.execute("SELECT id FROM plans WHERE slug = 'all-business';").fetchone()[0]
+        db.execute("UPDATE plans SET monthly_quota = 100000000 WHERE id = ?;", (plan_id,))
+        customer_id = api_manager._get_or_create_customer(db, email="bench@example.com")
+        key = api_manager._create_api_key(db, customer_id=customer_id, plan_id=plan_id)
+        db.commit()
+    return key["api_key"]
+
+
+async def _wait_ready(session, url: str, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with session.get(url) as response:
+                if response.status == 200:
+                    return
+        except OSError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError(f"server at {url} did not come up")
+
+
+async def _load(base: str, path: str, headers: dict, concurrency: int, seconds: float, streams: int) -> dict:
+    import aiohttp
+
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        await _wait_ready(session, base + "/health")
+
+        idle = []
+        for _ in range(streams):
+            response = await session.get(base + "/prices/stream", timeout=aiohttp.ClientTimeout(total=None))
+            idle.append(response)
+
+        latencies = []
+        errors = 0
+        deadline = time.monotonic() + seconds
+
+        async def worker() -> None:
+            nonlocal errors
+            async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=1)) as own:
+                while time.monotonic() < deadline:
+                    started = time.perf_counter()
+                    try:
+                        async with own.get(base + path, headers=headers) as response:
+                            await response.read()
+                            if response.status != 200:
+                                errors += 1
+                                continue
+                    except aiohttp.ClientError:
+                        errors += 1
+                        continue
+                    latencies.append(time.perf_counter() - started)
+
+        started = time.monotonic()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.monotonic() - started
+        for response in idle:
+            response.close()
+
+    latencies.sort()
+
+    def pct(p: float) -> float:
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000 if latencies else 0.0
+
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(pct(0.5), 2),
+        "p99_ms": round(pct(0.99), 2),
+        "max_ms": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--path", default="/prices", help="/prices, /v1/prices or /v1/key/{key}/prices")
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--streams", type=int, default=0, help="idle SSE clients held on the async server")
+    parser.add_argument("--encoding", default="gzip, br", help="Accept-Encoding sent by the client")
+    parser.add_argument("--only", choices=("flask", "async"))
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args(argv)
+
+    tmp = tempfile.mkdtemp(prefix="serve_bench_")
+    env = {
+        **os.environ,
+        "API_DB_PATH": os.path.join(tmp, "api.db"),
+        "API_KEY_PEPPER_PATH": os.path.join(tmp, "pepper"),
+        "SNAPSHOT_PATH": os.path.join(tmp, "snapshot.json"),
+        "SCRAPER_ENABLED": "0",
+        "ASYNC_SCRAPER_ENABLED": "0",
+    }
+    os.environ.update(env)
+    api_key = _prepare(tmp)
+    path = args.path.replace("{key}", api_key)
+    headers = {"x-api-key": api_key, "Accept-Encoding": args.encoding}
+
+    results = {}
+    for name in ("flask", "async"):
+        if args.only and args.only != name:
+            continue
+        port = _free_port()
+        if name == "flask":
+            cmd = [sys.executable, "-c", _FLASK.format(port=port)]
+        else:
+            cmd = [sys.executable, os.path.join(REPO_ROOT, "async_app.py")]
+        proc = subprocess.Popen(
+            cmd,
+            cwd=REPO_ROOT,
+            env={**env, "ASYNC_PORT": str(port)},
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            streams = args.streams if name == "async" else 0
+            results[name] = asyncio.run(
+                _load(f"http://127.0.0.1:{port}", path, headers, args.concurrency, args.seconds, streams)
+            )
+            results[name]["idle_streams"] = streams
+        finally:
+            proc.terminate()
+            proc.wait(timeout=10)
+        print(f"{name:>6}: {json.dumps(results[name])}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"path": args.path, "concurrency": args.concurrency, "results": results}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,128 @@
+"""Import-time and startup-time report for an API-only worker.
+
+Imports the app in a fresh interpreter with ``-X importtime`` (scraper
+disabled, throwaway DB and snapshot paths), serves one /health request and
+prints the slowest imports, total startup time, peak RSS and which heavy
+optional dependencies ended up loaded.
+
+    python bench/startup_report.py
+    python bench/startup_report.py --top 30 --budget-ms 400
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# ماژول‌هایی که یک worker فقط-API نباید بارگذاری کند
+HEAVY_MODULES = ("selenium", "supabase", "jwt")
+
+_PROBE = """
+import json, resource, sys, time
+t0 = time.perf_counter()
+import {module} as target
+t1 = time.perf_counter()
+client = target.app.test_client()
+status = client.get("/health").status_code
+t2 = time.perf_counter()
+print(json.dumps({{
+    "import_s": t1 - t0,
+    "first_request_s": t2 - t1,
+    "health_status": status,
+    "heavy_loaded": [m for m in {heavy!r} if m in sys.modules],
+    "modules": len(sys.modules),
+    "maxrss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+}}))
+"""
+
+
+def _parse_importtime(stderr: str) -> list:
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        try:
+            self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+            rows.append((int(self_us), int(cumulative_us), name.rstrip()))
+        except ValueError:
+            continue
+    return rows
+
+
+def run_report(module: str) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(
+            os.environ,
+            SCRAPER_ENABLED="0",
+            API_DB_PATH=os.path.join(tmp, "api_manager.db"),
+            API_KEY_PEPPER_PATH=os.path.join(tmp, "api_key_pepper"),
+            SNAPSHOT_PATH=os.path.join(tmp, "latest_prices.json"),
+        )
+        # اجرای دوم نماینده‌ی ری‌استارت روی دیتابیس موجود است
+        results = []
+        for _ in range(2):
+            started = time.perf_counter()
+            proc = subprocess.run(
+                [sys.executable, "-X", "importtime", "-c", _PROBE.format(module=module, heavy=HEAVY_MODULES)],
+                cwd=REPO_ROOT,
+                env=env,
+                capture_output=True,
+                text=True,
+            )
+            wall = time.perf_counter() - started
+            if proc.returncode != 0:
+                raise SystemExit(proc.stderr[-2000:])
+            probe = json.loads(proc.stdout.strip().splitlines()[-1])
+            probe["process_s"] = wall
+            probe["imports"] = _parse_importtime(proc.stderr)
+            results.append(probe)
+    return {"first_boot": results[0], "restart": results[1]}
+
+
+def _print_report(report: dict, top: int) -> None:
+    for label, probe in report.items():
+        print(f"== {label}")
+        print(f"   process wall time : {probe['process_s'] * 1000:8.1f} ms")
+        print(f"   import app        : {probe['import_s'] * 1000:8.1f} ms")
+        print(f"   first request     : {probe['first_request_s'] * 1000:8.1f} ms (/health -> {probe['health_status']})")
+        print(f"   modules loaded    : {probe['modules']}")
+        print(f"   peak rss          : {probe['maxrss_kb'] / 1024:8.1f} MiB")
+        print(f"   heavy deps loaded : {', '.join(probe['heavy_loaded']) or 'none'}")
+
+    imports = report["restart"]["imports"]
+    print(f"\n== top {top} imports by cumulative time (restart)")
+    print(f"   {'cumulative':>10} {'self':>8}  module")
+    for self_us, cumulative_us, name in sorted(imports, key=lambda r: r[1], reverse=True)[:top]:
+        print(f"   {cumulative_us / 1000:>8.1f}ms {self_us / 1000:>6.1f}ms {name}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="app")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--budget-ms", type=float, help="exit 1 if the restart import exceeds this")
+    parser.add_argument("--json", dest="json_path")
+    args = parser.parse_args(argv)
+
+    report = run_report(args.module)
+    _print_report(report, args.top)
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    restart = report["restart"]
+    if restart["heavy_loaded"]:
+        print(f"\nFAIL: API-only startup imported {', '.join(restart['heavy_loaded'])}")
+        return 1
+    if args.budget_ms is not None and restart["import_s"] * 1000 > args.budget_ms:
+        print(f"\nFAIL: import took {restart['import_s'] * 1000:.1f} ms (budget {args.budget_ms:.0f} ms)")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
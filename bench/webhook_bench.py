@@ -0,0 +1,176 @@
+"""Webhook delivery benchmark against local stand-in receivers.
+
+Creates a throwaway API database with many webhook endpoints spread over a
+few local HTTP receivers (some flaky, one unreachable), publishes snapshots
+through WebhookDispatcher and reports throughput, signature failures,
+retries and dead letters.
+
+    python bench/webhook_bench.py --endpoints 20000 --receivers 8
+    python bench/webhook_bench.py --fail-rate 0.2 --cycles 3
+"""
+import argparse
+import http.server
+import json
+import os
+import random
+import socket
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+
+from api_manager import init_api_manager  # noqa: E402
+from webhooks import (  # noqa: E402
+    EVENT_PRICES_UPDATED,
+    SIGNATURE_HEADER,
+    TIMESTAMP_HEADER,
+    WebhookDispatcher,
+    render_prices_body,
+    verify_signature,
+)
+
+
+class _Receiver(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, secrets: dict, fail_rate: float):
+        super().__init__(("127.0.0.1", 0), _ReceiverHandler)
+        self.secrets = secrets
+        self.fail_rate = fail_rate
+        self.lock = threading.Lock()
+        self.received = 0
+        self.bad_signatures = 0
+
+
+class _ReceiverHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        server = self.server
+        webhook_id = int(self.path.rsplit("/", 1)[-1])
+        ok = verify_signature(server.secrets[webhook_id], self.headers[TIMESTAMP_HEADER], body, self.headers[SIGNATURE_HEADER])
+        failed = random.random() < server.fail_rate
+        with server.lock:
+            if not ok:
+                server.bad_signatures += 1
+            elif not failed:
+                server.received += 1
+        status = 500 if failed else (204 if ok else 401)
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _unused_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _seed(db_path: str, receivers: list, endpoints: int, dead_port: int) -> dict:
+    db = sqlite3.connect(db_path)
+    now = "2026-01-01T00:00:00Z"
+    cur = db.execute("INSERT INTO customers (email, created_at) VALUES ('bench@example.com', ?);", (now,))
+    customer_id = cur.lastrowid
+    plan_ids = [r[0] for r in db.execute("SELECT id FROM plans ORDER BY id;")]
+    key_ids = []
+    for i, plan_id in enumerate(plan_ids):
+        cur = db.execute(
+            "INSERT INTO api_keys (customer_id, plan_id, key_hash, key_prefix, key_last4, status, created_at) VALUES (?, ?, ?, 'bb', ?, 'active', ?);",
+            (customer_id, plan_id, f"bench-{i}", f"{i:04d}", now),
+        )
+        key_ids.append(cur.lastrowid)
+
+    secrets = {}
+    rows = []
+    for i in range(endpoints):
+        webhook_id = i + 1
+        if i == endpoints - 1:
+            url = f"http://127.0.0.1:{dead_port}/hook/{webhook_id}"
+        else:
+            url = f"http://127.0.0.1:{receivers[i % len(receivers)].server_address[1]}/hook/{webhook_id}"
+        secret = f"whsec_bench_{webhook_id}"
+        secrets[webhook_id] = secret
+        rows.append((webhook_id, key_ids[i % len(key_ids)], url, secret, now))
+    db.executemany("INSERT INTO webhooks (id, api_key_id, url, secret, active, created_at) VALUES (?, ?, ?, ?, 1, ?);", rows)
+    db.commit()
+    db.close()
+    return secrets
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoints", type=int, default=10_000)
+    parser.add_argument("--receivers", type=int, default=4)
+    parser.add_argument("--fail-rate", type=float, default=0.05, help="share of deliveries answered with HTTP 500")
+    parser.add_argument("--cycles", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=64)
+    parser.add_argument("--per-host", type=int, default=16)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = Flask("webhook_bench")
+        app.config.update(API_DB_PATH=os.path.join(tmp, "api.db"), API_KEY_PEPPER_PATH=os.path.join(tmp, "pepper"))
+        init_api_manager(app)
+
+        secrets = {}
+        receivers = [_Receiver(secrets, args.fail_rate) for _ in range(args.receivers)]
+        for r in receivers:
+            threading.Thread(target=r.serve_forever, daemon=True).start()
+        secrets.update(_seed(app.config["API_DB_PATH"], receivers, args.endpoints, _unused_port()))
+
+        dispatcher = WebhookDispatcher(
+            app.config["API_DB_PATH"],
+            max_workers=args.workers,
+            per_host_limit=args.per_host,
+            max_attempts=3,
+            backoff_base=0.05,
+            backoff_max=0.5,
+            timeout=2,
+            allow_private=True,
+        )
+        dispatcher.start()
+        data = {"usd": "58,300", "eur": "63,100", "bitcoin": "67,214"}
+
+        for cycle in range(args.cycles):
+            before = dict(dispatcher.stats)
+            started = time.perf_counter()
+            dispatcher.publish(lambda scope: render_prices_body(EVENT_PRICES_UPDATED, {"data": data, "scope": scope, "cycle": cycle}))
+            while True:
+                stats = dispatcher.stats
+                done = stats["delivered"] + stats["dead_lettered"] - before.get("delivered", 0) - before.get("dead_lettered", 0)
+                if stats["fan_outs"] > before.get("fan_outs", 0) and done >= args.endpoints:
+                    break
+                time.sleep(0.01)
+            elapsed = time.perf_counter() - started
+            print(f"cycle {cycle}: {args.endpoints} endpoints in {elapsed:.2f}s ({args.endpoints / elapsed:,.0f} deliveries/s)")
+
+        dispatcher.stop()
+        db = sqlite3.connect(app.config["API_DB_PATH"])
+        dead = db.execute("SELECT COUNT(1) FROM webhook_dead_letters;").fetchone()[0]
+        db.close()
+        print(json.dumps(
+            {
+                "stats": dict(dispatcher.stats),
+                "received": sum(r.received for r in receivers),
+                "bad_signatures": sum(r.bad_signatures for r in receivers),
+                "dead_letter_rows": dead,
+            },
+            indent=2,
+        ))
+        for r in receivers:
+            r.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,278 @@
+import collections as _collections
+import functools as _functools
+import gzip as _gzip
+import importlib.util as _importlib_util
+import logging as _logging
+import os as _os
+import threading as _threading
+import time as _time
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+CBOR = "application/cbor"
+
+# نام‌های قدیمی‌تر MessagePack که بعضی کلاینت‌ها هنوز می‌فرستند
+_MEDIA_ALIASES = {"application/x-msgpack": MSGPACK, "application/vnd.msgpack": MSGPACK}
+
+IDENTITY = "identity"
+
+
+def _installed(module: str) -> bool:
+    # فقط وجود پکیج بررسی می‌شود؛ import واقعی با اولین درخواست همان فرمت انجام می‌شود
+    return _importlib_util.find_spec(module) is not None
+
+
+def _encode_msgpack(payload) -> bytes:
+    import msgpack
+
+    return msgpack.packb(payload, use_bin_type=True)
+
+
+def _encode_cbor(payload) -> bytes:
+    import cbor2
+
+    return cbor2.dumps(payload)
+
+
+def _compress_brotli(body: bytes, quality: int) -> bytes:
+    import brotli
+
+    return brotli.compress(body, quality=quality)
+
+
+def _format_encoders(dumps_json) -> dict:
+    """Media type -> encoder for every format whose library is installed (JSON always)."""
+    encoders = {JSON: lambda payload: dumps_json(payload).encode("utf-8")}
+    if _installed("msgpack"):
+        encoders[MSGPACK] = _encode_msgpack
+    if _installed("cbor2"):
+        encoders[CBOR] = _encode_cbor
+    return encoders
+
+
+def _content_compressors(gzip_level: int, brotli_quality: int) -> dict:
+    compressors = {"gzip": lambda body: _gzip.compress(body, compresslevel=gzip_level, mtime=0)}
+    if _installed("brotli"):
+        compressors = {"br": _functools.partial(_compress_brotli, quality=brotli_quality), **compressors}
+    return compressors
+
+
+class BodyVariants:
+    """Response bodies encoded on demand and reused until the next snapshot.
+
+    ``build_payload(key)`` returns the dict served for ``key`` (for example
+    ``("private", "gold")``). Each ``(media type, content coding)`` variant
+    of a key is encoded the first time a request negotiates it after
+    ``invalidate()``, and later requests only pick bytes, so a cache miss
+    costs one encoding rather than every format times every coding. A
+    compressed variant that is not smaller than its identity body is served
+    as identity. Bodies describe the snapshot as of its publication and are
+    only dropped early when ``expires_in()`` says so (the app passes the
+    time until a symbol turns stale) or, if set, after ``max_age`` seconds.
+
+    At most ``max_keys`` keys are cached, least recently used first out, so
+    open-ended keys (per-request symbol selections) stay bounded; ``pin()``
+    keeps fixed keys out of that eviction. ``hot_keys()`` lists the most
+    recently requested keys across invalidations and ``warm()`` rebuilds the
+    variants they were served in, ahead of the next request; ``warm(...,
+    all_variants=True)`` builds every format and coding up front.
+    """
+
+    def __init__(
+        self,
+        build_payload,
+        dumps_json,
+        *,
+        max_age: float = 0.0,
+        expires_in=None,
+        gzip_level: int = 9,
+        brotli_quality: int = 11,
+        max_keys: int = 256,
+        clock=_time.monotonic,
+    ):
+        self.build_payload = build_payload
+        self.max_age = float(max_age)
+        self.expires_in = expires_in
+        self._expires_at = None
+        self._encoders = _format_encoders(dumps_json)
+        self._compressors = _content_compressors(gzip_level, brotli_quality)
+        self._clock = clock
+        self._lock = _threading.Lock()
+        self.max_keys = max(1, int(max_keys))
+        self._generation = 0
+        self._pinned = set()
+        self._sets = _collections.OrderedDict()
+        self._recent = _collections.OrderedDict()
+        self._stats = {}
+
+    @classmethod
+    def from_env(cls, build_payload, dumps_json, expires_in=None) -> "BodyVariants":
+        return cls(
+            build_payload,
+            dumps_json,
+            max_age=float(_os.environ.get("BODY_VARIANT_MAX_AGE", "0")),
+            expires_in=expires_in,
+            gzip_level=int(_os.environ.get("BODY_GZIP_LEVEL", "9")),
+            brotli_quality=int(_os.environ.get("BODY_BROTLI_QUALITY", "11")),
+            max_keys=int(_os.environ.get("BODY_VARIANT_MAX_KEYS", "256")),
+        )
+
+    @property
+    def media_types(self) -> list:
+        return list(self._encoders)
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    @property
+    def codings(self) -> list:
+        return [*self._compressors, IDENTITY]
+
+    def negotiate(self, accept_mimetypes, accept_encodings) -> tuple:
+        """Pick ``(media_type, coding)`` from parsed Accept / Accept-Encoding headers."""
+        offers = [*self._encoders, *(alias for alias, target in _MEDIA_ALIASES.items() if target in self._encoders)]
+        media_type = accept_mimetypes.best_match(offers, default=JSON) or JSON
+        media_type = _MEDIA_ALIASES.get(media_type, media_type)
+        coding, best = IDENTITY, 0
+        # در کیفیت برابر ترتیب ما (اول brotli) برنده است، نه ترتیب هدر کلاینت
+        for candidate in self._compressors if accept_encodings else ():
+            quality = accept_encodings.quality(candidate)
+            if quality > best:
+                coding, best = candidate, quality
+        return media_type, coding
+
+    def invalidate(self) -> None:
+        now = self._clock()
+        with self._lock:
+            self._generation += 1
+            self._sets.clear()
+            self._expires_at = self._deadline(now)
+
+    def _deadline(self, now: float) -> float | None:
+        ttls = [self.max_age] if self.max_age > 0 else []
+        if self.expires_in is not None:
+            seconds = self.expires_in()
+            if seconds is not None:
+                ttls.append(max(0.0, seconds))
+        return now + min(ttls) if ttls else None
+
+    def pin(self, keys) -> None:
+        """Never evict ``keys`` (the fixed scopes) to make room for selections."""
+        with self._lock:
+            self._pinned.update(keys)
+
+    def warm(self, keys, all_variants: bool = False) -> None:
+        """Build, for each key, the variants it has been served in (identity JSON if none yet)."""
+        every = [(media_type, coding) for media_type in self._encoders for coding in self.codings]
+        for key in keys:
+            with self._lock:
+                wanted = every if all_variants else list(self._stats.get(key, ())) or [(JSON, IDENTITY)]
+            for media_type, coding in wanted:
+                if media_type in self._encoders and (coding == IDENTITY or coding in self._compressors):
+                    self._variant(key, media_type, coding)
+
+    def hot_keys(self, limit: int) -> list:
+        """Up to ``limit`` most recently requested keys, newest first."""
+        with self._lock:
+            return list(reversed(self._recent))[:limit]
+
+    def get(self, key, media_type: str, coding: str) -> tuple:
+        """Return ``(body, coding)``; ``coding`` falls back to identity if compressing did not help."""
+        with self._lock:
+            self._touch_locked(key)
+        body, used = self._variant(key, media_type, coding)
+        with self._lock:
+            stat = self._stats.get(key, {}).get((media_type, coding))
+            if stat is not None:
+                stat["served"] += 1
+        return body, used
+
+    def render(self, payload: dict, media_type: str, coding: str) -> tuple:
+        """Encode a one-off payload (bodies that differ per request) without caching."""
+        body = self._encoders[media_type](payload)
+        if coding != IDENTITY:
+            compressed = self._compressors[coding](body)
+            if len(compressed) < len(body):
+                return compressed, coding
+        return body, IDENTITY
+
+    def _entry(self, key) -> list:
+        """``[payload, variants]`` for the current snapshot, created empty on a miss."""
+        now = self._clock()
+        with self._lock:
+            if self._expires_at is not None and now >= self._expires_at:
+                # مثلا نمادی از stale_after گذشته؛ همه‌ی بدنه‌ها با freshness تازه دوباره ساخته می‌شوند
+                self._generation += 1
+                self._sets.clear()
+                self._expires_at = self._deadline(now)
+            entry = self._sets.get(key)
+            if entry is None:
+                entry = [None, {}]
+                self._sets[key] = entry
+            self._sets.move_to_end(key)
+            self._evict_locked()
+            return entry
+
+    def _evict_locked(self) -> None:
+        excess = len(self._sets) - self.max_keys
+        if excess <= 0:
+            return
+        for key in [k for k in self._sets if k not in self._pinned][:excess]:
+            del self._sets[key]
+
+    def _variant(self, key, media_type: str, coding: str) -> tuple:
+        # اگر وسط ساخت snapshot عوض شود، entry قدیمی از _sets حذف شده و نتیجه فقط برای همین درخواست است
+        entry = self._entry(key)
+        variants = entry[1]
+        found = variants.get((media_type, coding))
+        if found is not None:
+            return found
+        identity = variants.get((media_type, IDENTITY))
+        if identity is None:
+            if entry[0] is None:
+                entry[0] = self.build_payload(key)
+            started = _time.perf_counter()
+            body = self._encoders[media_type](entry[0])
+            identity = variants[(media_type, IDENTITY)] = (body, IDENTITY)
+            self._record_build(key, media_type, IDENTITY, len(body), _time.perf_counter() - started)
+        if coding == IDENTITY:
+            return identity
+        started = _time.perf_counter()
+        try:
+            compressed = self._compressors[coding](identity[0])
+        except Exception as exc:
+            _logging.warning("Could not %s-compress %s body for %s", coding, media_type, key, exc_info=exc)
+            compressed = identity[0]
+        found = (compressed, coding) if len(compressed) < len(identity[0]) else identity
+        variants[(media_type, coding)] = found
+        self._record_build(key, media_type, coding, len(found[0]), _time.perf_counter() - started)
+        return found
+
+    def _record_build(self, key, media_type: str, coding: str, size: int, seconds: float) -> None:
+        with self._lock:
+            stat = self._stats.setdefault(key, {}).setdefault((media_type, coding), {"served": 0, "builds": 0})
+            stat.update(bytes=size, encode_ms=round(seconds * 1000, 3))
+            stat["builds"] += 1
+
+    def _touch_locked(self, key) -> None:
+        self._recent[key] = None
+        self._recent.move_to_end(key)
+        while len(self._recent) > self.max_keys:
+            dropped, _ = self._recent.popitem(last=False)
+            # آمار کلیدهایی که دیگر درخواست نمی‌شوند هم دور ریخته می‌شود تا با انتخاب‌های دلخواه بی‌حد رشد نکند
+            self._stats.pop(dropped, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            rows = [
+                {"key": ":".join(map(str, key)), "media_type": media_type, "coding": coding, **stat}
+                for key, variants in sorted(self._stats.items(), key=lambda item: str(item[0]))
+                for (media_type, coding), stat in variants.items()
+            ]
+            return {
+                "generation": self._generation,
+                "media_types": self.media_types,
+                "codings": self.codings,
+                "variants": rows,
+            }
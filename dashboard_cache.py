@@ -0,0 +1,148 @@
+import collections as _collections
+import hashlib as _hashlib
+import threading as _threading
+import time as _time
+
+
+class VerifiedTokenCache:
+    """Payloads of already-verified JWTs, keyed by token digest, served only until ``exp``.
+
+    Tokens without an ``exp`` claim are never cached. The raw token is not
+    kept in memory, only its SHA-256 digest.
+    """
+
+    def __init__(self, max_entries: int = 10_000, clock=_time.time):
+        self.max_entries = int(max_entries)
+        self._clock = clock
+        self._lock = _threading.Lock()
+        self._entries = _collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _digest(token: str) -> bytes:
+        return _hashlib.sha256(token.encode("utf-8")).digest()
+
+    def get(self, token: str) -> dict | None:
+        digest = self._digest(token)
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, payload = entry
+            if self._clock() >= expires_at:
+                del self._entries[digest]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(digest)
+            self.hits += 1
+            return payload
+
+    def put(self, token: str, payload: dict) -> None:
+        try:
+            expires_at = float(payload["exp"])
+        except (KeyError, TypeError, ValueError):
+            return
+        digest = self._digest(token)
+        with self._lock:
+            self._entries[digest] = (expires_at, payload)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class UsageCounters:
+    """Latest monthly request count this process has seen per API key.
+
+    Fed by metering: every admitted request reports the count it was given,
+    so the value is at least as new as the last database read made by this
+    process. Requests metered in degraded mode only bump the count. The
+    last monthly quota seen for the key is kept too, so degraded metering
+    can still turn away keys that have used it up.
+    """
+
+    def __init__(self):
+        self._lock = _threading.Lock()
+        self._counts = {}
+        self._quotas = {}
+
+    def observe(self, api_key_id: int, month: str, request_count: int, monthly_quota: int | None = None) -> None:
+        key = (api_key_id, month)
+        with self._lock:
+            if request_count > self._counts.get(key, 0):
+                self._counts[key] = request_count
+            if monthly_quota is not None:
+                self._quotas[key] = int(monthly_quota)
+
+    def quota(self, api_key_id: int, month: str) -> int | None:
+        with self._lock:
+            return self._quotas.get((api_key_id, month))
+
+    def bump(self, api_key_id: int, month: str) -> None:
+        key = (api_key_id, month)
+        with self._lock:
+            self._counts[key] = self._counts.get(key, 0) + 1
+
+    def get(self, api_key_id: int, month: str) -> int:
+        with self._lock:
+            return self._counts.get((api_key_id, month), 0)
+
+
+class CustomerKeysCache:
+    """Per-user ``/me/keys`` rows, valid for one month and at most ``ttl`` seconds.
+
+    Entries are keyed by Supabase user id and remember the customer id, so a
+    write that only knows the customer (key rotation) can drop them too.
+    Each process has its own cache; writes handled by another worker show up
+    once ``ttl`` runs out.
+    """
+
+    def __init__(self, ttl: float = 30.0, max_entries: int = 10_000, clock=_time.monotonic):
+        self.ttl = float(ttl)
+        self.max_entries = int(max_entries)
+        self._clock = clock
+        self._lock = _threading.Lock()
+        self._entries = _collections.OrderedDict()
+        self._by_customer = {}
+
+    def get(self, user_id: str, month: str):
+        """Return ``(customer_id, rows)``, or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            stored_at, entry_month, customer_id, rows = entry
+            if entry_month != month or self._clock() - stored_at >= self.ttl:
+                self._drop(user_id)
+                return None
+            self._entries.move_to_end(user_id)
+            return customer_id, rows
+
+    def put(self, user_id: str, month: str, customer_id: int | None, rows: list) -> None:
+        with self._lock:
+            self._drop(user_id)
+            self._entries[user_id] = (self._clock(), month, customer_id, rows)
+            if customer_id is not None:
+                self._by_customer.setdefault(customer_id, set()).add(user_id)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate_user(self, user_id: str) -> None:
+        with self._lock:
+            self._drop(user_id)
+
+    def invalidate_customer(self, customer_id: int) -> None:
+        with self._lock:
+            for user_id in list(self._by_customer.get(customer_id, ())):
+                self._drop(user_id)
+
+    def _drop(self, user_id: str) -> None:
+        entry = self._entries.pop(user_id, None)
+        if entry is None:
+            return
+        users = self._by_customer.get(entry[2])
+        if users is not None:
+            users.discard(user_id)
+            if not users:
+                del self._by_customer[entry[2]]
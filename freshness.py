@@ -0,0 +1,100 @@
+import threading as _threading
+import time as _time
+
+MISSING_VALUE = "N/A"
+
+
+class SymbolTracker:
+    """Per-symbol last-good values with observation time and failure streak.
+
+    A failed read (``None``) keeps the previous value and bumps the symbol's
+    consecutive-failure count; a symbol whose last good observation is older
+    than ``stale_after`` seconds is reported as stale.
+    """
+
+    def __init__(self, symbols, stale_after: float = 300, clock=_time.time):
+        self.stale_after = float(stale_after)
+        self._clock = clock
+        self._lock = _threading.Lock()
+        self._records = {s: {"value": None, "observed_at": None, "failures": 0, "source": None} for s in symbols}
+
+    def observe(self, observed: dict, now: float | None = None, sources: dict | None = None) -> bool:
+        """Merge one scrape; returns True if any symbol's value changed.
+
+        ``sources`` optionally names where each observed value came from.
+        """
+        now = self._clock() if now is None else now
+        changed = False
+        with self._lock:
+            for symbol, record in self._records.items():
+                value = observed.get(symbol)
+                if value is None:
+                    record["failures"] += 1
+                    continue
+                if value != record["value"]:
+                    changed = True
+                record["value"] = value
+                record["observed_at"] = now
+                record["failures"] = 0
+                record["source"] = (sources or {}).get(symbol)
+        return changed
+
+    def fail_all(self) -> None:
+        with self._lock:
+            for record in self._records.values():
+                record["failures"] += 1
+
+    def values(self) -> dict:
+        with self._lock:
+            return {s: r["value"] if r["value"] is not None else MISSING_VALUE for s, r in self._records.items()}
+
+    def freshness(self, symbols=None, now: float | None = None) -> dict:
+        now = self._clock() if now is None else now
+        with self._lock:
+            items = self._records.items() if symbols is None else (
+                (s, self._records[s]) for s in symbols if s in self._records
+            )
+            out = {}
+            for symbol, record in items:
+                observed_at = record["observed_at"]
+                age = None if observed_at is None else max(0.0, now - observed_at)
+                out[symbol] = {
+                    "last_observed": None if observed_at is None else _time.strftime("%Y-%m-%d %H:%M:%S", _time.localtime(observed_at)),
+                    "age_seconds": None if age is None else int(age),
+                    "failures": record["failures"],
+                    "stale": age is None or age > self.stale_after,
+                    "source": record["source"],
+                }
+            return out
+
+    def seconds_until_stale(self, now: float | None = None) -> float | None:
+        """Seconds until the next fresh symbol turns stale (None if none will)."""
+        now = self._clock() if now is None else now
+        with self._lock:
+            left = [
+                record["observed_at"] + self.stale_after - now
+                for record in self._records.values()
+                if record["observed_at"] is not None
+            ]
+        left = [seconds for seconds in left if seconds >= 0]
+        # stale یعنی age > stale_after، پس کمی بعد از مرز
+        return min(left) + 0.001 if left else None
+
+    def dump(self) -> dict:
+        with self._lock:
+            return {s: dict(r) for s, r in self._records.items()}
+
+    def load(self, records: dict | None, values: dict | None = None, observed_at: float | None = None) -> None:
+        """Restore from ``dump()`` output, or from bare values stamped ``observed_at``."""
+        with self._lock:
+            for symbol, record in self._records.items():
+                saved = (records or {}).get(symbol)
+                if saved:
+                    record.update(
+                        value=saved.get("value"),
+                        observed_at=saved.get("observed_at"),
+                        failures=int(saved.get("failures") or 0),
+                        source=saved.get("source"),
+                    )
+                elif values and values.get(symbol) not in (None, MISSING_VALUE):
+                    record.update(value=values[symbol], observed_at=observed_at, failures=0)
@@ -0,0 +1,141 @@
+import os as _os
+import sqlite3 as _sqlite3
+import threading as _threading
+import time as _time
+
+# روزهایی که صفحه‌ی آرشیو داشتند ولی هیچ قیمتی نداشتند (تعطیلی‌ها) هم ثبت می‌شوند تا دوباره درخواست نشوند
+DAY_DONE = "done"
+DAY_EMPTY = "empty"
+
+_UPSERT_PRICE = """
+    INSERT INTO price_history (symbol, day, value, source, recorded_at) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (symbol, day) DO UPDATE SET
+        value = excluded.value, source = excluded.source, recorded_at = excluded.recorded_at;
+"""
+
+
+class HistoryStore:
+    """Daily closing value per symbol in a SQLite file of its own.
+
+    ``price_history`` holds one row per ``(symbol, day)``; ``backfill_days``
+    records which archive days have been imported, written in the same
+    transaction as their prices so an interrupted backfill resumes exactly
+    where its last committed batch ended. The file runs in WAL mode so API
+    reads are not blocked by a long import.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = _threading.local()
+        parent = _os.path.dirname(db_path)
+        if parent:
+            _os.makedirs(parent, exist_ok=True)
+        db = self._connect()
+        db.execute("PRAGMA journal_mode = WAL;")
+        db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS price_history (
+                symbol TEXT NOT NULL,
+                day TEXT NOT NULL,
+                value TEXT NOT NULL,
+                source TEXT NOT NULL,
+                recorded_at INTEGER NOT NULL,
+                PRIMARY KEY (symbol, day)
+            ) WITHOUT ROWID;
+
+            CREATE TABLE IF NOT EXISTS backfill_days (
+                day TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                symbols INTEGER NOT NULL,
+                fetched_at INTEGER NOT NULL
+            ) WITHOUT ROWID;
+            """
+        )
+
+    @classmethod
+    def from_env(cls, default_path: str) -> "HistoryStore":
+        return cls(_os.environ.get("HISTORY_DB_PATH") or default_path)
+
+    def _connect(self) -> _sqlite3.Connection:
+        # یک اتصال برای هر رشته؛ sqlite اتصال مشترک بین رشته‌ها را نمی‌پذیرد
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = _sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA synchronous = NORMAL;")
+            self._local.db = db
+        return db
+
+    def write_days(self, days: dict, source: str = "archive") -> int:
+        """Store ``{day: {symbol: value}}`` and mark those days imported, in one transaction.
+
+        Returns the number of price rows written. Values that are None are
+        skipped; a day with no values at all is recorded as empty.
+        """
+        now = int(_time.time())
+        rows = [
+            (symbol, day, value, source, now)
+            for day, values in days.items()
+            for symbol, value in values.items()
+            if value is not None
+        ]
+        progress = [
+            (day, DAY_DONE if any(v is not None for v in values.values()) else DAY_EMPTY,
+             sum(1 for v in values.values() if v is not None), now)
+            for day, values in days.items()
+        ]
+        db = self._connect()
+        db.execute("BEGIN IMMEDIATE;")
+        try:
+            db.executemany(_UPSERT_PRICE, rows)
+            db.executemany(
+                "INSERT OR REPLACE INTO backfill_days (day, status, symbols, fetched_at) VALUES (?, ?, ?, ?);",
+                progress,
+            )
+            db.execute("COMMIT;")
+        except BaseException:
+            db.execute("ROLLBACK;")
+            raise
+        return len(rows)
+
+    def record_live(self, day: str, values: dict) -> None:
+        """Keep today's latest scraped value per symbol (live rows do not mark the day as backfilled)."""
+        now = int(_time.time())
+        rows = [(symbol, day, value, "live", now) for symbol, value in values.items() if value is not None]
+        if not rows:
+            return
+        db = self._connect()
+        db.execute("BEGIN IMMEDIATE;")
+        try:
+            db.executemany(_UPSERT_PRICE, rows)
+            db.execute("COMMIT;")
+        except BaseException:
+            db.execute("ROLLBACK;")
+            raise
+
+    def imported_days(self, start: str, end: str) -> set:
+        rows = self._connect().execute(
+            "SELECT day FROM backfill_days WHERE day BETWEEN ? AND ?;", (start, end)
+        ).fetchall()
+        return {r[0] for r in rows}
+
+    def query(self, symbols, start: str, end: str) -> dict:
+        """``{symbol: [[day, value], ...]}`` for ``start <= day <= end``, oldest first."""
+        symbols = list(symbols)
+        out = {symbol: [] for symbol in symbols}
+        if not symbols:
+            return out
+        placeholders = ",".join("?" * len(symbols))
+        rows = self._connect().execute(
+            f"SELECT symbol, day, value FROM price_history WHERE symbol IN ({placeholders}) AND day BETWEEN ? AND ? "
+            "ORDER BY symbol, day;",
+            (*symbols, start, end),
+        )
+        for symbol, day, value in rows:
+            out[symbol].append([day, value])
+        return out
+
+    def stats(self) -> dict:
+        db = self._connect()
+        rows, first, last = db.execute("SELECT COUNT(*), MIN(day), MAX(day) FROM price_history;").fetchone()
+        days = dict(db.execute("SELECT status, COUNT(*) FROM backfill_days GROUP BY status;").fetchall())
+        return {"rows": rows, "first_day": first, "last_day": last, "imported_days": days}
@@ -0,0 +1,211 @@
+import datetime as _dt
+import logging as _logging
+import math as _math
+import sqlite3 as _sqlite3
+import threading as _threading
+import time as _time
+
+
+def _month_key() -> str:
+    return _dt.datetime.utcnow().strftime("%Y-%m")
+
+
+class _Lease:
+    __slots__ = ("month", "remaining", "granted", "committed", "monthly_quota", "granted_at", "expires_at", "rate", "lock")
+
+    def __init__(self):
+        self.month = None
+        self.remaining = 0
+        self.granted = 0
+        self.committed = 0
+        self.monthly_quota = 0
+        self.granted_at = 0.0
+        self.expires_at = 0.0
+        self.rate = 0.0
+        self.lock = _threading.Lock()
+
+
+class QuotaLeaseManager:
+    """Per-process quota leases over ``usage_monthly``.
+
+    Instead of one ``BEGIN IMMEDIATE`` per request, a worker reserves a block
+    of a key's remaining ``monthly_quota + extra_quota`` by adding the whole
+    block to ``request_count`` in one transaction, then admits requests from
+    that block locally. Unused units are given back when the lease expires,
+    when the month rolls over and at shutdown.
+
+    Because every admitted request was already counted in the database
+    before it was served, the monthly quota is never exceeded, whatever the
+    number of workers or nodes. The error goes the other way: a key can be
+    rejected while other workers still hold up to ``max_lease`` unused units
+    each, or while a crashed worker's block is counted but was never served.
+    To keep that bounded near the limit, a grant never takes more than
+    ``1 / fair_share`` of what is left, so the last units go out one at a time.
+    Lease size follows each key's observed request rate (``rate * ttl``).
+    """
+
+    def __init__(
+        self,
+        *,
+        ttl: float = 10.0,
+        min_lease: int = 1,
+        max_lease: int = 1000,
+        fair_share: int = 4,
+        clock=_time.monotonic,
+        on_grant=None,
+    ):
+        self.ttl = float(ttl)
+        self.min_lease = max(1, int(min_lease))
+        self.max_lease = max(self.min_lease, int(max_lease))
+        self.fair_share = max(1, int(fair_share))
+        self._clock = clock
+        self._on_grant = on_grant
+        self._leases = {}
+        self._lock = _threading.Lock()
+        self._last_sweep = clock()
+
+    def _lease_for(self, api_key_id: int) -> _Lease:
+        with self._lock:
+            lease = self._leases.get(api_key_id)
+            if lease is None:
+                lease = self._leases[api_key_id] = _Lease()
+            return lease
+
+    def acquire(self, db: _sqlite3.Connection, *, api_key_id: int) -> dict:
+        """Admit one request; same result shape as a direct metered increment."""
+        month = _month_key()
+        lease = self._lease_for(api_key_id)
+        with lease.lock:
+            now = self._clock()
+            if lease.month == month and lease.remaining > 0 and now < lease.expires_at:
+                lease.remaining -= 1
+                return self._result(lease)
+            result = self._renew(db, api_key_id, lease, month, now)
+        if now - self._last_sweep >= self.ttl:
+            self.sweep(db)
+        return result
+
+    def _target_size(self, lease: _Lease, now: float) -> int:
+        if lease.granted_at:
+            served = lease.granted - lease.remaining
+            elapsed = max(now - lease.granted_at, 1e-3)
+            observed = served / elapsed
+            lease.rate = observed if not lease.rate else 0.5 * lease.rate + 0.5 * observed
+        return min(self.max_lease, max(self.min_lease, _math.ceil(lease.rate * self.ttl)))
+
+    def _renew(self, db: _sqlite3.Connection, api_key_id: int, lease: _Lease, month: str, now: float) -> dict:
+        size = self._target_size(lease, now)
+        refund = lease.remaining if lease.month is not None else 0
+        db.execute("BEGIN IMMEDIATE;")
+        try:
+            if refund:
+                db.execute(
+                    "UPDATE usage_monthly SET request_count = MAX(0, request_count - ?) WHERE api_key_id = ? AND month = ?;",
+                    (refund, api_key_id, lease.month),
+                )
+            lease.remaining = 0
+            row = db.execute(
+                """
+                SELECT plans.monthly_quota AS base_quota,
+                       COALESCE(usage_monthly.request_count, 0) AS request_count,
+                       COALESCE(usage_monthly.extra_quota, 0) AS extra_quota
+                FROM api_keys
+                JOIN plans ON plans.id = api_keys.plan_id
+                LEFT JOIN usage_monthly ON usage_monthly.api_key_id = api_keys.id AND usage_monthly.month = ?
+                WHERE api_keys.id = ? AND api_keys.status = 'active';
+                """,
+                (month, api_key_id),
+            ).fetchone()
+            if not row:
+                db.commit()
+                lease.month = None
+                return {"ok": False, "error": "API key not active."}
+
+            monthly_quota = int(row["base_quota"]) + int(row["extra_quota"])
+            request_count = int(row["request_count"])
+            available = monthly_quota - request_count
+            if available <= 0:
+                db.commit()
+                lease.month = None
+                return {"ok": False, "error": "Monthly quota exceeded.", "month": month, "request_count": request_count, "monthly_quota": monthly_quota}
+
+            grant = max(1, min(size, available // self.fair_share))
+            db.execute(
+                """
+                INSERT INTO usage_monthly (api_key_id, month, request_count, extra_quota)
+                VALUES (?, ?, ?, 0)
+                ON CONFLICT(api_key_id, month) DO UPDATE SET request_count = request_count + ?;
+                """,
+                (api_key_id, month, grant, grant),
+            )
+            db.commit()
+        except BaseException:
+            db.rollback()
+            raise
+
+        lease.month = month
+        lease.granted = grant
+        lease.remaining = grant - 1
+        lease.committed = request_count + grant
+        lease.monthly_quota = monthly_quota
+        lease.granted_at = now
+        lease.expires_at = now + self.ttl
+        if self._on_grant is not None:
+            self._on_grant(db, api_key_id, month)
+        return self._result(lease)
+
+    @staticmethod
+    def _result(lease: _Lease) -> dict:
+        return {
+            "ok": True,
+            "month": lease.month,
+            "request_count": lease.committed - lease.remaining,
+            "monthly_quota": lease.monthly_quota,
+        }
+
+    def _refund(self, db: _sqlite3.Connection, expired_only: bool) -> int:
+        now = self._clock()
+        with self._lock:
+            leases = list(self._leases.items())
+        pending = []
+        for api_key_id, lease in leases:
+            if not lease.lock.acquire(blocking=False):
+                continue
+            try:
+                if lease.month is None or lease.remaining <= 0 or (expired_only and now < lease.expires_at):
+                    continue
+                pending.append((lease.remaining, api_key_id, lease.month))
+                lease.remaining = 0
+                lease.month = None
+            finally:
+                lease.lock.release()
+        if pending:
+            db.execute("BEGIN IMMEDIATE;")
+            db.executemany(
+                "UPDATE usage_monthly SET request_count = MAX(0, request_count - ?) WHERE api_key_id = ? AND month = ?;",
+                pending,
+            )
+            db.commit()
+        return len(pending)
+
+    def sweep(self, db: _sqlite3.Connection) -> int:
+        """Give back unused units of expired leases of keys that went idle."""
+        self._last_sweep = self._clock()
+        try:
+            return self._refund(db, expired_only=True)
+        except _sqlite3.Error as exc:
+            _logging.warning("Quota lease sweep failed", exc_info=exc)
+            return 0
+
+    def release_all(self, db_path: str) -> int:
+        """Give back every unused unit; call at shutdown."""
+        db = _sqlite3.connect(db_path, timeout=30)
+        db.row_factory = _sqlite3.Row
+        try:
+            return self._refund(db, expired_only=False)
+        finally:
+            db.close()
+
+    def outstanding(self) -> int:
+        with self._lock:
+            return sum(lease.remaining for lease in self._leases.values() if lease.month is not None)
@@ -0,0 +1,332 @@
+import json as _json
+import logging as _logging
+import os as _os
+import socket as _socket
+import threading as _threading
+import time as _time
+import uuid as _uuid
+
+
+class MemoryBackend:
+    """In-process stand-in for the Redis backend (same method contract).
+
+    Several SnapshotReplicator instances sharing one MemoryBackend behave like
+    nodes sharing one Redis, which is enough for local runs and failover drills.
+    """
+
+    def __init__(self, clock=_time.monotonic):
+        self._clock = clock
+        self._lock = _threading.Lock()
+        self._locks = {}
+        self._counters = {}
+        self._snapshots = {}
+        self._subscribers = {}
+
+    def try_acquire(self, name: str, holder: str, ttl_ms: int) -> bool:
+        with self._lock:
+            current = self._locks.get(name)
+            if current and current[1] > self._clock() and current[0] != holder:
+                return False
+            self._locks[name] = (holder, self._clock() + ttl_ms / 1000)
+            return True
+
+    def renew(self, name: str, holder: str, ttl_ms: int) -> bool:
+        with self._lock:
+            current = self._locks.get(name)
+            if not current or current[0] != holder or current[1] <= self._clock():
+                return False
+            self._locks[name] = (holder, self._clock() + ttl_ms / 1000)
+            return True
+
+    def release(self, name: str, holder: str) -> None:
+        with self._lock:
+            if self._locks.get(name, (None,))[0] == holder:
+                del self._locks[name]
+
+    def incr(self, name: str) -> int:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + 1
+            return self._counters[name]
+
+    def publish_snapshot(self, key: str, channel: str, body: bytes, fence: int, version: int) -> bool:
+        with self._lock:
+            stored = self._snapshots.get(key)
+            if stored and (stored[0], stored[1]) >= (fence, version):
+                return False
+            self._snapshots[key] = (fence, version, body)
+            subscribers = list(self._subscribers.get(channel, ()))
+        for callback in subscribers:
+            callback(body)
+        return True
+
+    def get_snapshot(self, key: str) -> bytes | None:
+        with self._lock:
+            stored = self._snapshots.get(key)
+            return stored[2] if stored else None
+
+    def subscribe(self, channel: str, callback) -> None:
+        with self._lock:
+            self._subscribers.setdefault(channel, []).append(callback)
+
+    def close(self) -> None:
+        pass
+
+
+class RedisBackend:
+    """Redis (or any Redis-compatible server) backend; ``redis`` is imported lazily."""
+
+    _RENEW = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('pexpire', KEYS[1], ARGV[2]) else return 0 end"
+    _RELEASE = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) else return 0 end"
+    # ذخیره فقط وقتی (fence, version) از نسخه‌ی ذخیره‌شده جدیدتر باشد؛ رهبر قدیمی نمی‌تواند بازنویسی کند
+    _PUBLISH = """
+local fence = tonumber(redis.call('hget', KEYS[1], 'fence') or '-1')
+local version = tonumber(redis.call('hget', KEYS[1], 'version') or '-1')
+local new_fence = tonumber(ARGV[2])
+local new_version = tonumber(ARGV[3])
+if new_fence < fence or (new_fence == fence and new_version <= version) then
+  return 0
+end
+redis.call('hset', KEYS[1], 'fence', ARGV[2], 'version', ARGV[3], 'body', ARGV[1])
+redis.call('publish', KEYS[2], ARGV[1])
+return 1
+"""
+
+    def __init__(self, url: str = "redis://localhost:6379/0", client=None):
+        if client is None:
+            import redis
+
+            client = redis.Redis.from_url(url)
+        self._redis = client
+        self._renew = self._redis.register_script(self._RENEW)
+        self._release = self._redis.register_script(self._RELEASE)
+        self._publish = self._redis.register_script(self._PUBLISH)
+        self._pubsub = None
+        self._thread = None
+        self._errors = 0
+        self._closed = False
+
+    def try_acquire(self, name: str, holder: str, ttl_ms: int) -> bool:
+        return bool(self._redis.set(name, holder, nx=True, px=ttl_ms))
+
+    def renew(self, name: str, holder: str, ttl_ms: int) -> bool:
+        return bool(self._renew(keys=[name], args=[holder, ttl_ms]))
+
+    def release(self, name: str, holder: str) -> None:
+        self._release(keys=[name], args=[holder])
+
+    def incr(self, name: str) -> int:
+        return int(self._redis.incr(name))
+
+    def publish_snapshot(self, key: str, channel: str, body: bytes, fence: int, version: int) -> bool:
+        return bool(self._publish(keys=[key, channel], args=[body, fence, version]))
+
+    def get_snapshot(self, key: str) -> bytes | None:
+        return self._redis.hget(key, "body")
+
+    def subscribe(self, channel: str, callback) -> None:
+        if self._thread is not None:
+            self._thread.stop()
+        self._pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        self._pubsub.subscribe(**{channel: lambda message: self._deliver(callback, message)})
+        self._thread = self._pubsub.run_in_thread(sleep_time=1.0, daemon=True, exception_handler=self._on_pubsub_error)
+
+    def _deliver(self, callback, message) -> None:
+        self._errors = 0
+        callback(message["data"])
+
+    def _on_pubsub_error(self, exc, pubsub, thread) -> None:
+        # بدون این handler خطای اتصال ترد subscriber را بی‌صدا می‌کشد؛ اینجا ترد زنده می‌ماند و
+        # get_message بعدی دوباره وصل و subscribe می‌کند (پیام‌های از دست رفته با reconcile جبران می‌شوند)
+        if self._closed:
+            # close() اتصال را بسته؛ ترد خودش با stop() تمام می‌شود
+            return
+        self._errors += 1
+        _logging.warning("Replication: Redis subscriber error (%s); reconnecting", exc)
+        _time.sleep(min(30.0, 0.5 * 2 ** min(self._errors, 6)))
+
+    def close(self) -> None:
+        self._closed = True
+        if self._thread is not None:
+            self._thread.stop()
+            self._thread.join(timeout=2.0)
+        self._redis.close()
+
+
+class SnapshotReplicator:
+    """Leader-elected snapshot replication with fencing tokens.
+
+    Candidate nodes race for a leader lock that must be renewed every
+    ``heartbeat`` seconds and expires after ``lease_ttl``. A node that wins
+    takes a new fencing token from a shared counter; every snapshot it
+    publishes is tagged ``(fence, version)``. The backend only stores and
+    broadcasts a snapshot that is newer than the stored one, and subscribers
+    only apply snapshots newer than the one they hold, so a paused or
+    partitioned ex-leader can never roll data back. When the leader stops
+    renewing, another candidate takes over within about ``lease_ttl``.
+
+    Subscribing happens on the heartbeat thread, so a backend that is down
+    at boot only delays replication. Followers also re-read the stored
+    snapshot every ``reconcile_interval`` seconds to catch up on anything
+    broadcast while their subscription was broken.
+    """
+
+    def __init__(
+        self,
+        backend,
+        apply_snapshot,
+        *,
+        prefix: str = "bonbast",
+        node_id: str | None = None,
+        heartbeat: float = 2.0,
+        lease_ttl: float = 6.0,
+        reconcile_interval: float = 30.0,
+        on_leadership_change=None,
+    ):
+        self.backend = backend
+        self.apply_snapshot = apply_snapshot
+        self.node_id = node_id or f"{_socket.gethostname()}-{_os.getpid()}-{_uuid.uuid4().hex[:6]}"
+        self.heartbeat = heartbeat
+        self.lease_ttl = lease_ttl
+        self.reconcile_interval = reconcile_interval
+        self.on_leadership_change = on_leadership_change
+
+        self._lock_key = f"{prefix}:leader"
+        self._fence_key = f"{prefix}:fence"
+        self._snapshot_key = f"{prefix}:snapshot"
+        self._channel = f"{prefix}:snapshots"
+
+        self._state_lock = _threading.Lock()
+        self._candidate = False
+        self._fence = None
+        self._version = 0
+        self._applied = (-1, -1)
+        self._subscribed = False
+        self._reconciled_at = None
+        self._stop = _threading.Event()
+        self._thread = None
+
+    @classmethod
+    def from_env(cls, apply_snapshot, **kwargs) -> "SnapshotReplicator | None":
+        mode = (_os.environ.get("REPLICATION_MODE") or "off").strip().lower()
+        if mode == "off":
+            return None
+        if mode == "memory":
+            backend = MemoryBackend()
+        elif mode == "redis":
+            backend = RedisBackend(_os.environ.get("REDIS_URL", "redis://localhost:6379/0"))
+        else:
+            raise ValueError(f"Unknown REPLICATION_MODE: {mode}")
+        return cls(
+            backend,
+            apply_snapshot,
+            prefix=_os.environ.get("REPLICATION_PREFIX", "bonbast"),
+            heartbeat=float(_os.environ.get("REPLICATION_HEARTBEAT", "2")),
+            lease_ttl=float(_os.environ.get("REPLICATION_LEASE_TTL", "6")),
+            reconcile_interval=float(_os.environ.get("REPLICATION_RECONCILE", "30")),
+            **kwargs,
+        )
+
+    @property
+    def is_leader(self) -> bool:
+        return self._fence is not None
+
+    def start(self) -> None:
+        self._thread = _threading.Thread(target=self._heartbeat_loop, name="replication-heartbeat", daemon=True)
+        self._thread.start()
+
+    def enable_candidacy(self) -> None:
+        """Let this node compete for leadership (only nodes that can scrape should)."""
+        self._candidate = True
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self.is_leader:
+            self.backend.release(self._lock_key, self.node_id)
+            self._set_leader(None)
+        self.backend.close()
+
+    def _set_leader(self, fence: int | None) -> None:
+        with self._state_lock:
+            was_leader = self._fence is not None
+            self._fence = fence
+            self._version = 0
+        if was_leader != (fence is not None):
+            _logging.info("Replication: node %s %s leadership (fence=%s)", self.node_id, "took" if fence else "lost", fence)
+            if self.on_leadership_change is not None:
+                self.on_leadership_change(fence is not None)
+
+    def _sync_follower(self) -> None:
+        if not self._subscribed:
+            self.backend.subscribe(self._channel, self._on_message)
+            self._subscribed = True
+            self._reconciled_at = None
+        now = _time.monotonic()
+        if self._reconciled_at is not None and now - self._reconciled_at < self.reconcile_interval:
+            return
+        latest = self.backend.get_snapshot(self._snapshot_key)
+        self._reconciled_at = now
+        if latest:
+            self._on_message(latest)
+
+    def _heartbeat_loop(self) -> None:
+        ttl_ms = int(self.lease_ttl * 1000)
+        while not self._stop.is_set():
+            try:
+                self._sync_follower()
+            except Exception as exc:
+                _logging.warning("Replication subscribe/reconcile failed", exc_info=exc)
+            try:
+                if self.is_leader:
+                    if not self.backend.renew(self._lock_key, self.node_id, ttl_ms):
+                        self._set_leader(None)
+                elif self._candidate and self.backend.try_acquire(self._lock_key, self.node_id, ttl_ms):
+                    self._set_leader(self.backend.incr(self._fence_key))
+            except Exception as exc:
+                # بدون دسترسی به backend نمی‌توان از رهبری مطمئن بود
+                _logging.warning("Replication heartbeat failed", exc_info=exc)
+                self._set_leader(None)
+            self._stop.wait(self.heartbeat)
+
+    def publish(self, snapshot: dict) -> bool:
+        """Publish a snapshot if this node is the leader; returns whether it was accepted."""
+        with self._state_lock:
+            if self._fence is None:
+                return False
+            self._version += 1
+            fence, version = self._fence, self._version
+        body = _json.dumps(
+            {"fence": fence, "version": version, "node": self.node_id, "snapshot": snapshot},
+            ensure_ascii=False,
+            separators=(",", ":"),
+        ).encode("utf-8")
+        if self.backend.publish_snapshot(self._snapshot_key, self._channel, body, fence, version):
+            return True
+        # یک رهبر جدیدتر وجود دارد؛ این نود کنار می‌رود
+        _logging.warning("Replication: snapshot (fence=%s, version=%s) rejected as stale; stepping down", fence, version)
+        self._set_leader(None)
+        return False
+
+    def _on_message(self, body) -> None:
+        try:
+            envelope = _json.loads(body)
+            tag = (int(envelope["fence"]), int(envelope["version"]))
+        except (ValueError, KeyError, TypeError):
+            _logging.warning("Replication: ignoring malformed message")
+            return
+        with self._state_lock:
+            if tag <= self._applied:
+                return
+            self._applied = tag
+        if envelope.get("node") == self.node_id:
+            return
+        self.apply_snapshot(envelope["snapshot"])
+
+    def state(self) -> dict:
+        return {
+            "node": self.node_id,
+            "leader": self.is_leader,
+            "fence": self._fence,
+            "applied": {"fence": self._applied[0], "version": self._applied[1]},
+        }
@@ -0,0 +1,181 @@
+import datetime as _dt
+import os as _os
+import random as _random
+import threading as _threading
+import time as _time
+
+# ایران از ۱۴۰۱ ساعت تابستانی ندارد؛ offset ثابت +03:30
+TEHRAN_OFFSET_MINUTES = 210
+
+_DAY_NAMES = {"mon": 0, "tue": 1, "wed": 2, "thu": 3, "fri": 4, "sat": 5, "sun": 6}
+
+# بازار تهران: شنبه تا چهارشنبه تمام روز، پنجشنبه تا ظهر
+DEFAULT_PROFILES = "sat-wed 09:00-20:00 60-120; thu 09:00-14:00 60-120"
+
+
+def _parse_days(spec: str) -> frozenset:
+    if spec == "*":
+        return frozenset(range(7))
+    if "-" not in spec:
+        return frozenset([_DAY_NAMES[spec]])
+    first, last = (_DAY_NAMES[p] for p in spec.split("-", 1))
+    days = [first]
+    while days[-1] != last:
+        days.append((days[-1] + 1) % 7)
+    return frozenset(days)
+
+
+def _parse_clock(value: str) -> int:
+    hours, minutes = value.split(":", 1)
+    return int(hours) * 60 + int(minutes)
+
+
+def parse_profiles(spec: str) -> list:
+    """Parse ``"sat-wed 09:00-20:00 60-120; * 00:00-24:00 120-900"``.
+
+    Each entry is ``days start-end min-max`` (local Tehran time, seconds for
+    the interval bounds). The first matching entry wins.
+    """
+    profiles = []
+    for entry in (spec or "").split(";"):
+        entry = entry.strip().lower()
+        if not entry:
+            continue
+        days, window, bounds = entry.split()
+        start, end = (_parse_clock(p) for p in window.split("-", 1))
+        low, high = (float(p) for p in bounds.split("-", 1))
+        profiles.append(
+            {
+                "name": f"{days} {window}",
+                "days": _parse_days(days),
+                "start": start,
+                "end": end,
+                "min_interval": low,
+                "max_interval": max(low, high),
+            }
+        )
+    return profiles
+
+
+def _env_float(name: str, default: float) -> float:
+    value = _os.environ.get(name)
+    return float(value) if value else default
+
+
+class ScrapeScheduler:
+    """Fixed-rate scrape cadence with jittered backoff and adaptive intervals.
+
+    Successful cycles are scheduled from the previous due time (not from the end
+    of the scrape), so a slow scrape does not push the period out. Each unchanged
+    snapshot stretches the interval towards the active profile's maximum and a
+    changed one pulls it back towards the minimum. Failures retry after an
+    exponentially growing, fully jittered delay.
+    """
+
+    def __init__(
+        self,
+        *,
+        min_interval: float = 60,
+        max_interval: float = 600,
+        growth: float = 1.5,
+        backoff_base: float = 5,
+        backoff_max: float = 120,
+        profiles: list | None = None,
+        tz_offset_minutes: int = TEHRAN_OFFSET_MINUTES,
+        clock=_time.monotonic,
+        wall_clock=_time.time,
+        rng: _random.Random | None = None,
+    ):
+        self.min_interval = float(min_interval)
+        self.max_interval = max(float(max_interval), self.min_interval)
+        self.growth = max(1.0, float(growth))
+        self.backoff_base = float(backoff_base)
+        self.backoff_max = float(backoff_max)
+        self.profiles = profiles or []
+        self.tz = _dt.timezone(_dt.timedelta(minutes=tz_offset_minutes))
+        self._clock = clock
+        self._wall_clock = wall_clock
+        self._rng = rng or _random.Random()
+        self._lock = _threading.Lock()
+
+        self.failures = 0
+        self.interval = self.min_interval
+        self._profile_name = None
+        self._anchor = clock()
+        self._next_due = self._anchor
+
+    @classmethod
+    def from_env(cls) -> "ScrapeScheduler":
+        return cls(
+            min_interval=_env_float("SCRAPE_MIN_INTERVAL", 60),
+            max_interval=_env_float("SCRAPE_MAX_INTERVAL", 600),
+            growth=_env_float("SCRAPE_INTERVAL_GROWTH", 1.5),
+            backoff_base=_env_float("SCRAPE_BACKOFF_BASE", 5),
+            backoff_max=_env_float("SCRAPE_BACKOFF_MAX", 120),
+            profiles=parse_profiles(_os.environ.get("SCRAPE_PROFILES", DEFAULT_PROFILES)),
+            tz_offset_minutes=int(_env_float("SCRAPE_TZ_OFFSET_MINUTES", TEHRAN_OFFSET_MINUTES)),
+        )
+
+    def _active_profile(self) -> dict:
+        local = _dt.datetime.fromtimestamp(self._wall_clock(), tz=self.tz)
+        minute = local.hour * 60 + local.minute
+        for profile in self.profiles:
+            if local.weekday() in profile["days"] and profile["start"] <= minute < profile["end"]:
+                return profile
+        return {"name": "default", "min_interval": self.min_interval, "max_interval": self.max_interval}
+
+    def _bounded_interval(self, profile: dict) -> float:
+        if profile["name"] != self._profile_name:
+            # ورود به یک بازه‌ی جدید: از حداقل همان پروفایل شروع کن
+            self._profile_name = profile["name"]
+            self.interval = profile["min_interval"]
+        return min(max(self.interval, profile["min_interval"]), profile["max_interval"])
+
+    def record_success(self, changed: bool) -> float:
+        """Schedule the next cycle after a good scrape; returns its interval."""
+        with self._lock:
+            profile = self._active_profile()
+            interval = self._bounded_interval(profile)
+            if changed:
+                interval = max(profile["min_interval"], interval / self.growth)
+            else:
+                interval = min(profile["max_interval"], interval * self.growth)
+            self.interval = interval
+
+            now = self._clock()
+            if self.failures:
+                # بعد از خطا ریتم را از همین لحظه دوباره تنظیم کن
+                self._anchor = now
+            self.failures = 0
+            self._anchor += interval
+            while self._anchor <= now:
+                self._anchor += interval
+            self._next_due = self._anchor
+            return interval
+
+    def record_failure(self) -> float:
+        """Schedule a retry with full-jitter exponential backoff; returns the delay."""
+        with self._lock:
+            self.failures += 1
+            # توان را محدود کن؛ بعد از ۱۰۲۴ خطای پشت‌سرهم 2**n به float تبدیل نمی‌شود (OverflowError)
+            cap = min(self.backoff_max, self.backoff_base * (2 ** min(self.failures - 1, 32)))
+            delay = self._rng.uniform(min(1.0, cap), cap)
+            self._next_due = self._clock() + delay
+            return delay
+
+    def seconds_until_next(self) -> float:
+        return max(0.0, self._next_due - self._clock())
+
+    def next_run_epoch(self) -> float:
+        return self._wall_clock() + self.seconds_until_next()
+
+    def wait(self) -> None:
+        _time.sleep(self.seconds_until_next())
+
+    def state(self) -> dict:
+        return {
+            "interval": round(self.interval, 1),
+            "profile": self._profile_name or "default",
+            "failures": self.failures,
+            "next_in": round(self.seconds_until_next(), 1),
+        }
@@ -0,0 +1,315 @@
+import concurrent.futures as _futures
+import html.parser as _html_parser
+import json as _json
+import os as _os
+import threading as _threading
+import time as _time
+import urllib.request as _urllib_request
+
+from scraper import BONBAST_URL, PAGE_LOAD_TIMEOUT, READY_ELEMENT_ID, TARGETS
+
+BROWSER = "browser"
+HTTP = "http"
+
+# مهلت کل خواندن یک منبع مرورگری: بالا آمدن Chrome + بارگذاری صفحه + صبر برای المان (هر کدام حداکثر PAGE_LOAD_TIMEOUT)
+BROWSER_TIMEOUT = 60.0
+
+# عناصری که تگ بسته ندارند و نباید در پشته‌ی parser بمانند
+_VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+
+
+class Source:
+    """One page of the scrape plan: where to read it and which symbol maps to which field.
+
+    ``targets`` maps API symbol -> element id (``browser`` and ``http`` with
+    ``format: html``) or dotted JSON path such as ``"data.usd.sell"``
+    (``http`` with ``format: json``). ``timeout`` bounds the whole read of
+    this source, browser startup included (``BROWSER_TIMEOUT`` for browser
+    sources, ``PAGE_LOAD_TIMEOUT`` for http ones by default);
+    ``page_timeout`` bounds the page load and the ready wait separately.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        url: str,
+        targets: dict,
+        *,
+        kind: str = BROWSER,
+        fmt: str = "html",
+        timeout: float | None = None,
+        page_timeout: float = PAGE_LOAD_TIMEOUT,
+        ready: str = READY_ELEMENT_ID,
+        headers: dict | None = None,
+    ):
+        if kind not in (BROWSER, HTTP):
+            raise ValueError(f"Unknown source kind {kind!r} for {name!r}.")
+        if fmt not in ("html", "json"):
+            raise ValueError(f"Unknown source format {fmt!r} for {name!r}.")
+        self.name = name
+        self.url = url
+        self.targets = dict(targets)
+        self.kind = kind
+        self.fmt = fmt
+        if timeout is None:
+            timeout = BROWSER_TIMEOUT if kind == BROWSER else PAGE_LOAD_TIMEOUT
+        self.timeout = float(timeout)
+        self.page_timeout = float(page_timeout)
+        self.ready = ready
+        self.headers = dict(headers or {})
+
+    @classmethod
+    def from_dict(cls, raw: dict, browser_timeout: float = BROWSER_TIMEOUT) -> "Source":
+        kind = raw.get("kind", BROWSER)
+        timeout = raw.get("timeout")
+        if timeout is None and kind == BROWSER:
+            timeout = browser_timeout
+        return cls(
+            raw["name"],
+            raw["url"],
+            raw.get("targets") or TARGETS,
+            kind=kind,
+            fmt=raw.get("format", "html"),
+            timeout=None if timeout is None else float(timeout),
+            page_timeout=float(raw.get("page_timeout", PAGE_LOAD_TIMEOUT)),
+            ready=raw.get("ready", READY_ELEMENT_ID),
+            headers=raw.get("headers"),
+        )
+
+    def fetch(self) -> dict:
+        """Read this source once; symbols that could not be read map to None."""
+        if self.kind == BROWSER:
+            return self._fetch_browser()
+        return self._fetch_http()
+
+    def _fetch_browser(self) -> dict:
+        from scraper import create_driver, extract_prices, load_page, wait_until_ready
+
+        driver = create_driver()
+        try:
+            driver.set_page_load_timeout(self.page_timeout)
+            load_page(driver, self.url)
+            wait_until_ready(driver, self.page_timeout, element_id=self.ready)
+            return extract_prices(driver, self.targets)
+        finally:
+            driver.quit()
+
+    def _fetch_http(self) -> dict:
+        request = _urllib_request.Request(self.url, headers={"User-Agent": "bonbast-scraper", **self.headers})
+        with _urllib_request.urlopen(request, timeout=self.timeout) as response:
+            body = response.read().decode(response.headers.get_content_charset() or "utf-8", errors="replace")
+        if self.fmt == "json":
+            return extract_json(_json.loads(body), self.targets)
+        return extract_html(body, self.targets)
+
+
+def extract_json(document, targets: dict) -> dict:
+    out = {}
+    for symbol, path in targets.items():
+        value = document
+        for part in path.split("."):
+            if isinstance(value, list) and part.isdigit() and int(part) < len(value):
+                value = value[int(part)]
+            elif isinstance(value, dict):
+                value = value.get(part)
+            else:
+                value = None
+            if value is None:
+                break
+        text = "" if value is None or isinstance(value, (dict, list)) else str(value).strip()
+        out[symbol] = text or None
+    return out
+
+
+class _ElementTextParser(_html_parser.HTMLParser):
+    """Collects the text inside elements whose id is wanted, like selenium's ``.text``."""
+
+    def __init__(self, ids):
+        super().__init__(convert_charrefs=True)
+        self.wanted = set(ids)
+        self.texts = {}
+        self._open = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _VOID_TAGS:
+            return
+        element_id = dict(attrs).get("id")
+        if element_id in self.wanted and element_id not in self.texts:
+            self.texts[element_id] = []
+            self._open.append((tag, element_id))
+        else:
+            self._open.append((tag, None))
+
+    def handle_endtag(self, tag):
+        for i in range(len(self._open) - 1, -1, -1):
+            if self._open[i][0] == tag:
+                del self._open[i:]
+                return
+
+    def handle_data(self, data):
+        for _tag, element_id in self._open:
+            if element_id is not None:
+                self.texts[element_id].append(data)
+
+
+def extract_html(body: str, targets: dict) -> dict:
+    parser = _ElementTextParser(targets.values())
+    parser.feed(body)
+    parser.close()
+    out = {}
+    for symbol, element_id in targets.items():
+        text = " ".join("".join(parser.texts.get(element_id, ())).split())
+        out[symbol] = text or None
+    return out
+
+
+class ScrapePlan:
+    """Sources read concurrently on a bounded pool and merged into one snapshot.
+
+    Every source gets its own deadline; one that fails or runs past it
+    contributes nothing to this cycle, so a cycle takes about as long as the
+    slowest source that answers in time rather than the sum of all of them.
+    Sources are listed in priority order: when several return a symbol, the
+    value from the earliest one wins and is attributed to it. A source whose
+    fetch from an earlier cycle is still running (past its deadline) is
+    skipped rather than started a second time alongside it.
+    """
+
+    def __init__(self, sources, max_workers: int = 4, clock=_time.monotonic):
+        self.sources = list(sources)
+        if not self.sources:
+            raise ValueError("A scrape plan needs at least one source.")
+        names = [source.name for source in self.sources]
+        if len(set(names)) != len(names):
+            raise ValueError("Scrape plan source names must be unique.")
+        self.max_workers = max(1, int(max_workers))
+        self._clock = clock
+        self._pool = None
+        self._lock = _threading.Lock()
+        self._last = None
+        self._inflight = {}
+
+    @classmethod
+    def from_env(cls) -> "ScrapePlan":
+        """``SCRAPE_PLAN_PATH`` points at a JSON list of sources; without it only bonbast is read."""
+        max_workers = int(_os.environ.get("SCRAPE_WORKERS", "4"))
+        browser_timeout = float(_os.environ.get("SCRAPE_BROWSER_TIMEOUT", str(BROWSER_TIMEOUT)))
+        path = _os.environ.get("SCRAPE_PLAN_PATH")
+        if not path:
+            return cls([Source("bonbast", BONBAST_URL, TARGETS, timeout=browser_timeout)], max_workers=max_workers)
+        with open(path, "r", encoding="utf-8") as f:
+            raw = _json.load(f)
+        sources = raw.get("sources", []) if isinstance(raw, dict) else raw
+        return cls([Source.from_dict(entry, browser_timeout) for entry in sources], max_workers=max_workers)
+
+    @property
+    def symbols(self) -> list:
+        """Union of every source's symbols, in plan order."""
+        seen = {}
+        for source in self.sources:
+            for symbol in source.targets:
+                seen.setdefault(symbol, None)
+        return list(seen)
+
+    def _executor(self) -> _futures.ThreadPoolExecutor:
+        if self._pool is None:
+            self._pool = _futures.ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="scrape")
+        return self._pool
+
+    def run(self) -> dict:
+        """Read every source once.
+
+        Returns ``{"values", "sources", "stats", "elapsed"}``: merged values
+        for every plan symbol (None when no source had it), the source each
+        value came from, and per-source ``ok`` / ``elapsed`` / ``error`` /
+        ``symbols`` read.
+        """
+        started = self._clock()
+        pool = self._executor()
+        timings = {}
+
+        def timed(source: Source) -> dict:
+            timings[source.name] = self._clock()
+            return source.fetch()
+
+        futures = []
+        for source in self.sources:
+            previous = self._inflight.get(source.name)
+            if previous is not None and not previous.done():
+                # fetch دور قبل (مثلا مرورگری که از مهلت گذشته) هنوز تمام نشده؛ دومی کنارش شروع نمی‌شود
+                futures.append((source, None))
+                continue
+            self._inflight[source.name] = pool.submit(timed, source)
+            futures.append((source, self._inflight[source.name]))
+        # منبعی که تا این لحظه حتی شروع نشده (همه‌ی workerها گیر بوده‌اند) در این دور کنار گذاشته می‌شود
+        waves = -(-len(self.sources) // self.max_workers)
+        start_by = started + waves * max(source.timeout for source in self.sources)
+        results = {}
+        stats = {}
+        for source, future in futures:
+            if future is None:
+                stats[source.name] = {"ok": False, "elapsed": 0.0, "symbols": 0, "error": "previous fetch still running"}
+                continue
+            # مهلت هر منبع از زمانی شمرده می‌شود که یک worker آن را برداشته، نه از زمان ثبت در صف
+            try:
+                while source.name not in timings and not future.done():
+                    if self._clock() >= start_by:
+                        raise _futures.TimeoutError()
+                    _futures.wait([future], timeout=0.05)
+                begun = timings.get(source.name, self._clock())
+                remaining = max(0.0, begun + source.timeout - self._clock())
+                values = future.result(timeout=remaining)
+                results[source.name] = values
+                stats[source.name] = {
+                    "ok": True,
+                    "elapsed": round(self._clock() - begun, 3),
+                    "symbols": sum(1 for value in values.values() if value is not None),
+                    "error": None,
+                }
+            except _futures.TimeoutError:
+                # رشته‌ی عقب‌مانده کارش را تمام می‌کند و منابعش (مثلا مرورگر) را خودش می‌بندد؛ نتیجه‌اش دور ریخته می‌شود
+                future.cancel()
+                stats[source.name] = {"ok": False, "elapsed": source.timeout, "symbols": 0, "error": "timeout"}
+            except Exception as exc:
+                begun = timings.get(source.name, started)
+                stats[source.name] = {
+                    "ok": False,
+                    "elapsed": round(self._clock() - begun, 3),
+                    "symbols": 0,
+                    "error": str(exc) or type(exc).__name__,
+                }
+
+        values = {symbol: None for symbol in self.symbols}
+        attribution = {}
+        for source in self.sources:
+            for symbol, value in (results.get(source.name) or {}).items():
+                if value is not None and values.get(symbol) is None:
+                    values[symbol] = value
+                    attribution[symbol] = source.name
+
+        result = {
+            "values": values,
+            "sources": attribution,
+            "stats": stats,
+            "elapsed": round(self._clock() - started, 3),
+        }
+        with self._lock:
+            self._last = {"elapsed": result["elapsed"], "stats": stats}
+        return result
+
+    def state(self) -> dict:
+        with self._lock:
+            last = self._last
+        return {
+            "workers": self.max_workers,
+            "sources": [
+                {"name": source.name, "kind": source.kind, "timeout": source.timeout, "symbols": len(source.targets)}
+                for source in self.sources
+            ],
+            "last_run": last,
+        }
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
@@ -0,0 +1,119 @@
+import os
+
+# selenium فقط در پروسه‌ای که اسکرپ می‌کند و در اولین استفاده import می‌شود
+
+# آدرس صفحه‌ای که اسکرپ می‌شود (برای بنچمارک می‌توان به سرور محلی اشاره داد)
+BONBAST_URL = os.environ.get("BONBAST_URL", "https://www.bonbast.com")
+
+# المانی که لود شدنش یعنی صفحه آماده است (دلار)
+READY_ELEMENT_ID = "usd1"
+PAGE_LOAD_TIMEOUT = 20
+
+# لیست تمام آیتم‌های موجود در عکس و ID آن‌ها در سایت Bonbast
+# کلید سمت چپ: نامی که در API می‌گیرید
+# مقدار سمت راست: ID المنت در HTML سایت
+TARGETS = {
+    # --- ارزهای اصلی (ستون چپ) ---
+    "usd": "usd1",         # دلار آمریکا
+    "eur": "eur1",         # یورو
+    "gbp": "gbp1",         # پوند انگلیس
+    "chf": "chf1",         # فرانک سوئیس
+    "cad": "cad1",         # دلار کانادا
+    "aud": "aud1",         # دلار استرالیا
+    "sek": "sek1",         # کرون سوئد
+    "nok": "nok1",         # کرون نروژ
+    "rub": "rub1",         # روبل روسیه
+    "thb": "thb1",         # بات تایلند
+    "sgd": "sgd1",         # دلار سنگاپور
+    "hkd": "hkd1",         # دلار هنگ کنگ
+    "azn": "azn1",         # منات آذربایجان
+    "amd": "amd1",         # درام ارمنستان
+
+    # --- ارزهای دیگر (ستون راست) ---
+    "dkk": "dkk1",         # کرون دانمارک
+    "aed": "aed1",         # درهم امارات
+    "jpy": "jpy1",         # ین ژاپن
+    "try": "try1",         # لیر ترکیه
+    "cny": "cny1",         # یوان چین
+    "sar": "sar1",         # ریال عربستان
+    "inr": "inr1",         # روپیه هند
+    "myr": "myr1",         # رینگیت مالزی
+    "afn": "afn1",         # افغانی افغانستان
+    "kwd": "kwd1",         # دینار کویت
+    "iqd": "iqd1",         # دینار عراق
+    "bhd": "bhd1",         # دینار بحرین
+    "omr": "omr1",         # ریال عمان
+    "qar": "qar1",         # ریال قطر
+
+    # --- طلا و سکه ---
+    "gold_ounce": "ounce",      # انس طلا
+    "gold_gram_18k": "gol18",   # گرم طلا ۱۸
+    "gold_mithqal": "mithqal",  # مثقال طلا
+    "coin_emami": "emami1",     # سکه امامی
+    "coin_azadi": "azadi1",     # سکه بهار آزادی (طرح قدیم)
+    "coin_half": "azadi1_2",    # نیم سکه
+    "coin_quarter": "azadi1_4", # ربع سکه
+    "coin_gram": "azadi1g",     # سکه گرمی
+    
+    # --- کریپتو (پایین صفحه) ---
+    "bitcoin": "bitcoin"        # بیت‌کوین
+}
+
+# محدوده هر scope برای فیلتر خروجی API
+SCOPE_KEYS = {
+    "currency": ["usd", "eur", "gbp", "chf", "cad", "aud", "sek", "nok", "rub", "thb", "sgd", "hkd", "azn", "amd",
+                 "dkk", "aed", "jpy", "try", "cny", "sar", "inr", "myr", "afn", "kwd", "iqd", "bhd", "omr", "qar"],
+    "crypto": ["bitcoin"],
+    "gold": ["gold_ounce", "gold_gram_18k", "gold_mithqal", "coin_emami", "coin_azadi", "coin_half", "coin_quarter", "coin_gram"],
+}
+
+
+def symbols_for_scope(scope: str) -> list:
+    if scope == "all" or not scope:
+        return list(TARGETS)
+    return list(SCOPE_KEYS.get(scope, []))
+
+
+def create_driver():
+    from selenium import webdriver
+    from selenium.webdriver.chrome.options import Options
+
+    options = Options()
+    options.add_argument("--headless")
+    options.add_argument("--no-sandbox")
+    options.add_argument("--disable-dev-shm-usage")
+    options.add_argument("--disable-gpu")
+    options.page_load_strategy = 'eager'
+    prefs = {"profile.managed_default_content_settings.images": 2}
+    options.add_experimental_option("prefs", prefs)
+    return webdriver.Chrome(options=options)
+
+
+def load_page(driver, url: str = BONBAST_URL) -> None:
+    driver.get(url)
+
+
+def wait_until_ready(driver, timeout: float = PAGE_LOAD_TIMEOUT, element_id: str = READY_ELEMENT_ID) -> None:
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+
+    # صبر برای لود شدن حداقل یکی از المان‌های اصلی (مثلا دلار)
+    wait = WebDriverWait(driver, timeout)
+    wait.until(EC.presence_of_element_located((By.ID, element_id)))
+
+
+def extract_prices(driver, targets: dict | None = None) -> dict:
+    """Read every ``targets`` element (default TARGETS); symbols that could not be read map to None."""
+    from selenium.common.exceptions import NoSuchElementException, StaleElementReferenceException
+    from selenium.webdriver.common.by import By
+
+    temp_data = {}
+    # حلقه برای گرفتن تمام آیتم‌های تعریف شده در دیکشنری TARGETS
+    for api_key, html_id in (TARGETS if targets is None else targets).items():
+        try:
+            text = driver.find_element(By.ID, html_id).text.strip()
+        except (NoSuchElementException, StaleElementReferenceException):
+            text = ""
+        temp_data[api_key] = text or None
+    return temp_data
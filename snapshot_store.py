@@ -0,0 +1,38 @@
+import json as _json
+import logging as _logging
+import os as _os
+import tempfile as _tempfile
+
+
+def save_snapshot(path: str, snapshot: dict) -> None:
+    """Write ``snapshot`` as JSON atomically (temp file + fsync + rename)."""
+    directory = _os.path.dirname(path) or "."
+    _os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = _tempfile.mkstemp(prefix=".snapshot-", suffix=".tmp", dir=directory)
+    try:
+        with _os.fdopen(fd, "wb") as f:
+            f.write(_json.dumps(snapshot, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+            f.flush()
+            _os.fsync(f.fileno())
+        _os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            _os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def load_snapshot(path: str) -> dict | None:
+    """Return the last persisted snapshot, or None if missing or unreadable."""
+    try:
+        with open(path, "rb") as f:
+            snapshot = _json.loads(f.read())
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as exc:
+        _logging.warning("Ignoring unreadable snapshot %s", path, exc_info=exc)
+        return None
+    if not isinstance(snapshot, dict) or not isinstance(snapshot.get("data"), dict):
+        return None
+    return snapshot
@@ -0,0 +1,54 @@
+class SelectionError(ValueError):
+    """A ``symbols=`` selection that cannot be served; ``status`` is the HTTP status to answer with."""
+
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+
+class SymbolSelector:
+    """Symbol selections as bitmasks over one fixed symbol order.
+
+    Each scope is itself a mask, so checking a selection against a key's
+    scope and recognising a selection that is exactly a scope are both a
+    single integer comparison. Masks are also what body caches are keyed by.
+    """
+
+    def __init__(self, symbols, scopes: dict):
+        self.order = list(symbols)
+        self.bits = {symbol: 1 << i for i, symbol in enumerate(self.order)}
+        self.all_mask = (1 << len(self.order)) - 1
+        self.scope_masks = {"all": self.all_mask}
+        for scope, members in scopes.items():
+            self.scope_masks[scope] = self.mask(s for s in members if s in self.bits)
+
+    def mask(self, symbols) -> int:
+        mask = 0
+        for symbol in symbols:
+            mask |= self.bits[symbol]
+        return mask
+
+    def parse(self, raw: str, scope: str = "all") -> int:
+        """Mask for a comma separated ``symbols=`` value, checked against ``scope``."""
+        names = [name.strip().lower() for name in (raw or "").split(",") if name.strip()]
+        if not names:
+            raise SelectionError("symbols must name at least one symbol.")
+        unknown = [name for name in names if name not in self.bits]
+        if unknown:
+            raise SelectionError(f"Unknown symbols: {', '.join(sorted(set(unknown)))}.")
+        mask = self.mask(names)
+        allowed = self.scope_masks.get(scope or "all", 0)
+        if mask & ~allowed:
+            outside = self.symbols(mask & ~allowed)
+            raise SelectionError(f"Symbols outside this key's scope: {', '.join(outside)}.", status=403)
+        return mask
+
+    def symbols(self, mask: int) -> list:
+        return [symbol for symbol in self.order if mask & self.bits[symbol]]
+
+    def scope_for(self, mask: int) -> str | None:
+        """The scope whose symbols are exactly ``mask``, if any."""
+        for scope, scope_mask in self.scope_masks.items():
+            if scope_mask == mask:
+                return scope
+        return None
@@ -0,0 +1,406 @@
+import collections as _collections
+import concurrent.futures as _futures
+import hashlib as _hashlib
+import heapq as _heapq
+import hmac as _hmac
+import http.client as _http_client
+import ipaddress as _ipaddress
+import itertools as _itertools
+import json as _json
+import logging as _logging
+import os as _os
+import random as _random
+import socket as _socket
+import sqlite3 as _sqlite3
+import threading as _threading
+import time as _time
+import urllib.parse as _urlparse
+import uuid as _uuid
+
+SIGNATURE_HEADER = "X-Bonbast-Signature"
+TIMESTAMP_HEADER = "X-Bonbast-Timestamp"
+EVENT_PRICES_UPDATED = "prices.updated"
+
+# کدهایی که تکرار ارسال برایشان فایده ندارد
+_PERMANENT_STATUSES = frozenset({400, 401, 403, 404, 405, 410, 413, 422})
+
+
+class WebhookURLError(ValueError):
+    """A webhook url that must not be registered or delivered to."""
+
+
+def private_addresses_allowed() -> bool:
+    """WEBHOOK_ALLOW_PRIVATE=1 lets webhooks target private/loopback hosts (local testing only)."""
+    return _os.environ.get("WEBHOOK_ALLOW_PRIVATE", "").strip().lower() in ("1", "true", "yes", "on")
+
+
+def _is_public_address(address: str) -> bool:
+    ip = _ipaddress.ip_address(address.split("%", 1)[0])
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+def resolve_webhook_url(url: str, *, allow_private: bool = False) -> tuple:
+    """``(scheme, host, port, address)`` to deliver ``url`` to; raises WebhookURLError.
+
+    Every address the host resolves to must be public (not loopback,
+    private, link-local, shared or reserved), otherwise customers could make
+    the server POST to internal services and read the outcome back from the
+    dead letters. Non-ASCII, whitespace and control characters are rejected
+    rather than guessed at; such urls must be percent-encoded (and IDN hosts
+    given in punycode) before they are registered.
+    """
+    if not url.isascii() or any(ch <= " " or ch == "\x7f" for ch in url):
+        raise WebhookURLError("The url must be percent-encoded ASCII without spaces or control characters.")
+    parts = _urlparse.urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise WebhookURLError("A valid http(s) url is required.")
+    try:
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+    except ValueError:
+        raise WebhookURLError("The url has an invalid port.") from None
+    try:
+        infos = _socket.getaddrinfo(parts.hostname, port, type=_socket.SOCK_STREAM)
+    except (OSError, UnicodeError):
+        raise WebhookURLError("The url's host does not resolve.") from None
+    addresses = [info[4][0] for info in infos]
+    if not addresses or not (allow_private or all(_is_public_address(a) for a in addresses)):
+        raise WebhookURLError("Webhook urls must point to a public address.")
+    return parts.scheme, parts.hostname, port, addresses[0]
+
+
+def sign_payload(secret: str, timestamp: str, body: bytes) -> str:
+    digest = _hmac.new(secret.encode("utf-8"), timestamp.encode("ascii") + b"." + body, _hashlib.sha256).hexdigest()
+    return f"sha256={digest}"
+
+
+def verify_signature(secret: str, timestamp: str, body: bytes, signature: str) -> bool:
+    return _hmac.compare_digest(sign_payload(secret, timestamp, body), signature or "")
+
+
+def load_endpoints(db: _sqlite3.Connection) -> list:
+    rows = db.execute(
+        """
+        SELECT webhooks.id, webhooks.url, webhooks.secret, plans.scope
+        FROM webhooks
+        JOIN api_keys ON api_keys.id = webhooks.api_key_id
+        JOIN plans ON plans.id = api_keys.plan_id
+        WHERE webhooks.active = 1 AND api_keys.status = 'active' AND plans.active = 1;
+        """
+    ).fetchall()
+    return [{"id": int(r[0]), "url": r[1], "secret": r[2], "scope": r[3] or "all"} for r in rows]
+
+
+class _HostLane:
+    """Per-host concurrency limit, pending deliveries and idle keep-alive connections."""
+
+    __slots__ = ("in_flight", "pending", "idle")
+
+    def __init__(self):
+        self.in_flight = 0
+        self.pending = _collections.deque()
+        self.idle = []
+
+
+class WebhookDispatcher:
+    """Fan out signed snapshot payloads to customer webhooks.
+
+    ``publish()`` only enqueues and returns, so the scraper never waits on
+    receivers. A coordinator thread loads the active endpoints, renders one
+    body per scope, and feeds a bounded thread pool. Each receiving host gets
+    at most ``per_host_limit`` concurrent deliveries over reused keep-alive
+    connections; failures are retried with jittered exponential backoff and
+    land in ``webhook_dead_letters`` after ``max_attempts``. If a newer
+    snapshot is published before the previous one was handed out, only the
+    newest is delivered.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        *,
+        max_workers: int = 32,
+        per_host_limit: int = 8,
+        max_attempts: int = 5,
+        backoff_base: float = 1.0,
+        backoff_max: float = 60.0,
+        timeout: float = 5.0,
+        allow_private: bool = False,
+    ):
+        self.db_path = db_path
+        self.per_host_limit = max(1, per_host_limit)
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.allow_private = allow_private
+
+        self._pool = _futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="webhook")
+        self._lock = _threading.Lock()
+        self._lanes = {}
+        self._wakeup = _threading.Condition(self._lock)
+        self._latest = None
+        self._retries = []
+        self._retry_seq = _itertools.count()
+        self._dead_letters = []
+        self._running = False
+        self._thread = None
+        self.stats = _collections.Counter()
+
+    @classmethod
+    def from_env(cls, db_path: str) -> "WebhookDispatcher":
+        env = _os.environ.get
+        return cls(
+            db_path,
+            max_workers=int(env("WEBHOOK_MAX_WORKERS", "32")),
+            per_host_limit=int(env("WEBHOOK_PER_HOST_LIMIT", "8")),
+            max_attempts=int(env("WEBHOOK_MAX_ATTEMPTS", "5")),
+            backoff_base=float(env("WEBHOOK_BACKOFF_BASE", "1")),
+            backoff_max=float(env("WEBHOOK_BACKOFF_MAX", "60")),
+            timeout=float(env("WEBHOOK_TIMEOUT", "5")),
+            allow_private=private_addresses_allowed(),
+        )
+
+    def start(self) -> None:
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+        self._thread = _threading.Thread(target=self._run, name="webhook-dispatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self, wait: bool = True) -> None:
+        with self._lock:
+            self._running = False
+            self._wakeup.notify_all()
+        if self._thread is not None and wait:
+            self._thread.join()
+        self._pool.shutdown(wait=wait)
+        self._flush_dead_letters()
+
+    def publish(self, render_body, event: str = EVENT_PRICES_UPDATED) -> None:
+        """Queue one snapshot; ``render_body(scope) -> bytes`` is called once per scope."""
+        with self._lock:
+            if self._latest is not None:
+                self.stats["superseded"] += 1
+            self._latest = (event, render_body)
+            self._wakeup.notify()
+
+    # --- coordinator -------------------------------------------------------
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                while self._running and self._latest is None and not self._dead_letters and not self._due_retries_locked():
+                    timeout = self._retries[0][0] - _time.monotonic() if self._retries else None
+                    self._wakeup.wait(timeout if timeout is None else max(0.0, timeout))
+                if not self._running:
+                    return
+                job, self._latest = self._latest, None
+                due = self._pop_due_retries_locked()
+            for delivery in due:
+                self._schedule(delivery)
+            if job is not None:
+                try:
+                    self._fan_out(*job)
+                except Exception as exc:  # pragma: no cover - keep the coordinator alive
+                    _logging.error("Webhook fan-out failed", exc_info=exc)
+            self._flush_dead_letters()
+
+    def _fan_out(self, event: str, render_body) -> None:
+        db = _sqlite3.connect(self.db_path, timeout=5)
+        try:
+            endpoints = load_endpoints(db)
+        finally:
+            db.close()
+        bodies = {}
+        for endpoint in endpoints:
+            scope = endpoint["scope"]
+            if scope not in bodies:
+                bodies[scope] = render_body(scope)
+            delivery = {
+                "endpoint": endpoint,
+                "event": event,
+                "body": bodies[scope],
+                "delivery_id": _uuid.uuid4().hex,
+                "attempt": 1,
+                "last_error": None,
+            }
+            # خرابی یک endpoint نباید ارسال به بقیه را متوقف کند
+            try:
+                self._schedule(delivery)
+            except WebhookURLError as exc:
+                self._give_up(delivery, str(exc))
+            except Exception as exc:
+                _logging.error("Could not schedule webhook %s", endpoint["id"], exc_info=exc)
+                self._give_up(delivery, "Delivery could not be scheduled.")
+        with self._lock:
+            self.stats["fan_outs"] += 1
+            self.stats["queued"] += len(endpoints)
+
+    def _due_retries_locked(self) -> bool:
+        return bool(self._retries) and self._retries[0][0] <= _time.monotonic()
+
+    def _pop_due_retries_locked(self) -> list:
+        now = _time.monotonic()
+        due = []
+        while self._retries and self._retries[0][0] <= now:
+            due.append(_heapq.heappop(self._retries)[2])
+        return due
+
+    # --- per-host scheduling -----------------------------------------------
+
+    @staticmethod
+    def _host_key(url: str) -> tuple:
+        parts = _urlparse.urlsplit(url)
+        try:
+            port = parts.port or (443 if parts.scheme == "https" else 80)
+        except ValueError:
+            raise WebhookURLError("The url has an invalid port.") from None
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise WebhookURLError("A valid http(s) url is required.")
+        return parts.scheme, parts.hostname, port
+
+    def _schedule(self, delivery: dict) -> None:
+        key = self._host_key(delivery["endpoint"]["url"])
+        with self._lock:
+            lane = self._lanes.setdefault(key, _HostLane())
+            if lane.in_flight >= self.per_host_limit:
+                lane.pending.append(delivery)
+                return
+            lane.in_flight += 1
+        self._pool.submit(self._deliver_loop, key, delivery)
+
+    def _deliver_loop(self, key: tuple, delivery: dict) -> None:
+        # این ترد تا خالی شدن صف همان میزبان ادامه می‌دهد تا سهم هم‌زمانی‌اش آزاد نشود
+        try:
+            while delivery is not None:
+                self._attempt(key, delivery)
+                with self._lock:
+                    lane = self._lanes[key]
+                    if lane.pending:
+                        delivery = lane.pending.popleft()
+                    else:
+                        lane.in_flight -= 1
+                        delivery = None
+        finally:
+            # اگر ترد با خطا بیرون رفت، سهم میزبان باید آزاد شود وگرنه بقیه‌ی endpointهای آن میزبان برای همیشه منتظر می‌مانند
+            if delivery is not None:
+                with self._lock:
+                    self._lanes[key].in_flight -= 1
+
+    def _attempt(self, key: tuple, delivery: dict) -> None:
+        endpoint = delivery["endpoint"]
+        try:
+            timestamp = str(int(_time.time()))
+            headers = {
+                "Content-Type": "application/json",
+                "User-Agent": "bonbast-api-webhooks/1",
+                "X-Bonbast-Event": delivery["event"],
+                "X-Bonbast-Delivery": delivery["delivery_id"],
+                "X-Bonbast-Attempt": str(delivery["attempt"]),
+                TIMESTAMP_HEADER: timestamp,
+                SIGNATURE_HEADER: sign_payload(endpoint["secret"], timestamp, delivery["body"]),
+            }
+            status = self._post(key, endpoint["url"], delivery["body"], headers)
+        except WebhookURLError as exc:
+            self._give_up(delivery, str(exc))
+            return
+        except (OSError, _http_client.HTTPException) as exc:
+            status, error = None, f"{type(exc).__name__}: {exc}"
+        except Exception as exc:
+            # خطای غیرمنتظره (مثلا url ثبت‌شده‌ی قدیمی با کاراکتر غیر ASCII) با تکرار درست نمی‌شود
+            _logging.error("Webhook %s delivery failed", endpoint["id"], exc_info=exc)
+            self._give_up(delivery, f"{type(exc).__name__}: {exc}")
+            return
+        else:
+            error = None if 200 <= status < 300 else f"HTTP {status}"
+
+        if error is None:
+            with self._lock:
+                self.stats["delivered"] += 1
+            return
+        if status in _PERMANENT_STATUSES or delivery["attempt"] >= self.max_attempts:
+            self._give_up(delivery, error)
+            return
+        delivery["last_error"] = error
+        cap = min(self.backoff_max, self.backoff_base * (2 ** (delivery["attempt"] - 1)))
+        delivery["attempt"] += 1
+        with self._lock:
+            self.stats["retried"] += 1
+            _heapq.heappush(self._retries, (_time.monotonic() + _random.uniform(0, cap), next(self._retry_seq), delivery))
+            self._wakeup.notify()
+
+    def _give_up(self, delivery: dict, error: str) -> None:
+        delivery["last_error"] = error
+        with self._lock:
+            self.stats["dead_lettered"] += 1
+            self._dead_letters.append(delivery)
+            self._wakeup.notify()
+
+    def _post(self, key: tuple, url: str, body: bytes, headers: dict) -> int:
+        scheme, host, port = key
+        parts = _urlparse.urlsplit(url)
+        path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        with self._lock:
+            lane = self._lanes[key]
+            conn = lane.idle.pop() if lane.idle else None
+        if conn is None:
+            # آدرس همین‌جا دوباره resolve و بررسی می‌شود و اتصال به همان IP می‌رود تا
+            # تغییر DNS بعد از ثبت (DNS rebinding) راهی به شبکه‌ی داخلی باز نکند
+            address = resolve_webhook_url(url, allow_private=self.allow_private)[3]
+            cls = _http_client.HTTPSConnection if scheme == "https" else _http_client.HTTPConnection
+            conn = cls(host, port, timeout=self.timeout)
+            conn._create_connection = lambda addr, *args: _socket.create_connection((address, addr[1]), *args)
+        try:
+            conn.request("POST", path, body=body, headers=headers)
+            response = conn.getresponse()
+            response.read()
+        except BaseException:
+            conn.close()
+            raise
+        if response.will_close:
+            conn.close()
+        else:
+            with self._lock:
+                self._lanes[key].idle.append(conn)
+        return response.status
+
+    # --- dead letters -------------------------------------------------------
+
+    def _flush_dead_letters(self) -> None:
+        with self._lock:
+            batch, self._dead_letters = self._dead_letters, []
+        if not batch:
+            return
+        now = _time.strftime("%Y-%m-%dT%H:%M:%SZ", _time.gmtime())
+        db = _sqlite3.connect(self.db_path, timeout=30)
+        try:
+            db.executemany(
+                """
+                INSERT INTO webhook_dead_letters (webhook_id, delivery_id, event, payload, attempts, last_error, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?);
+                """,
+                [
+                    (
+                        d["endpoint"]["id"],
+                        d["delivery_id"],
+                        d["event"],
+                        d["body"].decode("utf-8"),
+                        d["attempt"],
+                        d["last_error"],
+                        now,
+                    )
+                    for d in batch
+                ],
+            )
+            db.commit()
+        except _sqlite3.Error as exc:
+            _logging.error("Could not record %d webhook dead letters", len(batch), exc_info=exc)
+        finally:
+            db.close()
+
+
+def render_prices_body(event: str, payload: dict) -> bytes:
+    return _json.dumps({"event": event, **payload}, ensure_ascii=False, separators=(",", ":")).encode("utf-8")